@@ -0,0 +1,106 @@
+from array import array
+from bisect import bisect_right
+
+
+__all__ = ['Arrangement', 'Track']
+
+
+class Track(object):
+    # One sequencer's part of a song: sections in play order, each a shared
+    # Pattern played repeats times. Positions are in the sequencer's own
+    # steps from the top of the song, and starts holds where each section
+    # starts (with the track's length last), so finding what plays at any
+    # position is one bisect however many sections there are.
+    def __init__(self, sequencer, sections=()):
+        self.sequencer = sequencer
+        self.patterns = []
+        self.repeats = array('I')
+        self.starts = array('Q', [0])
+        self.muted = False
+        self.soloed = False
+        for pattern, repeats in sections:
+            self.append(pattern, repeats)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @property
+    def length(self):
+        return self.starts[-1]
+
+    def append(self, pattern, repeats=1):
+        self.insert(len(self.patterns), pattern, repeats)
+
+    def insert(self, index, pattern, repeats=1):
+        if repeats < 1:
+            raise ValueError('Sections play at least once, not {} times'.format(repeats))
+        self.patterns.insert(index, pattern)
+        self.repeats.insert(index, repeats)
+        self.starts.insert(index + 1, 0)
+        self._update_starts(index)
+
+    def remove(self, index):
+        del self.patterns[index]
+        del self.repeats[index]
+        del self.starts[index + 1]
+        self._update_starts(index)
+
+    def set_repeats(self, index, repeats):
+        if repeats < 1:
+            raise ValueError('Sections play at least once, not {} times'.format(repeats))
+        self.repeats[index] = repeats
+        self._update_starts(index)
+
+    def _update_starts(self, index):
+        # Only sections from index on move
+        starts = self.starts
+        patterns = self.patterns
+        repeats = self.repeats
+        for section in range(index, len(patterns)):
+            starts[section + 1] = starts[section] + len(patterns[section]) * repeats[section]
+
+    def section_at(self, position):
+        # Index of the section playing at position, None outside the song
+        if position < 0 or position >= self.starts[-1]:
+            return None
+        return bisect_right(self.starts, position) - 1
+
+    def step_id(self, section, position):
+        # Step of the section's pattern that plays at position
+        return (position - self.starts[section]) % len(self.patterns[section])
+
+    def __repr__(self):
+        return u'<Track sequencer={}, sections={}, length={}>'.format(self.sequencer.id, len(self), self.length)
+
+
+class Arrangement(object):
+    # A song: a Track per sequencer, all starting together. Muting a track
+    # silences it; once any track is soloed only soloed tracks play. Both
+    # can change while the song plays. PolymeterClock plays arrangements
+    # with an ArrangementScheduler, see there for how sections change.
+    def __init__(self, tracks=()):
+        self.tracks = list(tracks)
+
+    @property
+    def sequencers(self):
+        return [track.sequencer for track in self.tracks]
+
+    def add_track(self, sequencer, sections=()):
+        track = Track(sequencer, sections)
+        self.tracks.append(track)
+        return track
+
+    def track(self, sequencer):
+        for track in self.tracks:
+            if track.sequencer is sequencer:
+                return track
+        raise ValueError('{} is not arranged'.format(sequencer))
+
+    def audible(self, track):
+        if track.muted:
+            return False
+        return track.soloed or not any(other.soloed for other in self.tracks)
+
+    def length(self):
+        # In beats, to the end of the longest track
+        return max([float(track.length) / track.sequencer.beat_subdivision for track in self.tracks] or [0.0])
@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clock import PlaybackClock  # noqa: E402
+from sequencer import Sequencer  # noqa: E402
+
+
+def run(bpm, subdivision, seconds, sequencer_count=8):
+    sequencers = [
+        Sequencer(id=_id, bars=1, beats_per_bar=4, steps_per_beat=subdivision)
+        for _id in range(sequencer_count)
+    ]
+    interval = 60.0 / (bpm * subdivision)
+    clock = PlaybackClock(sequencers, interval)
+    clock.start()
+    time.sleep(seconds)
+    clock.stop()
+    return interval, clock.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure playback clock jitter and drift')
+    parser.add_argument('--bpm', type=float, default=300)
+    parser.add_argument('--subdivision', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    interval, report = run(args.bpm, args.subdivision, args.seconds)
+    print('interval: {:.6f}s'.format(interval))
+    for key, value in sorted(report.as_dict().items()):
+        print('{}: {}'.format(key, value))
+    if report.max_error >= 0.001:
+        print('FAIL: worst tick was {:.6f}s late'.format(report.max_error))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import argparse
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persistence import SessionFile, export_json, import_json, save_session  # noqa: E402
+from sequencer import Sequencer  # noqa: E402
+
+
+def build(pattern_count):
+    rng = random.Random(0)
+    sequencers = []
+    for _id in range(pattern_count):
+        sequencer = Sequencer(_id, bars=4, beats_per_bar=4, steps_per_beat=4, midi_channel=_id % 16)
+        for step_id in range(0, sequencer.step_count, 2):
+            sequencer.set_note_for_step(step_id, rng.randrange(128))
+        sequencers.append(sequencer)
+    return sequencers
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare session load times for binary, pickle and JSON')
+    parser.add_argument('--patterns', type=int, default=10000)
+    args = parser.parse_args()
+
+    sequencers = build(args.patterns)
+    directory = tempfile.mkdtemp()
+    try:
+        binary_path = os.path.join(directory, 'library.pyseq')
+        pickle_path = os.path.join(directory, 'library.pickle')
+        json_path = os.path.join(directory, 'library.json')
+        save_session(binary_path, sequencers)
+        with open(pickle_path, 'wb') as fp:
+            pickle.dump(sequencers, fp, pickle.HIGHEST_PROTOCOL)
+        with open(json_path, 'w') as fp:
+            export_json(sequencers, fp)
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as fp:
+                return pickle.load(fp)
+
+        def load_json():
+            with open(json_path) as fp:
+                return import_json(fp)
+
+        def open_binary_and_load_one():
+            with SessionFile(binary_path) as session:
+                return session.load(len(session) // 2)
+
+        def load_binary():
+            with SessionFile(binary_path) as session:
+                return session.load_all()
+
+        for label, function in (
+            ('binary, one pattern', open_binary_and_load_one),
+            ('binary, all patterns', load_binary),
+            ('pickle, all patterns', load_pickle),
+            ('json, all patterns', load_json),
+        ):
+            seconds, _ = timed(function)
+            print('{:>22}: {:>9.4f}s'.format(label, seconds))
+        for path in (binary_path, pickle_path, json_path):
+            print('{:>22}: {:>9.1f} KiB'.format(os.path.basename(path), os.path.getsize(path) / 1024.0))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
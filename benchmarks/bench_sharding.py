@@ -0,0 +1,61 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sequencer import Sequencer  # noqa: E402
+from sharding import ShardedEngine  # noqa: E402
+
+
+def build(track_count):
+    sequencers = []
+    for _id in range(track_count):
+        sequencer = Sequencer(_id, bars=4, beats_per_bar=4, steps_per_beat=4, midi_channel=_id % 16)
+        for step_id in range(_id % 4, sequencer.step_count, 4):
+            sequencer.set_note_for_step(step_id, 36 + (_id + step_id) % 48)
+        sequencers.append(sequencer)
+    return sequencers
+
+
+def serial_rate(track_count, ticks):
+    sequencers = build(track_count)
+    started = time.perf_counter()
+    for _ in range(ticks):
+        for sequencer in sequencers:
+            sequencer.advance()
+    return ticks / (time.perf_counter() - started)
+
+
+def sharded_rate(track_count, ticks, workers):
+    engine = ShardedEngine(build(track_count), workers=workers)
+    engine.start()
+    try:
+        started = time.perf_counter()
+        for _ in range(ticks):
+            engine.collect()
+        return ticks / (time.perf_counter() - started)
+    finally:
+        engine.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial and sharded sequencer ticking')
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--tracks', type=int, nargs='+', default=[8, 64, 512, 4096])
+    args = parser.parse_args()
+
+    print('{:>6} {:>14} {:>14}'.format('tracks', 'serial ticks/s', 'sharded ticks/s'))
+    for track_count in args.tracks:
+        print('{:>6} {:>14.0f} {:>14.0f}'.format(
+            track_count,
+            serial_rate(track_count, args.ticks),
+            sharded_rate(track_count, args.ticks, args.workers),
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import gc
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sequencer import MAXIMUM_BARS, Note, Sequencer  # noqa: E402
+
+
+class DictSequencer(Sequencer):
+    # The dict of Note objects layout Sequencer used before StepStore
+    def update_step_count(self):
+        self.step_count = self.bars * self.beats_per_bar * self.beat_subdivision
+        self.steps = dict((step_id, Note(None)) for step_id in range(self.step_count))
+
+    def tick(self, delta):
+        self.active_step += 1
+        if self.active_step > (self.step_count - 1):
+            self.active_step = 0
+        self.process_step(self.steps[self.active_step])
+
+    def set_note_for_step(self, step_id, value=None):
+        self.steps[step_id].value = value
+        self.steps[step_id].is_hold = False
+
+
+def build(sequencer_class, count):
+    sequencers = []
+    for _id in range(count):
+        sequencer = sequencer_class(_id, bars=MAXIMUM_BARS, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+        for step_id in range(0, sequencer.step_count, 4):
+            sequencer.set_note_for_step(step_id, 36 + (step_id % 24))
+        sequencers.append(sequencer)
+    return sequencers
+
+
+def measure_memory(sequencer_class, count):
+    gc.collect()
+    tracked_before = len(gc.get_objects())
+    tracemalloc.start()
+    sequencers = build(sequencer_class, count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracked = len(gc.get_objects()) - tracked_before
+    del sequencers
+    return size, tracked
+
+
+def measure_ticks(sequencer_class, count, ticks):
+    sequencers = build(sequencer_class, count)
+
+    def run():
+        for sequencer in sequencers:
+            sequencer.tick(None)
+
+    seconds = min(timeit.repeat(run, number=ticks, repeat=3))
+    return (count * ticks) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare dict of Note against StepStore step storage')
+    parser.add_argument('--patterns', type=int, default=500)
+    parser.add_argument('--ticks', type=int, default=200)
+    args = parser.parse_args()
+
+    for label, sequencer_class in (('dict', DictSequencer), ('array', Sequencer)):
+        size, tracked = measure_memory(sequencer_class, args.patterns)
+        rate = measure_ticks(sequencer_class, args.patterns, args.ticks)
+        print('{:>6}: {:>10.1f} KiB, {:>7} gc tracked objects, {:>12.0f} ticks/s'.format(
+            label, size / 1024.0, tracked, rate
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sequencer import Sequencer  # noqa: E402
+from step_grid import StepGridWindow  # noqa: E402
+
+
+class CountingWidget(object):
+    writes = 0
+
+    def __init__(self, **properties):
+        self.__dict__.update(properties)
+
+    def __setattr__(self, name, value):
+        CountingWidget.writes += 1
+        object.__setattr__(self, name, value)
+
+
+def build_step_widgets(steps_per_bar):
+    return [
+        CountingWidget(step_id=step_id, children=[
+            CountingWidget(note_offset_id=note_offset_id, background_color=[1, 1, 1, 1], text='', state='normal')
+            for note_offset_id in reversed(range(11))
+        ])
+        for step_id in range(steps_per_bar)
+    ]
+
+
+def full_refresh(step_widgets, sequencer, octave, bar):
+    # SequencerView._update_step_view before dirty tracking
+    current_octave_start = octave * 12
+    current_note_range = range(current_octave_start, current_octave_start + 12)
+    current_bar_start = bar * sequencer.steps_per_bar
+    current_step_range = range(current_bar_start, current_bar_start + sequencer.steps_per_bar)
+    for step_widget in step_widgets:
+        sequencer_step_note_id = sequencer.steps[step_widget.step_id].value
+        if step_widget.step_id != sequencer.active_step:
+            color = [1, 1, 1, 1]
+        else:
+            color = [.5, .5, .5, 1]
+        for step_button in step_widget.children:
+            computed_button_note_id = (octave * 12) + step_button.note_offset_id
+            step_button.background_color = color
+            step_button.text = '({})'.format(computed_button_note_id)
+            step_button.state = 'normal'
+            if sequencer_step_note_id in current_note_range:
+                if computed_button_note_id == sequencer_step_note_id:
+                    if step_widget.step_id in current_step_range:
+                        step_button.state = 'down'
+
+
+def run(ticks, dirty_tracking):
+    sequencer = Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+    for step_id in range(0, sequencer.step_count, 2):
+        sequencer.set_note_for_step(step_id, 24 + step_id % 11)
+    step_widgets = build_step_widgets(sequencer.steps_per_bar)
+    window = StepGridWindow(sequencer.steps_per_bar)
+
+    CountingWidget.writes = 0
+    for _ in range(ticks):
+        sequencer.tick(None)
+        if dirty_tracking:
+            # Each changed cell is one Color write on the grid's canvas
+            CountingWidget.writes += len(window.refresh(sequencer, 2, 0))
+        else:
+            full_refresh(step_widgets, sequencer, 2, 0)
+    return CountingWidget.writes / float(ticks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count step grid property writes per tick')
+    parser.add_argument('--ticks', type=int, default=1000)
+    args = parser.parse_args()
+    print('full refresh: {:.1f} writes/tick'.format(run(args.ticks, False)))
+    print('dirty refresh: {:.1f} writes/tick'.format(run(args.ticks, True)))
+
+
+if __name__ == '__main__':
+    main()
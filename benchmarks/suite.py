@@ -0,0 +1,469 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from arrangement import Arrangement  # noqa: E402
+from cli import HEADLESS_MODULES  # noqa: E402
+from history import EditHistory  # noqa: E402
+from midi_engine import encode_message  # noqa: E402
+from recorder import NoteRecorder  # noqa: E402
+from pattern import Pattern  # noqa: E402
+from scheduler import ArrangementScheduler, StepScheduler  # noqa: E402
+from sequencer import MAXIMUM_BARS, Note, Sequencer  # noqa: E402
+from step_grid import StepGridWindow  # noqa: E402
+from steps import StepStore  # noqa: E402
+from tempo import TempoMap  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SONG_SECTIONS = 10000
+STARTUP_BUDGET = 0.1        # Seconds the headless modules may take to import from cold
+STARTUP_RUNS = 10           # Cold starts measured at least, the fastest counts
+BASELINE_RUNS = 9           # Runs of the suite, each in its own interpreter, --update-baseline records from
+HIGHER_IS_BETTER = 'higher'
+LOWER_IS_BETTER = 'lower'
+# Tolerances of results that swing further than --tolerance from run to
+# run however they're measured (a cold import depends on what the OS has
+# cached), still far tighter than any real regression
+TOLERANCES = {'startup.headless_import.seconds': 1.0}
+
+cases = []
+
+
+def case(function):
+    cases.append(function)
+    return function
+
+
+def best_rate(function, number, repeat):
+    # Operations per second from the fastest of several runs, the least
+    # noisy number timeit can give us
+    return number / min(timeit.repeat(function, number=number, repeat=repeat))
+
+
+def build_sequencer(bars=1, density=4, seed=0):
+    rng = random.Random(seed)
+    sequencer = Sequencer(0, bars=bars, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+    for step_id in range(0, sequencer.step_count, density):
+        sequencer.set_note_for_step_range(step_id, step_id + rng.randrange(density), 36 + rng.randrange(48))
+    return sequencer
+
+
+@case
+def tick(repeat):
+    sequencer = build_sequencer()
+    return {'tick.ticks_per_second': (best_rate(lambda: sequencer.tick(None), 20000, repeat), HIGHER_IS_BETTER)}
+
+
+@case
+def tick_scaling(repeat):
+    results = {}
+    for bars in range(1, MAXIMUM_BARS + 1):
+        sequencer = build_sequencer(bars)
+        results['tick_scaling.bars_{}.ticks_per_second'.format(bars)] = (
+            best_rate(lambda: sequencer.tick(None), 20000, repeat), HIGHER_IS_BETTER
+        )
+    return results
+
+
+@case
+def process_step(repeat):
+    sequencer = build_sequencer()
+    note = Note(60)
+    return {
+        'process_step.calls_per_second': (
+            best_rate(lambda: sequencer.process_step(note), 20000, repeat), HIGHER_IS_BETTER
+        )
+    }
+
+
+@case
+def edits(repeat):
+    sequencer = build_sequencer(MAXIMUM_BARS)
+    rng = random.Random(1)
+    step_ids = [rng.randrange(sequencer.step_count - 8) for _ in range(1000)]
+    positions = iter(step_ids * 1000)
+
+    def set_note():
+        sequencer.set_note_for_step(next(positions), 60)
+
+    def set_range():
+        step_id = next(positions)
+        sequencer.clear_note_for_step(step_id)
+        sequencer.set_note_for_step_range(step_id, step_id + 4, 60)
+
+    def clear_note():
+        sequencer.clear_note_for_step(next(positions))
+
+    return {
+        'edits.set_note_for_step.seconds': (1.0 / best_rate(set_note, 1000, repeat), LOWER_IS_BETTER),
+        'edits.set_note_for_step_range.seconds': (1.0 / best_rate(set_range, 1000, repeat), LOWER_IS_BETTER),
+        'edits.clear_note_for_step.seconds': (1.0 / best_rate(clear_note, 1000, repeat), LOWER_IS_BETTER),
+    }
+
+
+@case
+def bulk_edits(repeat):
+    # Steps rewritten per second by whole-pattern bulk edits, each patching
+    # the timeline and notifying once
+    sequencer = build_sequencer(MAXIMUM_BARS)
+    step_count = sequencer.step_count
+    semitones = iter([1, -1] * 100000)
+
+    def transpose():
+        sequencer.transpose(next(semitones))
+
+    def rotate():
+        sequencer.rotate(5)
+
+    def euclid():
+        sequencer.euclid(5, 36, 0, step_count // 2 - 1)
+
+    return {
+        'bulk_edits.transpose.steps_per_second': (step_count * best_rate(transpose, 200, repeat), HIGHER_IS_BETTER),
+        'bulk_edits.rotate.steps_per_second': (step_count * best_rate(rotate, 200, repeat), HIGHER_IS_BETTER),
+        'bulk_edits.euclid.steps_per_second': (step_count // 2 * best_rate(euclid, 200, repeat), HIGHER_IS_BETTER),
+    }
+
+
+@case
+def history(repeat):
+    # What recording deltas adds to an edit, what each one costs to keep,
+    # and undoing/redoing a whole-pattern edit as one batch
+    sequencer = build_sequencer(MAXIMUM_BARS)
+    edit_history = EditHistory()
+    edit_history.attach(sequencer)
+    rng = random.Random(2)
+    positions = iter([rng.randrange(sequencer.step_count) for _ in range(1000)] * 1000)
+    values = iter([60, 62] * 1000000)
+
+    def set_note():
+        sequencer.set_note_for_step(next(positions), next(values))
+
+    seconds = 1.0 / best_rate(set_note, 1000, repeat)
+    edit_history.clear()
+    for _ in range(100):
+        set_note()
+    bytes_per_edit = len(edit_history.ring) / 100.0
+
+    sequencer.transpose(1)
+    undone = iter([True, False] * 100000)
+
+    def undo():
+        if next(undone):
+            edit_history.undo()
+        else:
+            edit_history.redo()
+
+    return {
+        'history.set_note_for_step.seconds': (seconds, LOWER_IS_BETTER),
+        'history.bytes_per_edit': (bytes_per_edit, LOWER_IS_BETTER),
+        'history.undo_transpose.seconds': (1.0 / best_rate(undo, 200, repeat), LOWER_IS_BETTER),
+    }
+
+
+class StepPositions(object):
+    # Stands in for the playing clock, timestamps are step positions
+    def position_at(self, sequencer, timestamp):
+        return timestamp
+
+
+@case
+def record(repeat):
+    # Live input of a 32nd note drum roll over two bars, quantized and
+    # written in one batch per bar the way a UI timer would flush it
+    sequencer = build_sequencer(MAXIMUM_BARS)
+    recorder = NoteRecorder(StepPositions(), sequencer)
+    note_on = encode_message('NoteOn', 0, 38)
+    note_off = encode_message('NoteOff', 0, 38)
+    roll = [position / 2.0 for position in range(sequencer.steps_per_bar * 4)]
+
+    def record_roll():
+        for bar_roll in (roll[:len(roll) // 2], roll[len(roll) // 2:]):
+            for position in bar_roll:
+                recorder.receive(note_on, position + 0.1)
+                recorder.receive(note_off, position + 0.3)
+            recorder.flush()
+
+    return {
+        'record.drum_roll.seconds_per_note': (1.0 / (len(roll) * best_rate(record_roll, 100, repeat)), LOWER_IS_BETTER),
+    }
+
+
+@case
+def tempo_map(repeat):
+    sequencer = build_sequencer(MAXIMUM_BARS)
+    tempo_map = TempoMap(sequencer.step_count)
+    tempo_map.set_tempo(4, 90, ramp=True)
+    rng = random.Random(1)
+    positions = iter([rng.randrange(1 << 20) for _ in range(1000)] * 1000)
+    bpms = iter([100.0, 140.0] * 100000)
+
+    def lookup():
+        tempo_map.time_of(next(positions))
+
+    def edit():
+        tempo_map.set_tempo(2, next(bpms))
+
+    return {
+        'tempo_map.lookups_per_second': (best_rate(lookup, 20000, repeat), HIGHER_IS_BETTER),
+        'tempo_map.edit.seconds': (1.0 / best_rate(edit, 200, repeat), LOWER_IS_BETTER),
+    }
+
+
+@case
+def scheduler(repeat):
+    # One busy sequencer scheduled alone and alongside idle ones, idle
+    # sequencers are never queued so the rates should match. Runs of the
+    # two alternate so machine noise hits both alike.
+    def build_step(idle_count):
+        sequencers = [build_sequencer()] + [
+            Sequencer(_id, bars=MAXIMUM_BARS, midi_channel=0) for _id in range(1, idle_count + 1)
+        ]
+        step_scheduler = StepScheduler(sequencers)
+
+        def step():
+            beat, indexes = step_scheduler.pop()
+            for index in indexes:
+                sequencers[index].tick(None)
+                step_scheduler.schedule(index)
+        return step
+
+    alone = build_step(0)
+    shared = build_step(63)
+    alone_seconds = []
+    shared_seconds = []
+    for _ in range(repeat):
+        alone_seconds.append(timeit.timeit(alone, number=20000))
+        shared_seconds.append(timeit.timeit(shared, number=20000))
+    return {
+        'scheduler.steps_per_second': (20000 / min(shared_seconds), HIGHER_IS_BETTER),
+        'scheduler.idle_overhead': (min(shared_seconds) / min(alone_seconds), LOWER_IS_BETTER),
+    }
+
+
+@case
+def arrangement(repeat):
+    # Seeking a song of thousands of sections, and everything a section
+    # change costs the clock thread: swapping the pattern in, playing its
+    # first step and compiling the next section ahead of time
+    patterns = []
+    for value in range(8):
+        steps = StepStore(16)
+        steps.set(0, 36 + value)
+        patterns.append(Pattern(steps))
+    song = Arrangement()
+    sequencer = song.add_track(Sequencer(0, bars=1, midi_channel=0), [
+        (patterns[section % 8], 1) for section in range(SONG_SECTIONS)
+    ]).sequencer
+    scheduler = ArrangementScheduler(song)
+    song_beats = song.length()
+    rng = random.Random(4)
+    beats = iter([rng.uniform(0, song_beats) for _ in range(1000)] * 1000)
+
+    def seek():
+        scheduler.locate(next(beats))
+
+    seek_seconds = 1.0 / best_rate(seek, 1000, repeat)
+    scheduler.locate(0)
+
+    def change_section():
+        if scheduler.peek() is None:
+            scheduler.locate(0)
+        scheduler.pop()
+        sequencer.advance()
+        scheduler.schedule(0)
+
+    return {
+        'arrangement.seek.seconds': (seek_seconds, LOWER_IS_BETTER),
+        'arrangement.section_change.seconds': (1.0 / best_rate(change_section, 1000, repeat), LOWER_IS_BETTER),
+    }
+
+
+@case
+def memory(repeat):
+    gc.collect()
+    tracemalloc.start()
+    sequencers = [build_sequencer(MAXIMUM_BARS, seed=seed) for seed in range(100)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sequencers
+    return {'memory.bytes_per_pattern': (size / 100.0, LOWER_IS_BETTER)}
+
+
+def import_times(modules):
+    # Imports modules in a fresh interpreter under -X importtime, returning
+    # seconds spent in each module imported after the interpreter's own
+    # startup (site and everything it pulls in)
+    code = 'import importlib\nfor name in {!r}: importlib.import_module(name)'.format(tuple(modules))
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stderr
+    times = {}
+    started = False
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+        if started:
+            times[name.strip()] = int(self_us) / 1e6
+        elif name.strip() == 'site':
+            started = True
+    return times
+
+
+@case
+def startup(repeat):
+    # Cold start of headless playback, without Kivy
+    modules = ('cli',) + HEADLESS_MODULES
+    return {'startup.headless_import.seconds': (
+        min(sum(import_times(modules).values()) for _ in range(max(repeat, STARTUP_RUNS))), LOWER_IS_BETTER
+    )}
+
+
+@case
+def ui_update(repeat):
+    # A playback tick's redraw, and moving to another bar of the longest
+    # pattern, which should cost the same as moving around a short one
+    sequencer = build_sequencer()
+    window = StepGridWindow(sequencer.steps_per_bar)
+
+    def update():
+        sequencer.tick(None)
+        window.refresh(sequencer, 2, 0)
+
+    long_sequencer = build_sequencer(MAXIMUM_BARS)
+    navigation_window = StepGridWindow(long_sequencer.steps_per_bar)
+    bars = iter(list(range(MAXIMUM_BARS)) * 100000)
+
+    def navigate():
+        navigation_window.refresh(long_sequencer, 2, next(bars))
+
+    return {
+        'ui_update.seconds_per_tick': (1.0 / best_rate(update, 2000, repeat), LOWER_IS_BETTER),
+        'ui_update.navigate.seconds': (1.0 / best_rate(navigate, 2000, repeat), LOWER_IS_BETTER),
+    }
+
+
+def run(selected=None, repeat=5):
+    results = {}
+    for function in cases:
+        if selected and function.__name__ not in selected:
+            continue
+        for name, (value, direction) in function(repeat).items():
+            results[name] = {'value': value, 'better': direction}
+    return results
+
+
+def run_separately(selected, repeat, count):
+    # Runs the suite in count fresh interpreters. How fast a process runs
+    # depends on where it lands in memory and on the host, and that holds
+    # for its whole life, so repeats within one process can't show it.
+    directory = tempfile.mkdtemp()
+    runs = []
+    try:
+        for index in range(count):
+            path = os.path.join(directory, '{}.json'.format(index))
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__)] + list(selected or []) + [
+                    '--repeat', str(repeat), '--output', path, '--baseline', os.path.join(directory, 'none.json')
+                ],
+                cwd=ROOT, capture_output=True, check=True
+            )
+            with open(path) as fp:
+                runs.append(json.load(fp)['results'])
+    finally:
+        shutil.rmtree(directory)
+    return runs
+
+
+def baseline_results(runs):
+    # Per result, the run three quarters of the way from best to worst:
+    # what most later runs should match or beat, rather than whichever
+    # way the machine's noise fell on one run
+    results = {}
+    for name in runs[0]:
+        ranked = sorted(
+            (run_results[name] for run_results in runs),
+            key=lambda result: result['value'],
+            reverse=runs[0][name]['better'] == HIGHER_IS_BETTER
+        )
+        results[name] = ranked[3 * (len(ranked) - 1) // 4]
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]['value']
+        value = result['value']
+        allowed = TOLERANCES.get(name, tolerance)
+        if result['better'] == HIGHER_IS_BETTER:
+            regressed = value < expected * (1 - allowed)
+        else:
+            regressed = value > expected * (1 + allowed)
+        if regressed:
+            regressions.append((name, expected, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the sequencer benchmark suite')
+    parser.add_argument('cases', nargs='*', help='Only run these cases ({})'.format(
+        ', '.join(function.__name__ for function in cases)
+    ))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed fractional slowdown before a result counts as a regression')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.update_baseline:
+        results = baseline_results(run_separately(args.cases, args.repeat, BASELINE_RUNS))
+    else:
+        results = run(args.cases, args.repeat)
+    document = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    for name, result in sorted(results.items()):
+        print('{:<48} {:>16.6g}'.format(name, result['value']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    for name, expected, value in regressions:
+        print('REGRESSION {}: {:.6g} (baseline {:.6g})'.format(name, value, expected))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
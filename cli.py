@@ -0,0 +1,118 @@
+import argparse
+import importlib
+import sys
+import threading
+import time
+
+
+__all__ = ['main', 'HEADLESS_MODULES']
+
+DEFAULT_BPM = 120
+
+# Everything headless playback needs. None of these may import Kivy, the
+# GUI and its widgets are only loaded by the gui command.
+HEADLESS_MODULES = ('arrangement', 'clock', 'midi_clock', 'midi_engine', 'persistence', 'sequencer', 'tempo')
+
+# Commands whose module has its own argument parser
+DELEGATED_COMMANDS = {
+    'render': 'render',
+    'smf': 'smf',
+}
+
+GUI_APPS = {
+    'main': ('main', 'SequencerApp'),
+    'test': ('test', 'TestApp'),
+}
+
+
+def play(args):
+    from clock import PolymeterClock
+    from midi_clock import MidiClockFollower, MidiClockOutput
+    from midi_engine import BatchingBackend, RawMidiBackend, RawMidiInput, midi_engine
+    from persistence import load_session
+    from tempo import TempoMap
+
+    sequencers = load_session(args.session)
+    first = sequencers[0]
+    tempo_map = TempoMap(first.step_count, args.bpm, first.beats_per_bar, first.beat_subdivision)
+    if args.device:
+        midi_engine.set_backend(BatchingBackend(RawMidiBackend(args.device)))
+    for sequencer in sequencers:
+        sequencer.locate(0)
+
+    follower = midi_input = None
+    finished = threading.Event()
+    if args.clock_in:
+        # Bars are counted on the leader's clock, and its Stop ends playback
+        beats = args.bars * first.beats_per_bar
+
+        def leader_changed(follower, message):
+            if message == 'stop' or (beats and message == 'pulse' and follower.anchor()[1] >= beats):
+                finished.set()
+        follower = MidiClockFollower(tempo_map)
+        follower.listeners.append(leader_changed)
+        midi_input = RawMidiInput(args.clock_in, follower.receive)
+    clock_output = MidiClockOutput() if args.send_clock else None
+
+    playback_clock = PolymeterClock(sequencers, tempo_map, clock_output=clock_output, follower=follower)
+    playback_clock.start()
+    try:
+        if midi_input is not None:
+            midi_input.start()
+            while not finished.wait(1):
+                pass
+        elif args.bars:
+            time.sleep(tempo_map.time_of(args.bars * first.steps_per_bar))
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if midi_input is not None:
+            midi_input.stop()
+        playback_clock.stop()
+        for sequencer in sequencers:
+            sequencer.release_all()
+        midi_engine.flush()
+    return 0
+
+
+def gui(args):
+    # The only place Kivy gets imported
+    module_name, class_name = GUI_APPS[args.app]
+    app_class = getattr(importlib.import_module(module_name), class_name)
+    app_class().run()
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in DELEGATED_COMMANDS:
+        return importlib.import_module(DELEGATED_COMMANDS[argv[0]]).main(argv[1:])
+
+    parser = argparse.ArgumentParser(description='pyseq step sequencer')
+    subparsers = parser.add_subparsers(dest='command')
+    play_parser = subparsers.add_parser('play', help='Play a saved session without the GUI')
+    play_parser.add_argument('session')
+    play_parser.add_argument('--bpm', type=float, default=DEFAULT_BPM)
+    play_parser.add_argument('--bars', type=int, default=0, help='Stop after this many bars, 0 plays until Ctrl+C')
+    play_parser.add_argument('--device', help='ALSA rawmidi device to play through, e.g. /dev/snd/midiC1D0')
+    play_parser.add_argument('--send-clock', action='store_true', help='Send MIDI clock and transport to the device')
+    play_parser.add_argument('--clock-in', metavar='DEVICE', help='Follow MIDI clock from this rawmidi device')
+    gui_parser = subparsers.add_parser('gui', help='Open the sequencer GUI')
+    gui_parser.add_argument('--app', choices=sorted(GUI_APPS), default='test')
+    for command in sorted(DELEGATED_COMMANDS):
+        subparsers.add_parser(command, help='See {} {} --help'.format(parser.prog, command))
+    args = parser.parse_args(argv)
+
+    if args.command == 'play':
+        return play(args)
+    if args.command == 'gui':
+        return gui(args)
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+import math
+import threading
+import time
+
+from instrumentation import instruments
+from midi_engine import midi_engine
+from scheduler import ArrangementScheduler, StepScheduler
+
+
+__all__ = ['PlaybackClock', 'PolymeterClock', 'JitterReport']
+
+# perf_counter is monotonic and has sub-microsecond resolution on the
+# platforms we care about
+default_timer = time.perf_counter
+
+FOLLOW_LOOKAHEAD = 2        # Pulses a following clock may run ahead of its leader
+
+
+class JitterReport(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tick_count = 0
+        self.missed_deadlines = 0
+        self.total_error = 0.0
+        self.total_square_error = 0.0
+        self.min_error = None
+        self.max_error = None
+        self.drift = 0.0
+
+    def record(self, scheduled, actual, interval):
+        error = actual - scheduled
+        self.tick_count += 1
+        self.total_error += error
+        self.total_square_error += error * error
+        if self.min_error is None or error < self.min_error:
+            self.min_error = error
+        if self.max_error is None or error > self.max_error:
+            self.max_error = error
+        if error >= interval:
+            self.missed_deadlines += 1
+        # Deadlines are absolute, so the error of the latest tick is also how
+        # far playback has drifted from the ideal grid since start()
+        self.drift = error
+
+    @property
+    def mean_error(self):
+        if not self.tick_count:
+            return 0.0
+        return self.total_error / self.tick_count
+
+    @property
+    def jitter(self):
+        if not self.tick_count:
+            return 0.0
+        mean = self.mean_error
+        variance = (self.total_square_error / self.tick_count) - (mean * mean)
+        return math.sqrt(max(variance, 0.0))
+
+    def as_dict(self):
+        return {
+            'tick_count': self.tick_count,
+            'missed_deadlines': self.missed_deadlines,
+            'mean_error': self.mean_error,
+            'min_error': self.min_error or 0.0,
+            'max_error': self.max_error or 0.0,
+            'jitter': self.jitter,
+            'drift': self.drift,
+        }
+
+    def __repr__(self):
+        return (
+            u'<JitterReport ticks={tick_count}, missed={missed_deadlines}, '
+            u'mean={mean_error:.6f}s, max={max_error:.6f}s, '
+            u'jitter={jitter:.6f}s, drift={drift:.6f}s>'
+        ).format(**self.as_dict())
+
+
+class PlaybackClock(object):
+    def __init__(self, sequencers, interval, on_tick=None, spin_threshold=0.001, timer=default_timer,
+                 tempo_map=None):
+        self.sequencers = sequencers
+        self.interval = interval
+        self.tempo_map = tempo_map
+        self.on_tick = on_tick
+        self.spin_threshold = spin_threshold
+        self.timer = timer
+        self.report = JitterReport()
+        self._pending_interval = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self.report.reset()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='PlaybackClock')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def set_interval(self, interval):
+        # Picked up by the clock thread on its next deadline, so the grid is
+        # rebased exactly once instead of racing with _run()
+        self._pending_interval = interval
+
+    def _wait_until(self, deadline):
+        remaining = deadline - self.timer()
+        if remaining > self.spin_threshold:
+            if self._stop_event.wait(remaining - self.spin_threshold):
+                return False
+        while self.timer() < deadline:
+            pass
+        return not self._stop_event.is_set()
+
+    def _run(self):
+        if self.tempo_map is not None:
+            return self._run_tempo_map()
+        origin = self.timer()
+        tick_index = 0
+        while not self._stop_event.is_set():
+            if self._pending_interval is not None:
+                origin = origin + tick_index * self.interval
+                tick_index = 0
+                self.interval = self._pending_interval
+                self._pending_interval = None
+
+            deadline = origin + (tick_index + 1) * self.interval
+            if not self._wait_until(deadline):
+                break
+            actual = self.timer()
+            self.report.record(deadline, actual, self.interval)
+            if instruments.enabled:
+                instruments.record('clock.lateness', actual - deadline)
+            midi_engine.begin_tick(deadline)
+            self.tick(self.interval)
+            tick_index += 1
+
+    def _run_tempo_map(self):
+        # Deadlines are looked up in the tempo map's step table rather than
+        # worked out from an interval. Editing the map rebases the schedule
+        # on the last deadline, so playback carries on from where it was.
+        tempo_map = self.tempo_map
+        origin = deadline = self.timer()
+        version = tempo_map.version
+        position = 0
+        while not self._stop_event.is_set():
+            if tempo_map.version != version:
+                version = tempo_map.version
+                origin = deadline - tempo_map.time_of(position)
+
+            position += 1
+            deadline = origin + tempo_map.time_of(position)
+            interval = tempo_map.interval(position)
+            if not self._wait_until(deadline):
+                break
+            actual = self.timer()
+            self.report.record(deadline, actual, interval)
+            if instruments.enabled:
+                instruments.record('clock.lateness', actual - deadline)
+            midi_engine.begin_tick(deadline)
+            self.interval = interval
+            self.tick(interval)
+
+    def tick(self, delta):
+        for sequencer in self.sequencers:
+            sequencer.tick(delta)
+        midi_engine.flush()
+        if self.on_tick is not None:
+            self.on_tick()
+
+
+class PolymeterClock(PlaybackClock):
+    # Ticks every sequencer at its own step rate and pattern length, timed
+    # by a TempoMap in beats. A StepScheduler queues each sequencer's next
+    # step that sends anything, so the clock only wakes for those: idle
+    # sequencers cost nothing until an edit reschedules them.
+    #
+    # Playback starts on the downbeat: each sequencer's next step plays
+    # as soon as the clock starts. A MidiClockOutput is pulsed from the
+    # same schedule, in between steps. Given a MidiClockFollower the
+    # clock follows external MIDI clock instead: its beats are re-aligned
+    # to the follower's filtered estimate on every pulse, and it never
+    # runs more than FOLLOW_LOOKAHEAD pulses past the last one received,
+    # so when the leader stops the sequencers stop with it.
+    #
+    # Given an Arrangement, sequencers (arrangement.sequencers) play their
+    # tracks' sections through an ArrangementScheduler. Muted tracks and
+    # ones past their end keep their place without sending anything.
+    def __init__(self, sequencers, tempo_map, on_tick=None, spin_threshold=0.001, timer=default_timer,
+                 follow=(), clock_output=None, follower=None, arrangement=None):
+        super(PolymeterClock, self).__init__(
+            sequencers, tempo_map.interval(0), on_tick, spin_threshold, timer, tempo_map
+        )
+        self.arrangement = arrangement
+        if arrangement is None:
+            self.scheduler = StepScheduler(sequencers, follow)
+        else:
+            self.scheduler = ArrangementScheduler(arrangement, follow)
+        self.clock_output = clock_output
+        self.follower = follower
+        self.origin = None          # When beat 0 played, by self.timer
+        self._edited = set()
+        self._relocate = None
+        self._leader_started = False
+        self._wake = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        super(PolymeterClock, self).stop()
+
+    def sequencer_changed(self, sequencer, first_step_id, last_step_id):
+        # Called on whichever thread made the edit
+        self._edited.add(self.scheduler.index(sequencer))
+        self._wake.set()
+
+    def seek(self, bar):
+        # Playback carries on from the top of bar, straight away if playing
+        self._relocate = self.tempo_map.bar_start(bar) / float(self.tempo_map.steps_per_beat)
+        self._wake.set()
+
+    def follower_changed(self, follower, message):
+        # Called on the MIDI input's thread
+        if message == 'start' or message == 'continue':
+            self._relocate = follower.song_beat
+            self._leader_started = True
+        self._wake.set()
+
+    def following(self, beat):
+        # Whether the leader's clock has got far enough for beat to play
+        follower = self.follower
+        anchor = follower.anchor()
+        return (
+            self._leader_started and follower.running and anchor is not None and
+            beat <= anchor[1] + FOLLOW_LOOKAHEAD / float(follower.ppqn)
+        )
+
+    def beat_time(self, beat):
+        return self.tempo_map.time_at(beat * self.tempo_map.steps_per_beat)
+
+    def beat_at(self, timestamp):
+        return self.tempo_map.position_at(timestamp - self.origin) / self.tempo_map.steps_per_beat
+
+    def position_at(self, sequencer, timestamp):
+        # Which of sequencer's steps is playing at timestamp, as a fraction
+        # and counting on through loops, e.g. to line MIDI input up with
+        # playback. None until the clock has started.
+        if self.origin is None:
+            return None
+        index = self.scheduler.index(sequencer)
+        return self.scheduler.anchors[index] + self.beat_at(timestamp) * sequencer.beat_subdivision
+
+    def _wait_until(self, deadline):
+        # Also returns early when an edit needs rescheduling
+        remaining = deadline - self.timer()
+        if remaining > self.spin_threshold:
+            if self._wake.wait(remaining - self.spin_threshold):
+                return False
+        while self.timer() < deadline:
+            pass
+        return not self._stop_event.is_set()
+
+    def _run(self):
+        for sequencer in self.sequencers:
+            sequencer.listeners.append(self.sequencer_changed)
+        if self.follower is not None:
+            # Beats count from the leader's start, so wait for the next one
+            self._leader_started = False
+            self.follower.listeners.append(self.follower_changed)
+        if self.clock_output is not None and self._relocate is None:
+            # After a seek _schedule() sends the song position instead
+            self.clock_output.start()
+        try:
+            self._schedule()
+        finally:
+            if self.clock_output is not None:
+                self.clock_output.stop()
+            if self.follower is not None:
+                self.follower.listeners.remove(self.follower_changed)
+            for sequencer in self.sequencers:
+                sequencer.listeners.remove(self.sequencer_changed)
+
+    def _schedule(self):
+        tempo_map = self.tempo_map
+        scheduler = self.scheduler
+        sequencers = self.sequencers
+        clock_output = self.clock_output
+        follower = self.follower
+        arrangement = self.arrangement
+        scheduler.start(first_position=0)
+        origin = deadline = self.origin = self.timer()
+        version = tempo_map.version
+        follower_version = None
+        beat = 0.0
+        while not self._stop_event.is_set():
+            self._wake.clear()
+            if self._relocate is not None:
+                # Seeking, or the leader started over or continued from
+                # somewhere else
+                for sequencer in sequencers:
+                    sequencer.release_all()
+                scheduler.locate(self._relocate)
+                if clock_output is not None:
+                    # Followers are sent the new song position too
+                    clock_output.start(self._relocate)
+                self._relocate = None
+                beat = 0.0
+                origin = deadline = self.origin = self.timer()
+            if tempo_map.version != version:
+                # Carry on from the last beat played at the new tempo
+                version = tempo_map.version
+                origin = self.origin = deadline - self.beat_time(beat)
+            if follower is not None and follower.version != follower_version:
+                follower_version = follower.version
+                anchor = follower.anchor()
+                if anchor is not None:
+                    origin = self.origin = anchor[0] - self.beat_time(anchor[1])
+            if self._edited:
+                now = self.beat_at(self.timer())
+                while self._edited:
+                    scheduler.reschedule(self._edited.pop(), max(now, beat))
+
+            due_beat = scheduler.peek()
+            pulse_due = clock_output is not None and (due_beat is None or clock_output.next_beat <= due_beat)
+            if pulse_due:
+                due_beat = clock_output.next_beat
+            if due_beat is None or (follower is not None and not self.following(due_beat)):
+                self._wake.wait()
+                continue
+            due_deadline = origin + self.beat_time(due_beat)
+            if not self._wait_until(due_deadline):
+                continue
+            if pulse_due:
+                clock_output.pulse()
+                continue
+
+            beat, indexes = scheduler.pop()
+            deadline = due_deadline
+            actual = self.timer()
+            interval = self.beat_time(beat + 1.0 / sequencers[indexes[0]].beat_subdivision) - self.beat_time(beat)
+            self.report.record(deadline, actual, interval)
+            if instruments.enabled:
+                instruments.record('clock.lateness', actual - deadline)
+            midi_engine.begin_tick(deadline)
+            for index in indexes:
+                sequencer = sequencers[index]
+                if arrangement is not None and not scheduler.audible(index):
+                    sequencer.skip()
+                else:
+                    sequencer.tick(self.beat_time(beat + 1.0 / sequencer.beat_subdivision) - self.beat_time(beat))
+                scheduler.schedule(index)
+            midi_engine.flush()
+            if self.on_tick is not None:
+                self.on_tick()
@@ -0,0 +1,57 @@
+import random
+
+
+__all__ = ['Groove']
+
+STRAIGHT = 50.0
+
+
+class Groove(object):
+    # Timing offsets in fractions of a step, applied when a step's events
+    # are scheduled rather than by bending the clock interval.
+    #
+    # swing is a percentage in the usual drum machine sense: 50 is straight,
+    # 66.7 puts every second step on a triplet. offsets are per step nudges
+    # repeated over the pattern, humanize adds up to +/- that much random
+    # drift per step from a seeded RNG so renders are reproducible.
+    def __init__(self, swing=STRAIGHT, offsets=None, humanize=0.0, seed=0):
+        self.swing = swing
+        self.offsets = list(offsets or [])
+        self.humanize = humanize
+        self.seed = seed
+        self.compiled = {}
+        self.compiled_from = None   # The parameters compiled holds offsets for
+
+    @property
+    def is_straight(self):
+        return self.swing == STRAIGHT and not any(self.offsets) and not self.humanize
+
+    def compile(self, step_count):
+        # Precomputed once per pattern length; a tuple so the tick path
+        # reads ready made floats instead of boxing array items. Changing
+        # any parameter, offsets in place included, drops what was cached.
+        parameters = (self.swing, tuple(self.offsets), self.humanize, self.seed)
+        if parameters != self.compiled_from:
+            self.compiled = {}
+            self.compiled_from = parameters
+        offsets = self.compiled.get(step_count)
+        if offsets is not None:
+            return offsets
+
+        rng = random.Random(self.seed)
+        swing_offset = 2 * self.swing / 100.0 - 1
+        offsets = []
+        for step_id in range(step_count):
+            offset = swing_offset if step_id % 2 else 0.0
+            if self.offsets:
+                offset += self.offsets[step_id % len(self.offsets)]
+            if self.humanize:
+                offset += rng.uniform(-self.humanize, self.humanize)
+            offsets.append(offset)
+        offsets = self.compiled[step_count] = tuple(offsets)
+        return offsets
+
+    def __repr__(self):
+        return u'<Groove swing={}, offsets={}, humanize={}, seed={}>'.format(
+            self.swing, self.offsets, self.humanize, self.seed
+        )
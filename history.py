@@ -0,0 +1,295 @@
+import struct
+
+from array import array
+
+from steps import EMPTY_VALUE, MASK_BYTES
+
+
+__all__ = ['EditHistory', 'DeltaRing']
+
+DEFAULT_BUDGET = 1 << 20        # Bytes of deltas kept before the oldest go
+
+NOTES, HOLDS, VELOCITIES, GATES, PROBABILITIES, CHORDS = range(6)
+CC_LANE = 128                   # CC lanes are CC_LANE + controller
+LANE = 0xFFFFFFFF               # Step id of entries adding (1) or removing (0) a CC lane
+
+FRAME = struct.Struct('<I')                     # Payload length, before and after each record
+RECORD = struct.Struct('<H')                    # Slot of the sequencer edited
+ENTRY = struct.Struct('<BIff')                  # Lane, step id, old value, new value
+CHORD_ENTRY = struct.Struct('<BI{0}s{0}s'.format(MASK_BYTES))
+
+
+class DeltaRing(object):
+    # Variable length records in a fixed size bytearray. Positions only
+    # ever grow and wrap round the buffer, oldest records are dropped to
+    # make room. Each record is framed by its length on both sides so the
+    # ring can be walked backwards (undo) as well as forwards (redo).
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self.start = 0      # Oldest record
+        self.cursor = 0     # Just past the last record applied
+        self.end = 0        # Just past the newest record, beyond cursor are redos
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _write(self, position, data):
+        offset = position % self.capacity
+        head = min(len(data), self.capacity - offset)
+        self.buffer[offset:offset + head] = data[:head]
+        self.buffer[:len(data) - head] = data[head:]
+
+    def _read(self, position, size):
+        offset = position % self.capacity
+        head = min(size, self.capacity - offset)
+        return bytes(self.buffer[offset:offset + head] + self.buffer[:size - head])
+
+    def _length_at(self, position):
+        return FRAME.unpack(self._read(position, FRAME.size))[0]
+
+    def push(self, payload):
+        # Anything that was undone can't be redone past a new edit
+        size = len(payload) + 2 * FRAME.size
+        self.end = self.cursor
+        if size > self.capacity:
+            self.clear()
+            return False
+        while self.end + size - self.start > self.capacity:
+            self.start += self._length_at(self.start) + 2 * FRAME.size
+        frame = FRAME.pack(len(payload))
+        self._write(self.end, frame + payload + frame)
+        self.end += size
+        self.cursor = self.end
+        return True
+
+    def back(self):
+        if self.cursor == self.start:
+            return None
+        length = self._length_at(self.cursor - FRAME.size)
+        self.cursor -= length + 2 * FRAME.size
+        return self._read(self.cursor + FRAME.size, length)
+
+    def forward(self):
+        if self.cursor == self.end:
+            return None
+        length = self._length_at(self.cursor)
+        payload = self._read(self.cursor + FRAME.size, length)
+        self.cursor += length + 2 * FRAME.size
+        return payload
+
+
+class EditHistory(object):
+    # Undo/redo for the sequencers attached to it. Every edit a sequencer
+    # reports is diffed against a shadow copy of its steps, and only the
+    # lanes and steps that changed are kept: (lane, step id, old, new).
+    # Deltas live in a DeltaRing, so however long the session the history
+    # never holds more than budget bytes; the oldest edits are forgotten.
+    #
+    # An undo or redo writes a whole record back into the arrays and
+    # patches the timeline once, however many steps the edit touched.
+    #
+    # A sequencer playing an arrangement swaps its steps for another
+    # pattern's between edits. That's only noted when it happens, on the
+    # clock's thread, and the next edit diffs against the new pattern.
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.ring = DeltaRing(budget)
+        self.sequencers = []
+        self.shadows = []
+        self.cued = []          # Steps of the pattern cued since the last edit, per slot
+        self.applying = False
+
+    def attach(self, sequencer):
+        self.sequencers.append(sequencer)
+        self.shadows.append(sequencer.steps.copy())
+        self.cued.append(None)
+        sequencer.listeners.append(self.sequencer_changed)
+        sequencer.pattern_listeners.append(self.pattern_replaced)
+
+    def detach(self, sequencer):
+        # Slots are recorded in the deltas, so a detached sequencer takes
+        # the history with it
+        slot = self.slot(sequencer)
+        sequencer.listeners.remove(self.sequencer_changed)
+        sequencer.pattern_listeners.remove(self.pattern_replaced)
+        del self.sequencers[slot]
+        del self.shadows[slot]
+        del self.cued[slot]
+        self.ring.clear()
+
+    def slot(self, sequencer):
+        for slot, attached in enumerate(self.sequencers):
+            if attached is sequencer:
+                return slot
+        raise ValueError('{} has no history'.format(sequencer))
+
+    def clear(self):
+        self.ring.clear()
+
+    @property
+    def can_undo(self):
+        return self.ring.cursor != self.ring.start
+
+    @property
+    def can_redo(self):
+        return self.ring.cursor != self.ring.end
+
+    def pattern_replaced(self, sequencer):
+        self.cued[self.slot(sequencer)] = sequencer.steps
+
+    def sequencer_changed(self, sequencer, first_step_id, last_step_id):
+        slot = self.slot(sequencer)
+        shadow = self.shadows[slot]
+        cued = self.cued[slot]
+        if cued is not None:
+            # Patterns are never edited in place, so what was cued is still
+            # what the sequencer held before this edit forked it
+            self.cued[slot] = None
+            if len(cued) != len(shadow):
+                self.ring.clear()
+            shadow = self.shadows[slot] = cued.copy()
+        steps = sequencer.steps
+        step_count = len(steps)
+        if len(shadow) != step_count:
+            # Deltas can't be replayed over a different number of steps
+            self.shadows[slot] = steps.copy()
+            self.ring.clear()
+            return
+
+        # Bulk edits may also split a note held on past the end of the range
+        ranges = [(first_step_id, min(last_step_id + 1, step_count - 1))]
+        if last_step_id + 1 >= step_count and first_step_id > 0:
+            ranges.append((0, 0))
+        payload = bytearray(RECORD.pack(slot))
+        lanes_changed = set(shadow.cc_lanes) ^ set(steps.cc_lanes)
+        for first, last in ranges:
+            payload += self.diff(shadow, steps, first, last)
+        for controller in lanes_changed:
+            added = controller in steps.cc_lanes
+            payload += ENTRY.pack(CC_LANE + controller, LANE, not added, added)
+            if not added:
+                shadow.remove_cc_lane(controller)
+        if len(payload) > RECORD.size and not self.applying:
+            self.ring.push(bytes(payload))
+
+    def lane_pairs(self, shadow, steps):
+        # (lane code, shadow lane, current lane) for every lane either side
+        # has, a lane missing on either side reads as empty
+        yield NOTES, shadow.notes, steps.notes
+        yield HOLDS, shadow.holds, steps.holds
+        yield VELOCITIES, shadow.velocities, steps.velocities
+        yield GATES, shadow.gates, steps.gates
+        yield PROBABILITIES, shadow.probabilities, steps.probabilities
+        empty = None
+        for controller in sorted(set(shadow.cc_lanes) | set(steps.cc_lanes)):
+            lane = steps.cc_lanes.get(controller)
+            if lane is None:
+                empty = empty or array('h', [EMPTY_VALUE]) * len(steps)
+                lane = empty
+            yield CC_LANE + controller, shadow.cc_lane(controller), lane
+
+    def diff(self, shadow, steps, first_step_id, last_step_id):
+        # Packs the deltas between the shadow and the steps, bringing the
+        # shadow up to date as it goes
+        entries = bytearray()
+        end = last_step_id + 1
+        for code, old_lane, new_lane in self.lane_pairs(shadow, steps):
+            old_values = old_lane[first_step_id:end]
+            new_values = new_lane[first_step_id:end]
+            if old_values == new_values:
+                continue
+            for step_id, old_value, new_value in zip(range(first_step_id, end), old_values, new_values):
+                if old_value != new_value:
+                    entries += ENTRY.pack(code, step_id, old_value, new_value)
+            old_lane[first_step_id:end] = new_values
+
+        old_chords = shadow.chords
+        new_chords = steps.chords
+        if end - first_step_id < len(old_chords) + len(new_chords):
+            step_ids = [
+                step_id for step_id in range(first_step_id, end) if step_id in old_chords or step_id in new_chords
+            ]
+        else:
+            step_ids = sorted(
+                step_id for step_id in set(old_chords) | set(new_chords) if first_step_id <= step_id < end
+            )
+        for step_id in step_ids:
+            old_mask = old_chords.get(step_id, 0)
+            new_mask = new_chords.get(step_id, 0)
+            if old_mask != new_mask:
+                entries += CHORD_ENTRY.pack(
+                    CHORDS, step_id, old_mask.to_bytes(MASK_BYTES, 'little'), new_mask.to_bytes(MASK_BYTES, 'little')
+                )
+                if new_mask:
+                    old_chords[step_id] = new_mask
+                else:
+                    del old_chords[step_id]
+        return entries
+
+    def undo(self):
+        # Returns the sequencer the undone edit was made to, or None
+        payload = self.ring.back()
+        return self.apply(payload, False) if payload is not None else None
+
+    def redo(self):
+        payload = self.ring.forward()
+        return self.apply(payload, True) if payload is not None else None
+
+    def apply(self, payload, redo):
+        slot, = RECORD.unpack_from(payload)
+        sequencer = self.sequencers[slot]
+        sequencer.fork_pattern()
+        steps = sequencer.steps
+        lanes = {
+            NOTES: steps.notes,
+            HOLDS: steps.holds,
+            VELOCITIES: steps.velocities,
+            GATES: steps.gates,
+            PROBABILITIES: steps.probabilities,
+        }
+        lanes_removed = []
+        first_step_id = len(steps)
+        last_step_id = -1
+        offset = RECORD.size
+        while offset < len(payload):
+            code = payload[offset]
+            if code == CHORDS:
+                _, step_id, old_mask, new_mask = CHORD_ENTRY.unpack_from(payload, offset)
+                offset += CHORD_ENTRY.size
+                mask = int.from_bytes(new_mask if redo else old_mask, 'little')
+                if mask:
+                    steps.chords[step_id] = mask
+                else:
+                    steps.chords.pop(step_id, None)
+            else:
+                _, step_id, old_value, new_value = ENTRY.unpack_from(payload, offset)
+                offset += ENTRY.size
+                value = new_value if redo else old_value
+                if step_id == LANE:
+                    if value:
+                        steps.cc_lane(code - CC_LANE)
+                    else:
+                        lanes_removed.append(code - CC_LANE)
+                    continue
+                if code >= CC_LANE:
+                    steps.cc_lane(code - CC_LANE)[step_id] = int(value)
+                elif code == GATES:
+                    lanes[code][step_id] = value
+                else:
+                    lanes[code][step_id] = int(value)
+            first_step_id = min(first_step_id, step_id)
+            last_step_id = max(last_step_id, step_id)
+        for controller in lanes_removed:
+            steps.remove_cc_lane(controller)
+        if first_step_id > last_step_id:
+            first_step_id = last_step_id = 0
+
+        self.applying = True
+        try:
+            sequencer.changed(first_step_id, last_step_id)
+        finally:
+            self.applying = False
+        return sequencer
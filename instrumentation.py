@@ -0,0 +1,124 @@
+import time
+
+from array import array
+
+
+__all__ = ['Histogram', 'Instrumentation', 'instruments', 'timer']
+
+timer = time.perf_counter
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS     # ~3% precision per bucket
+BUCKET_COUNT = 64 * SUB_BUCKET_COUNT        # Enough for any 64 bit nanosecond value
+
+
+class Histogram(object):
+    # HDR style: values are kept in nanoseconds, exact below 64ns, then in
+    # power of two ranges each split into SUB_BUCKET_COUNT linear buckets,
+    # so recording is a couple of integer operations and no allocation
+    def __init__(self):
+        self.counts = array('Q', [0]) * BUCKET_COUNT
+        self.reset()
+
+    def reset(self):
+        for index in range(BUCKET_COUNT):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket_index(nanoseconds):
+        if nanoseconds < 2 * SUB_BUCKET_COUNT:
+            return nanoseconds
+        exponent = nanoseconds.bit_length() - (SUB_BUCKET_BITS + 1)
+        return (exponent + 1) * SUB_BUCKET_COUNT + (nanoseconds >> exponent) - SUB_BUCKET_COUNT
+
+    @staticmethod
+    def bucket_value(index):
+        if index < 2 * SUB_BUCKET_COUNT:
+            return index
+        exponent = index // SUB_BUCKET_COUNT - 1
+        return (index % SUB_BUCKET_COUNT + SUB_BUCKET_COUNT) << exponent
+
+    def record(self, seconds):
+        nanoseconds = int(seconds * 1e9) if seconds > 0 else 0
+        self.counts[self.bucket_index(nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if self.min is None or nanoseconds < self.min:
+            self.min = nanoseconds
+        if self.max is None or nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def percentile(self, percentile):
+        if not self.count:
+            return 0.0
+        target = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_value(index), self.max) / 1e9
+        return self.max / 1e9
+
+    @property
+    def mean(self):
+        return self.total / 1e9 / self.count if self.count else 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': (self.min or 0) / 1e9,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': (self.max or 0) / 1e9,
+        }
+
+
+class Instrumentation(object):
+    # Hot paths check `instruments.enabled` before timing anything, so with
+    # it off the only cost is that one attribute lookup
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def snapshot(self):
+        return dict((name, histogram.as_dict()) for name, histogram in self.histograms.items())
+
+    def dump(self):
+        lines = ['{:<24} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'histogram', 'count', 'mean us', 'p50 us', 'p99 us', 'p99.9 us', 'max us'
+        )]
+        for name, stats in sorted(self.snapshot().items()):
+            lines.append('{:<24} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                name, stats['count'], stats['mean'] * 1e6, stats['p50'] * 1e6,
+                stats['p99'] * 1e6, stats['p999'] * 1e6, stats['max'] * 1e6
+            ))
+        return '\n'.join(lines)
+
+
+instruments = Instrumentation()
@@ -1,16 +1,21 @@
 from kivy.app import App
 from kivy.clock import Clock
-from kivy.graphics import Color, Rectangle
-from kivy.properties import ListProperty, NumericProperty, StringProperty
+from kivy.graphics import Color, InstructionGroup, Rectangle
+from kivy.properties import NumericProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
-from kivy.uix.label import Label
 from kivy.uix.togglebutton import ToggleButton
 from kivy.uix.screenmanager import ScreenManager
 from kivy.uix.widget import Widget
 
+from clock import PolymeterClock
+from instrumentation import instruments, timer
 from menu import Menu
+from midi_clock import MidiClockOutput
 from sequencer import Sequencer
+from step_grid import CELL_COLORS, StepGridWindow
+from steps import mask_notes
+from tempo import TempoMap
 
 
 BLACK_KEY_NOTE_IDS = [1, 3, 6, 8, 10]
@@ -30,31 +35,6 @@ NOTE_MAPPING = {
 }
 
 
-class StepIndicator(Label):
-    color = ListProperty([0.75, 0.75, 0.75, 1])
-    height = NumericProperty(10)
-    size_hint_y = StringProperty(None)
-
-    def __init__(self, step_id, beat_subdivision, **kwargs):
-        if step_id % beat_subdivision == 0:
-            kwargs['text'] = str(step_id / beat_subdivision)
-        else:
-            kwargs['text'] = ''
-        super(StepIndicator, self).__init__(**kwargs)
-
-
-class StepButton(ToggleButton):
-    def __init__(self, step_id, note_id, sequencer, **kwargs):
-        self.sequencer = sequencer
-        self.step_id = step_id
-        self.note_id = note_id
-        super(StepButton, self).__init__(
-            text='{} ({})'.format(step_id, NOTE_MAPPING[self.note_id]),
-            group='step_{}'.format(step_id),
-            **kwargs
-        )
-
-
 class PianoRollButton(ToggleButton):
     def __init__(self, note_id, **kwargs):
         if note_id in BLACK_KEY_NOTE_IDS:
@@ -74,82 +54,117 @@ class PianoRollWidget(BoxLayout):
     def __init__(self, sequencer, **kwargs):
         super(PianoRollWidget, self).__init__(**kwargs)
         self.active_octave = 5
-        self.add_widget(Widget(height=10, size_hint_y=None))
         for note_id in reversed(range(12)):
             self.add_widget(PianoRollButton(note_id))
 
 
-class StepWidget(BoxLayout):
-    def __init__(self, sequencer, step_id, **kwargs):
-        super(StepWidget, self).__init__(
-            orientation='vertical',
-            width='25dp',
-            **kwargs
-        )
-        self.step_id = step_id
-        self.active_octave = 5
-        self.active_step_indicator = StepIndicator(step_id, sequencer.beat_subdivision)
+class StepGrid(Widget):
+    # One bar by the piano roll's octave of steps, drawn from a
+    # StepGridWindow as a Color and Rectangle per cell recolored in place.
+    # Touches toggle notes in and out of the step's chord.
+    def __init__(self, sequencer, **kwargs):
+        super(StepGrid, self).__init__(**kwargs)
         self.sequencer = sequencer
-        self.add_widget(self.active_step_indicator)
-        for note_id in reversed(range(12)):
-            self.add_widget(StepButton(self.step_id, note_id, self.sequencer))
-
-    def set_active_step_indicator(self):
-        self.active_step_indicator.texture = 'atlas://data/images/sequencer/step_indicator_active'
-
-    def clear_active_step_indicator(self):
-        self.active_step_indicator.color = 'atlas://data/images/sequencer/step_indicator'
+        self.window = StepGridWindow(sequencer.steps_per_bar, rows=len(NOTE_MAPPING))
+        self.colors = []
+        self.rectangles = []
+        cells = InstructionGroup()
+        for state in self.window.cells:
+            color = Color(*CELL_COLORS[state])
+            rectangle = Rectangle()
+            cells.add(color)
+            cells.add(rectangle)
+            self.colors.append(color)
+            self.rectangles.append(rectangle)
+        self.canvas.add(cells)
+        self.bind(pos=self.layout_cells, size=self.layout_cells)
+
+    def layout_cells(self, *args):
+        width = self.width / float(self.window.columns)
+        height = self.height / float(self.window.rows)
+        for cell, rectangle in enumerate(self.rectangles):
+            column, row = divmod(cell, self.window.rows)
+            rectangle.pos = (self.x + column * width + 1, self.y + row * height + 1)
+            rectangle.size = (width - 2, height - 2)
+
+    def refresh(self, octave, bar):
+        cells = self.window.cells
+        for cell in self.window.refresh(self.sequencer, octave, bar):
+            self.colors[cell].rgba = CELL_COLORS[cells[cell]]
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super(StepGrid, self).on_touch_down(touch)
+        column = int((touch.x - self.x) * self.window.columns / self.width)
+        row = int((touch.y - self.y) * self.window.rows / self.height)
+        step_id = self.window.step_at(column)
+        value = self.window.note_at(row)
+        if step_id < self.sequencer.step_count and value <= 127:
+            chord = mask_notes(self.sequencer.steps.note_mask(step_id) ^ (1 << value))
+            self.sequencer.set_chord_for_step(step_id, chord)
+            self.refresh(self.window.state.octave, self.window.state.bar)
+        return True
 
 
 class SequencerView(BoxLayout):
     def __init__(self, **kwargs):
-        super(SequencerView, self).__init__(**kwargs)
         self.sequencer = kwargs.pop('sequencer')
+        super(SequencerView, self).__init__(**kwargs)
         self.right_nav_box = BoxLayout(orientation='vertical', size_hint_x=None, width='25dp')
         self.right_nav_box.add_widget(Button(text='Up'))
         self.right_nav_box.add_widget(Button(text='Dn'))
         self.bottom_nav_box = BoxLayout(orientation='horizontal', size_hint_y=None, height='25dp')
         self.bottom_nav_box.add_widget(Button(text='<'))
         self.bottom_nav_box.add_widget(Button(text='>'))
-        self.step_container = BoxLayout(orientation='horizontal')
-        for step_id in range(self.sequencer.beats_per_bar * self.sequencer.beat_subdivision):
-            self.step_container.add_widget(StepWidget(self.sequencer, step_id))
+        self.step_grid = StepGrid(self.sequencer)
+        # Edits, undo and pattern changes redraw whatever they changed
+        self.sequencer.listeners.append(self.step_grid.window.state.sequencer_changed)
+        self.sequencer.pattern_listeners.append(self.step_grid.window.state.pattern_replaced)
         self.add_widget(PianoRollWidget(self.sequencer))
-        self.add_widget(self.step_container)
-
-    def tick(self, delta):
-        self.update_active_step_id()
+        self.add_widget(self.step_grid)
 
-    def update_active_step_id(self):
-        for step in self.children:
-            if step.id == self.sequencer.active_step:
-                step.set_active_step_indicator()
-            else:
-                step.clear_active_step_indicator()
+    def refresh(self, octave, bar):
+        # Only the previous and current active step, edited steps and a
+        # changed octave or bar have their cells recolored
+        self.step_grid.refresh(octave, bar)
 
 
 class SequencerApp(App):
     active_sequencer = NumericProperty(0)
     sequencers = []
-    step_timer = None
-    bpm = 120
+    playback_clock = None
+    tempo_map = None
+    bpm = NumericProperty(120)
     steps_per_beat = 4
-    tick_interval = 1.0 / (bpm * steps_per_beat)
+    send_clock = True
 
     def get_active_sequencer(self):
         return self.sequencers[self.active_sequencer]
 
+    def on_bpm(self, instance, bpm):
+        # A running clock picks tempo map edits up on its next step
+        if self.tempo_map is not None:
+            self.tempo_map.set_tempo(0, bpm)
+
     def start_playback(self):
-        self.step_timer = Clock.schedule_interval(self.tick, self.tick_interval)
+        # Sequencers are ticked on the playback clock's own thread, the UI is
+        # only told about it through a trigger that fires on the next frame
+        self.playback_clock = PolymeterClock(
+            self.sequencers,
+            self.tempo_map,
+            on_tick=Clock.create_trigger(self.update_ui),
+            follow=[self.get_active_sequencer()],
+            clock_output=MidiClockOutput() if self.send_clock else None
+        )
+        self.playback_clock.start()
 
     def stop_playback(self):
-        if self.step_timer:
-            self.step_timer.cancel()
-            self.step_timer = None
+        if self.playback_clock:
+            self.playback_clock.stop()
+            self.playback_clock = None
 
-    def tick(self, delta):
-        for sequencer in self.sequencers:
-            sequencer.tick(delta)
+    def update_ui(self, delta):
+        started = timer() if instruments.enabled else None
         sequencer = self.get_active_sequencer()
         first_step = self.current_bar * sequencer.beat_subdivision * sequencer.beats_per_bar
         last_step = first_step + (sequencer.beat_subdivision * sequencer.beats_per_bar)
@@ -158,6 +173,9 @@ class SequencerApp(App):
             '{} - {}'.format(first_step, last_step),
             self.get_active_sequencer().active_step
         )
+        self.sequencer_view.refresh(self.current_octave, self.current_bar)
+        if started is not None:
+            instruments.record('ui.update', timer() - started)
 
     def initialize(self):
         self.current_octave = 0
@@ -168,6 +186,7 @@ class SequencerApp(App):
             Sequencer(id=_id, bars=1, beats_per_bar=4, steps_per_beat=self.steps_per_beat, midi_channel=0)
             for _id in range(8)
         ]
+        self.tempo_map = TempoMap(self.sequencers[0].step_count, self.bpm, 4, self.steps_per_beat)
 
     def build(self):
         self.initialize()
@@ -177,8 +196,9 @@ class SequencerApp(App):
         self.root = BoxLayout(orientation='vertical', padding='2dp', spacing='2dp')
         self.root.screen_manager = ScreenManager()
         self.root.add_widget(self.menu)
-        self.sequencer_view = SequencerView()
+        self.sequencer_view = SequencerView(sequencer=self.get_active_sequencer())
         self.root.add_widget(self.sequencer_view)
+        self.sequencer_view.refresh(self.current_octave, self.current_bar)
         return self.root
 
 
@@ -0,0 +1,187 @@
+import math
+import random
+
+from midi_engine import midi_engine
+
+
+__all__ = ['MidiClockOutput', 'MidiClockFollower', 'PulseGenerator', 'song_position_message']
+
+PPQN = 24                   # MIDI clock pulses per quarter note
+PULSES_PER_SIXTEENTH = 6    # Song position counts in 16ths
+SECONDS_PER_MINUTE = 60.0
+
+TIMING_CLOCK = 0xF8
+START = 0xFA
+CONTINUE = 0xFB
+STOP = 0xFC
+SONG_POSITION = 0xF2
+
+
+def song_position_message(beat):
+    sixteenths = min(int(beat * 4), 0x3FFF)
+    return bytes((SONG_POSITION, sixteenths & 0x7F, sixteenths >> 7))
+
+
+class MidiClockOutput(object):
+    # Sends MIDI clock for PolymeterClock, which asks for next_beat and
+    # calls pulse() on its own schedule, in between steps. Beats count
+    # from start(), the song position it was given is only what's reported.
+    def __init__(self, engine=midi_engine, ppqn=PPQN):
+        self.engine = engine
+        self.ppqn = ppqn
+        self.pulses = 0
+
+    @property
+    def next_beat(self):
+        return self.pulses / float(self.ppqn)
+
+    def _send(self, data):
+        self.engine.send_raw(data)
+        self.engine.flush()
+
+    def start(self, song_beat=0.0):
+        # From the top followers get Start. Anywhere else they get where
+        # to go first, then Continue, from the 16th at or before song_beat.
+        self.pulses = 0
+        if song_beat:
+            self._send(song_position_message(song_beat))
+            self._send(bytes((CONTINUE,)))
+        else:
+            self._send(bytes((START,)))
+
+    def pulse(self):
+        self._send(bytes((TIMING_CLOCK,)))
+        self.pulses += 1
+
+    def stop(self):
+        self._send(bytes((STOP,)))
+
+
+class MidiClockFollower(object):
+    # Turns incoming MIDI clock into a steady tempo and beat position.
+    # Pulses run through a second order delay locked loop (a PLL over
+    # timestamps): each one nudges the estimated time of the latest pulse
+    # and the pulse period by a fraction of how early or late it was, so
+    # input jitter is filtered out while real tempo changes are tracked.
+    # bandwidth (Hz) trades one against the other.
+    #
+    # The estimate drives the clock through the tempo map, updated only
+    # when the tempo moves by more than tolerance (a fraction), and
+    # through anchor(), which PolymeterClock re-aligns its beats to on
+    # every pulse. Listeners are called with (follower, message) for
+    # 'start', 'continue', 'stop' and 'pulse', on the input's thread.
+    def __init__(self, tempo_map=None, ppqn=PPQN, bandwidth=0.5, tolerance=0.001):
+        self.tempo_map = tempo_map
+        self.ppqn = ppqn
+        self.bandwidth = bandwidth
+        self.tolerance = tolerance
+        self.listeners = []
+        self.running = False
+        self.song_beat = 0.0            # Where the leader started or continued from
+        self.reset()
+
+    def reset(self, first_pulse=0):
+        self.pulses = first_pulse - 1   # Index of the latest pulse since start/continue
+        self.first_pulse = first_pulse
+        self.estimate = None            # Filtered time of the latest pulse
+        self.period = None              # Filtered seconds per pulse
+        self.version = 0                # Bumped on every new estimate
+
+    @property
+    def bpm(self):
+        if self.period is None:
+            return None
+        return SECONDS_PER_MINUTE / (self.period * self.ppqn)
+
+    def anchor(self):
+        # (time, beat) of the latest pulse, beats counting from start or
+        # continue. None until the tempo is known.
+        if self.version == 0:
+            return None
+        return self.estimate, (self.pulses - self.first_pulse) / float(self.ppqn)
+
+    def receive(self, data, timestamp):
+        # Callback for RawMidiInput
+        status = data[0]
+        if status == TIMING_CLOCK:
+            self.pulse(timestamp)
+        elif status == START:
+            self.song_beat = 0.0
+            self.start('start')
+        elif status == CONTINUE:
+            self.start('continue')
+        elif status == STOP:
+            self.running = False
+            self.notify('stop')
+        elif status == SONG_POSITION and len(data) == 3:
+            self.song_beat = (data[1] | data[2] << 7) / 4.0
+
+    def start(self, message):
+        # The next pulse is the first one after the start point
+        self.reset(int(round(self.song_beat * self.ppqn)) if message == 'continue' else 0)
+        self.running = True
+        self.notify(message)
+
+    def pulse(self, timestamp):
+        self.pulses += 1
+        if self.estimate is None:
+            self.estimate = timestamp
+            return
+        if self.period is None:
+            self.period = timestamp - self.estimate
+            if self.period <= 0:
+                self.reset(self.first_pulse)
+                return
+            # Loop gains for the bandwidth at this pulse rate
+            omega = 2 * math.pi * self.bandwidth * self.period
+            self.phase_gain = math.sqrt(2) * omega
+            self.period_gain = omega * omega
+            self.estimate = timestamp
+        else:
+            error = timestamp - (self.estimate + self.period)
+            self.estimate += self.period + self.phase_gain * error
+            self.period += self.period_gain * error
+        self.version += 1
+        if self.tempo_map is not None:
+            bpm = self.bpm
+            current = self.tempo_map.bpm_at(0)
+            if abs(bpm - current) > current * self.tolerance:
+                self.tempo_map.set_tempo(0, bpm)
+        self.notify('pulse')
+
+    def notify(self, message):
+        for listener in self.listeners:
+            listener(self, message)
+
+
+class PulseGenerator(object):
+    # Synthetic MIDI clock: timestamped messages a leader at bpm would
+    # send, with uniform jitter of up to +/- jitter seconds on each pulse.
+    # Seeded, so tests see the same jitter every run.
+    def __init__(self, bpm, jitter=0.0, ppqn=PPQN, seed=0):
+        self.bpm = float(bpm)
+        self.jitter = jitter
+        self.ppqn = ppqn
+        self.random = random.Random(seed)
+        self.time = 0.0
+
+    @property
+    def period(self):
+        return SECONDS_PER_MINUTE / (self.bpm * self.ppqn)
+
+    def start(self, time=0.0):
+        self.time = time
+        return [(bytes((START,)), time)]
+
+    def pulses(self, count):
+        # The ideal time of each pulse moves on by one period, only the
+        # timestamp it arrives with is jittered
+        messages = []
+        for _ in range(count):
+            jitter = self.random.uniform(-self.jitter, self.jitter)
+            messages.append((bytes((TIMING_CLOCK,)), self.time + jitter))
+            self.time += self.period
+        return messages
+
+    def stop(self):
+        return [(bytes((STOP,)), self.time)]
@@ -1,9 +1,323 @@
-__all__ = ['midi_engine']
+import os
+import select
+import threading
 
+from instrumentation import instruments, timer
 
-class MidiEngine(object):
-    def send_message(self, message, midi_channel, value):
+
+__all__ = [
+    'midi_engine', 'MidiEngine', 'MidiBackend', 'NullBackend', 'RawMidiBackend',
+    'RecordingBackend', 'BatchingBackend', 'encode_message', 'coalesce_messages', 'MidiParser', 'RawMidiInput',
+]
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROL_CHANGE = 0xB0
+DEFAULT_VELOCITY = 100
+MESSAGE_STATUS = {
+    'NoteOff': NOTE_OFF,
+    'NoteOn': NOTE_ON,
+    'ControlChange': CONTROL_CHANGE,
+}
+# Data bytes following each status, by the status' high nibble for channel
+# messages and whole status byte for system common ones
+DATA_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+SYSTEM_DATA_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1}
+SYSEX_START = 0xF0
+SYSEX_END = 0xF7
+REAL_TIME = 0xF8        # Clock, start, stop etc. are single bytes from here up
+
+
+def encode_message(message, midi_channel, value, velocity=DEFAULT_VELOCITY):
+    # For ControlChange value is the controller and velocity its new value
+    status = MESSAGE_STATUS[message]
+    if status == NOTE_OFF:
+        velocity = 0
+    return bytes((status | (midi_channel & 0x0F), value & 0x7F, velocity & 0x7F))
+
+
+def coalesce_messages(messages, merge_retriggers=False):
+    # Drops messages that cancel out within one batch: repeated NoteOns or
+    # NoteOffs for a note, and a NoteOn followed by its own NoteOff. With
+    # merge_retriggers a NoteOff followed by a NoteOn for the same note is
+    # dropped as well, leaving the note ringing instead of restarting it.
+    result = []
+    kept = {}
+    for data in messages:
+        status = data[0] & 0xF0
+        if status != NOTE_ON and status != NOTE_OFF:
+            result.append(data)
+            continue
+
+        key = (data[0] & 0x0F, data[1])
+        history = kept.setdefault(key, [])
+        if history:
+            previous_status = result[history[-1]][0] & 0xF0
+            if previous_status == status:
+                continue
+            if status == NOTE_OFF or merge_retriggers:
+                result[history.pop()] = None
+                continue
+        history.append(len(result))
+        result.append(data)
+    return [data for data in result if data is not None]
+
+
+class MidiBackend(object):
+    # delay is how long after the current tick's scheduled time a message
+    # is meant to play (groove offsets, gate lengths). Only backends that
+    # schedule, like QueuedBackend, honour it; for the rest MidiEngine
+    # moves delayed messages to the nearest tick.
+    schedules = False
+
+    def send(self, data, delay=0.0):
+        raise NotImplementedError
+
+    def send_batch(self, messages, delay=0.0):
+        for data in messages:
+            self.send(data, delay)
+
+    def begin_tick(self, timestamp):
+        pass
+
+    def flush(self):
         pass
 
+    def close(self):
+        pass
+
+
+class NullBackend(MidiBackend):
+    def send(self, data, delay=0.0):
+        pass
+
+    def send_batch(self, messages, delay=0.0):
+        pass
+
+
+class RawMidiBackend(MidiBackend):
+    # Writes raw MIDI bytes to an ALSA rawmidi device such as /dev/snd/midiC1D0,
+    # including the loopback ports the snd-virmidi module creates
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY)
+
+    def send(self, data, delay=0.0):
+        os.write(self.fd, data)
+
+    def send_batch(self, messages, delay=0.0):
+        if messages:
+            os.write(self.fd, b''.join(messages))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class RecordingBackend(MidiBackend):
+    # Keeps the delays it was asked for, so it counts as scheduling
+    schedules = True
+
+    def __init__(self, fp=None):
+        self.fp = fp
+        self.messages = []
+        self.delays = []
+        self.writes = 0
+
+    def send(self, data, delay=0.0):
+        self.send_batch([data], delay)
+
+    def send_batch(self, messages, delay=0.0):
+        if not messages:
+            return
+        self.writes += 1
+        self.messages.extend(messages)
+        self.delays.extend([delay] * len(messages))
+        if self.fp is not None:
+            self.fp.write(b''.join(messages))
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class BatchingBackend(MidiBackend):
+    # Collects every message sent during a tick and writes them to the
+    # wrapped backend in one go when the clock flushes at the end of it
+    def __init__(self, backend, merge_retriggers=False):
+        self.backend = backend
+        self.merge_retriggers = merge_retriggers
+        self.pending = {}
+
+    @property
+    def schedules(self):
+        return self.backend.schedules
+
+    def send(self, data, delay=0.0):
+        messages = self.pending.get(delay)
+        if messages is None:
+            messages = self.pending[delay] = []
+        messages.append(data)
+
+    def send_batch(self, messages, delay=0.0):
+        for data in messages:
+            self.send(data, delay)
+
+    def flush(self):
+        # One write per distinct delay, which is one write per tick unless
+        # a groove spreads the tick's sequencers apart
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = {}
+        for delay in sorted(pending):
+            messages = coalesce_messages(pending[delay], self.merge_retriggers)
+            if messages:
+                self.backend.send_batch(messages, delay)
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+
+class MidiEngine(object):
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else NullBackend()
+        self.tick_timestamp = None
+        self.tick_interval = None
+        self.deferred = []
+
+    def set_backend(self, backend):
+        self.backend.close()
+        self.backend = backend
+        self.deferred = []
+
+    def begin_tick(self, timestamp):
+        if self.tick_timestamp is not None:
+            self.tick_interval = timestamp - self.tick_timestamp
+        self.tick_timestamp = timestamp
+        self.backend.begin_tick(timestamp)
+        if self.deferred:
+            deferred = self.deferred
+            self.deferred = []
+            self.backend.send_batch(deferred)
+
+    def send_message(self, message, midi_channel, value, velocity=DEFAULT_VELOCITY, delay=0.0):
+        if instruments.enabled:
+            started = timer()
+            self.send_raw(encode_message(message, midi_channel, value, velocity), delay)
+            instruments.record('midi.send_message', timer() - started)
+        else:
+            self.send_raw(encode_message(message, midi_channel, value, velocity), delay)
+
+    def send_raw(self, data, delay=0.0):
+        if delay and not self.backend.schedules:
+            # Nothing downstream can wait, so the message goes out on
+            # whichever tick is nearest to when it was due
+            if self.tick_interval and delay * 2 >= self.tick_interval:
+                self.deferred.append(data)
+                return
+            delay = 0.0
+        self.backend.send(data, delay)
+
+    def flush(self):
+        self.backend.flush()
+
+
+class MidiParser(object):
+    # Splits a raw MIDI byte stream into whole messages. Real time bytes
+    # are picked out wherever they fall, even mid-message, running status
+    # is followed and system exclusive messages are skipped.
+    def __init__(self):
+        self.status = None
+        self.data = []
+        self.length = 0
+        self.sysex = False
+
+    def feed(self, data):
+        messages = []
+        for byte in bytearray(data):
+            if byte >= REAL_TIME:
+                messages.append(bytes((byte,)))
+            elif byte >= NOTE_OFF:
+                self.sysex = byte == SYSEX_START
+                self.status = None
+                self.data = []
+                if byte >= SYSEX_START:
+                    self.length = SYSTEM_DATA_LENGTHS.get(byte, 0)
+                else:
+                    self.length = DATA_LENGTHS[byte & 0xF0]
+                if not self.length:
+                    if byte != SYSEX_START and byte != SYSEX_END:
+                        messages.append(bytes((byte,)))
+                else:
+                    self.status = byte
+            elif self.status is not None and not self.sysex:
+                self.data.append(byte)
+                if len(self.data) == self.length:
+                    messages.append(bytes([self.status] + self.data))
+                    self.data = []
+                    if self.status >= SYSEX_START:
+                        # Only channel messages have running status
+                        self.status = None
+        return messages
+
+
+class RawMidiInput(object):
+    # Reads an ALSA rawmidi device, or any FIFO or file of raw MIDI bytes,
+    # on its own thread. callback(data, timestamp) is called there for
+    # every whole message, stamped when the bytes holding it were read.
+    def __init__(self, path, callback, timer=timer, poll_interval=0.05):
+        self.path = path
+        self.callback = callback
+        self.timer = timer
+        self.poll_interval = poll_interval
+        self.parser = MidiParser()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.fd = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        # Non blocking, so opening a FIFO doesn't wait for a writer
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='RawMidiInput')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self.fd], [], [], self.poll_interval)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 1024)
+            except BlockingIOError:
+                continue
+            if not data:
+                # A FIFO with no writer reads as empty until one opens it
+                self._stop_event.wait(self.poll_interval)
+                continue
+            timestamp = self.timer()
+            for message in self.parser.feed(data):
+                self.callback(message, timestamp)
+
 
 midi_engine = MidiEngine()
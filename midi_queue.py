@@ -0,0 +1,213 @@
+import threading
+import time
+
+from array import array
+from operator import itemgetter
+
+from midi_engine import MidiBackend
+
+
+__all__ = ['MessageRing', 'MidiWriter', 'QueuedBackend']
+
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+
+class MessageRing(object):
+    # Single producer (the sequencer engine), single consumer (MidiWriter).
+    # head and tail only ever grow and are each written by one side, so the
+    # two threads never need a lock to agree on what's in the ring.
+    def __init__(self, capacity=4096, overflow_policy=DROP_NEWEST, block_timeout=0.01):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy {!r}'.format(overflow_policy))
+        self.capacity = capacity
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.timestamps = array('d', [0.0]) * capacity
+        self.messages = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+        self.dropped = 0       # Producer side, refused by DROP_NEWEST/BLOCK
+        self.overwritten = 0   # Consumer side, lapped under DROP_OLDEST
+
+    def __len__(self):
+        return min(self.tail - self.head, self.capacity)
+
+    def push(self, timestamp, data):
+        if self.tail - self.head >= self.capacity:
+            self.overflows += 1
+            if self.overflow_policy == BLOCK:
+                blocked = not self._wait_for_space()
+            else:
+                blocked = self.overflow_policy == DROP_NEWEST
+            if blocked:
+                # Never hold the playback clock for longer than block_timeout
+                self.dropped += 1
+                return False
+            # DROP_OLDEST just overwrites, pop() notices it was lapped
+
+        slot = self.tail % self.capacity
+        self.timestamps[slot] = timestamp
+        self.messages[slot] = data
+        self.tail += 1
+        return True
+
+    def _wait_for_space(self):
+        deadline = time.perf_counter() + self.block_timeout
+        while self.tail - self.head >= self.capacity:
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0)
+        return True
+
+    def peek_timestamp(self):
+        self._skip_lapped()
+        if self.head == self.tail:
+            return None
+        return self.timestamps[self.head % self.capacity]
+
+    def pop(self):
+        while True:
+            self._skip_lapped()
+            head = self.head
+            if head == self.tail:
+                return None
+            slot = head % self.capacity
+            timestamp = self.timestamps[slot]
+            data = self.messages[slot]
+            # The producer may have lapped us while we were reading the slot
+            if self.tail - head <= self.capacity:
+                self.head = head + 1
+                return timestamp, data
+
+    def _skip_lapped(self):
+        lapped = self.tail - self.head - self.capacity
+        if lapped > 0:
+            self.overwritten += lapped
+            self.head += lapped
+
+
+class MidiWriter(object):
+    # Drains a MessageRing on its own thread, writing each message to the
+    # backend when its timestamp comes due
+    def __init__(self, ring, backend, spin_threshold=0.0005, idle_wait=0.0005, timer=time.perf_counter):
+        self.ring = ring
+        self.backend = backend
+        self.spin_threshold = spin_threshold
+        self.idle_wait = idle_wait
+        self.timer = timer
+        # An underrun is a message that reached the writer after its
+        # timestamp had already passed, i.e. the output latency target was
+        # too small to absorb how late the engine produced it
+        self.underruns = 0
+        self.written = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='MidiWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.drain()
+
+    def drain(self):
+        batch = []
+        item = self.ring.pop()
+        while item is not None:
+            batch.append(item[1])
+            item = self.ring.pop()
+        self._write(batch)
+
+    def write_due(self, now):
+        batch = []
+        ring = self.ring
+        timestamp = ring.peek_timestamp()
+        while timestamp is not None and timestamp <= now:
+            timestamp, data = ring.pop()
+            if now - timestamp > self.spin_threshold:
+                self.underruns += 1
+            batch.append(data)
+            timestamp = ring.peek_timestamp()
+        self._write(batch)
+        return timestamp
+
+    def _write(self, batch):
+        if batch:
+            self.backend.send_batch(batch)
+            self.written += len(batch)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            next_timestamp = self.write_due(self.timer())
+            if next_timestamp is None:
+                self._stop_event.wait(self.idle_wait)
+                continue
+
+            remaining = next_timestamp - self.timer()
+            if remaining > self.spin_threshold:
+                self._stop_event.wait(min(remaining - self.spin_threshold, self.idle_wait))
+            else:
+                while self.timer() < next_timestamp:
+                    pass
+
+
+class QueuedBackend(MidiBackend):
+    # Puts a MessageRing and MidiWriter between the engine and a backend, so
+    # a slow device never stalls the playback clock. Messages are stamped
+    # with the tick's scheduled time plus the output latency target.
+    schedules = True
+
+    def __init__(self, backend, latency=0.005, capacity=4096, overflow_policy=DROP_NEWEST, timer=time.perf_counter):
+        self.backend = backend
+        self.latency = latency
+        self.timer = timer
+        self.ring = MessageRing(capacity, overflow_policy)
+        self.writer = MidiWriter(self.ring, backend, timer=timer)
+        self.timestamp = None
+        self.pending = []
+        self.writer.start()
+
+    @property
+    def overflows(self):
+        return self.ring.overflows
+
+    @property
+    def underruns(self):
+        return self.writer.underruns
+
+    def begin_tick(self, timestamp):
+        self.timestamp = timestamp
+
+    def send(self, data, delay=0.0):
+        if self.timestamp is None:
+            self.ring.push(self.timer() + self.latency, data)
+            return
+        # A negative groove offset can pull a message ahead of its tick, but
+        # never further than the latency headroom allows
+        self.pending.append((self.timestamp + self.latency + max(delay, -self.latency), data))
+
+    def flush(self):
+        # The writer pops in ring order, so a tick's messages go in sorted
+        # by time or one delayed message would hold back the ones behind it
+        if self.pending:
+            pending = self.pending
+            self.pending = []
+            if len(pending) > 1:
+                pending.sort(key=itemgetter(0))
+            for timestamp, data in pending:
+                self.ring.push(timestamp, data)
+        self.timestamp = None
+
+    def close(self):
+        self.writer.stop()
+        self.backend.close()
@@ -0,0 +1,51 @@
+import weakref
+
+from timeline import Timeline
+
+
+__all__ = ['Pattern', 'PatternPool', 'pattern_pool']
+
+
+class Pattern(object):
+    # Step data shared by every sequencer playing it. Nothing writes to
+    # self.steps once the pattern exists, sequencers fork their own copy
+    # before editing (see Sequencer.set_pattern).
+    def __init__(self, steps, digest=None):
+        self.steps = steps
+        self.digest = digest or steps.digest()
+        self._compiled = None
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def compiled(self):
+        # The compiled timeline doesn't depend on the MIDI channel, so every
+        # sequencer playing the pattern shares the one compile
+        if self._compiled is None:
+            self._compiled = Timeline(self.steps).compiled
+        return self._compiled
+
+    def __repr__(self):
+        return u'<Pattern digest={}, steps={}>'.format(self.digest, len(self))
+
+
+class PatternPool(object):
+    # Interns patterns by content, so identical step data is only stored
+    # (and compiled) once. Patterns no sequencer uses any more drop out.
+    def __init__(self):
+        self.patterns = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def intern(self, steps):
+        digest = steps.digest()
+        pattern = self.patterns.get(digest)
+        if pattern is None:
+            pattern = Pattern(steps.copy(), digest)
+            self.patterns[digest] = pattern
+        return pattern
+
+
+pattern_pool = PatternPool()
@@ -0,0 +1,228 @@
+import json
+import mmap
+import struct
+import sys
+
+from array import array
+
+from sequencer import Sequencer
+from steps import EMPTY_VALUE, MASK_BYTES
+
+
+__all__ = ['SessionFile', 'save_session', 'load_session', 'export_json', 'import_json']
+
+MAGIC = b'PYSQ'
+VERSION = 3
+HEADER = struct.Struct('<4sHHI')         # magic, version, reserved, sequencer count
+RECORDS = {
+    1: struct.Struct('<iHHHhIQ'),        # id, bars, beats_per_bar, beat_subdivision,
+                                         # midi_channel (-1 for None), step_count, data offset
+    2: struct.Struct('<iHHHhIQH'),       # then the number of CC lanes
+    3: struct.Struct('<iHHHhIQHI'),      # then the number of chords
+}
+RECORD = RECORDS[VERSION]
+RECORD_FIELDS = 9
+CONTROLLER = struct.Struct('<H')
+CHORD = struct.Struct('<I16s')           # step id, 128 bit little endian note mask
+NO_MIDI_CHANNEL = -1
+BYTES_PER_STEP = 9                       # note, hold, velocity, probability, gate
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def save_session(path, sequencers):
+    # Layout: header, one fixed width record per sequencer, then each
+    # sequencer's lanes one after another: int16 note values, uint8 hold
+    # flags, uint8 velocities, uint8 probabilities, float32 gates, then
+    # per CC lane a uint16 controller number and its int16 values, then the
+    # chords as step id and note mask pairs
+    data_offset = HEADER.size + RECORD.size * len(sequencers)
+    records = []
+    for sequencer in sequencers:
+        midi_channel = NO_MIDI_CHANNEL if sequencer.midi_channel is None else sequencer.midi_channel
+        cc_lane_count = len(sequencer.steps.cc_lanes)
+        chord_count = len(sequencer.steps.chords)
+        records.append(RECORD.pack(
+            sequencer.id, sequencer.bars, sequencer.beats_per_bar, sequencer.beat_subdivision,
+            midi_channel, sequencer.step_count, data_offset, cc_lane_count, chord_count
+        ))
+        data_offset += sequencer.step_count * BYTES_PER_STEP
+        data_offset += cc_lane_count * (CONTROLLER.size + sequencer.step_count * 2)
+        data_offset += chord_count * CHORD.size
+
+    with open(path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, 0, len(sequencers)))
+        fp.write(b''.join(records))
+        for sequencer in sequencers:
+            steps = sequencer.steps
+            fp.write(_little_endian(steps.notes).tobytes())
+            fp.write(steps.holds.tobytes())
+            fp.write(steps.velocities.tobytes())
+            fp.write(steps.probabilities.tobytes())
+            fp.write(_little_endian(steps.gates).tobytes())
+            for controller in sorted(steps.cc_lanes):
+                fp.write(CONTROLLER.pack(controller))
+                fp.write(_little_endian(steps.cc_lanes[controller]).tobytes())
+            for step_id in sorted(steps.chords):
+                fp.write(CHORD.pack(step_id, steps.chords[step_id].to_bytes(MASK_BYTES, 'little')))
+
+
+class SessionFile(object):
+    # Memory maps a saved session so individual sequencers can be listed
+    # and loaded without reading the rest of the file
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ValueError('{} is not a pyseq session file'.format(path))
+        magic, self.version, _, self.sequencer_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is not a pyseq session file'.format(path))
+        if self.version not in RECORDS:
+            self.close()
+            raise ValueError('{} was saved by a newer version (format {})'.format(path, self.version))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.sequencer_count
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def header(self, index):
+        if not 0 <= index < self.sequencer_count:
+            raise IndexError(index)
+        record_format = RECORDS[self.version]
+        record = record_format.unpack_from(self.map, HEADER.size + record_format.size * index)
+        # Counts of things older versions didn't store are zero
+        record += (0,) * (RECORD_FIELDS - len(record))
+        (_id, bars, beats_per_bar, beat_subdivision, midi_channel, step_count, data_offset,
+         cc_lane_count, chord_count) = record
+        return {
+            'id': _id,
+            'bars': bars,
+            'beats_per_bar': beats_per_bar,
+            'beat_subdivision': beat_subdivision,
+            'midi_channel': None if midi_channel == NO_MIDI_CHANNEL else midi_channel,
+            'step_count': step_count,
+            'data_offset': data_offset,
+            'cc_lane_count': cc_lane_count,
+            'chord_count': chord_count,
+        }
+
+    def _read(self, typecode, offset, count):
+        values = array(typecode)
+        values.frombytes(self.map[offset:offset + count * values.itemsize])
+        return _little_endian(values), offset + count * values.itemsize
+
+    def load(self, index):
+        header = self.header(index)
+        sequencer = Sequencer(
+            header['id'],
+            bars=header['bars'],
+            beats_per_bar=header['beats_per_bar'],
+            steps_per_beat=header['beat_subdivision'],
+            midi_channel=header['midi_channel'],
+            step_count=header['step_count']
+        )
+        step_count = header['step_count']
+        steps = sequencer.steps
+        offset = header['data_offset']
+        steps.notes, offset = self._read('h', offset, step_count)
+        steps.holds, offset = self._read('B', offset, step_count)
+        if self.version > 1:
+            steps.velocities, offset = self._read('B', offset, step_count)
+            steps.probabilities, offset = self._read('B', offset, step_count)
+            steps.gates, offset = self._read('f', offset, step_count)
+            for _ in range(header['cc_lane_count']):
+                controller, = CONTROLLER.unpack_from(self.map, offset)
+                steps.cc_lanes[controller], offset = self._read('h', offset + CONTROLLER.size, step_count)
+            for _ in range(header['chord_count']):
+                step_id, mask = CHORD.unpack_from(self.map, offset)
+                steps.chords[step_id] = int.from_bytes(mask, 'little')
+                offset += CHORD.size
+        sequencer.recompile()
+        return sequencer
+
+    def load_all(self):
+        return [self.load(index) for index in range(self.sequencer_count)]
+
+
+def load_session(path):
+    with SessionFile(path) as session:
+        return session.load_all()
+
+
+def export_json(sequencers, fp):
+    json.dump({
+        'version': VERSION,
+        'sequencers': [
+            {
+                'id': sequencer.id,
+                'bars': sequencer.bars,
+                'beats_per_bar': sequencer.beats_per_bar,
+                'beat_subdivision': sequencer.beat_subdivision,
+                'midi_channel': sequencer.midi_channel,
+                'notes': [step.value for step in sequencer.steps.values()],
+                'holds': list(sequencer.steps.holds),
+                'velocities': list(sequencer.steps.velocities),
+                'gates': list(sequencer.steps.gates),
+                'probabilities': list(sequencer.steps.probabilities),
+                'cc_lanes': dict(
+                    (str(controller), [None if value == EMPTY_VALUE else value for value in lane])
+                    for controller, lane in sequencer.steps.cc_lanes.items()
+                ),
+                'chords': dict(
+                    (str(step_id), sequencer.steps.chord(step_id)) for step_id in sequencer.steps.chords
+                ),
+            }
+            for sequencer in sequencers
+        ]
+    }, fp)
+
+
+def import_json(fp):
+    session = json.load(fp)
+    sequencers = []
+    for data in session['sequencers']:
+        sequencer = Sequencer(
+            data['id'],
+            bars=data['bars'],
+            beats_per_bar=data['beats_per_bar'],
+            steps_per_beat=data['beat_subdivision'],
+            midi_channel=data['midi_channel'],
+            step_count=len(data['notes'])
+        )
+        steps = sequencer.steps
+        for step_id, (value, is_hold) in enumerate(zip(data['notes'], data['holds'])):
+            steps.set(step_id, value, is_hold)
+        # Lanes are missing from files written before they existed
+        for step_id, velocity in enumerate(data.get('velocities', [])):
+            steps.set_velocity(step_id, velocity)
+        for step_id, gate in enumerate(data.get('gates', [])):
+            steps.set_gate(step_id, gate)
+        for step_id, probability in enumerate(data.get('probabilities', [])):
+            steps.set_probability(step_id, probability)
+        for controller, values in data.get('cc_lanes', {}).items():
+            for step_id, value in enumerate(values):
+                steps.set_cc(step_id, int(controller), value)
+        for step_id, chord in data.get('chords', {}).items():
+            steps.set_chord(int(step_id), chord, steps.holds[int(step_id)])
+        sequencer.recompile()
+        sequencers.append(sequencer)
+    return sequencers
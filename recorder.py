@@ -0,0 +1,92 @@
+import math
+
+from collections import deque
+
+from midi_engine import NOTE_OFF, NOTE_ON
+
+
+__all__ = ['NoteRecorder', 'quantize_position']
+
+
+def quantize_position(position, strength=1.0):
+    # The step a note played at a fractional step position is written to.
+    # Steps have no timing of their own within them, so strength is how
+    # close to a step, in half steps, a note has to be to be pulled onto
+    # it: at 1 every note snaps to the nearest step, at 0 each stays on the
+    # step it was played in.
+    nearest = math.floor(position + 0.5)
+    if nearest - position <= strength * 0.5:
+        return int(nearest)
+    return int(math.floor(position))
+
+
+class NoteRecorder(object):
+    # Records live MIDI input into a sequencer while a PolymeterClock plays
+    # it. receive() is RawMidiInput's callback and only runs on its thread:
+    # each NoteOn is held until its NoteOff, then the whole note is queued
+    # with where it started and ended in the sequencer's steps.
+    #
+    # flush() quantizes what's queued and writes it with one record_notes()
+    # call, so however many notes came in since the last flush (a drum roll,
+    # a chord) listeners and the UI hear about one edit. Call it from the
+    # thread that makes the sequencer's other edits, e.g. on a UI timer.
+    def __init__(self, clock, sequencer, strength=1.0, midi_channel=None):
+        self.clock = clock
+        self.sequencer = sequencer
+        self.strength = strength
+        self.midi_channel = midi_channel    # None records every channel
+        self.held = {}                      # note: (position, velocity)
+        self.recorded = deque()             # (start, end, note, velocity) waiting for flush()
+
+    def receive(self, data, timestamp):
+        status = data[0]
+        kind = status & 0xF0
+        if len(data) < 3 or (kind != NOTE_ON and kind != NOTE_OFF):
+            return
+        if self.midi_channel is not None and status & 0x0F != self.midi_channel:
+            return
+        position = self.clock.position_at(self.sequencer, timestamp)
+        if position is None:
+            return
+        value, velocity = data[1], data[2]
+        started = self.held.pop(value, None)
+        if started is not None:
+            # A NoteOn without a NoteOff first ends the note as well
+            self.recorded.append((started[0], position, value, started[1]))
+        if kind == NOTE_ON and velocity:
+            self.held[value] = (position, velocity)
+
+    def release(self, timestamp):
+        # Ends every held note, once the input has stopped
+        for value in list(self.held):
+            position, velocity = self.held.pop(value)
+            self.recorded.append((position, self.clock.position_at(self.sequencer, timestamp), value, velocity))
+
+    def flush(self):
+        # Returns how many notes were written. Notes are taken off the
+        # front of the queue while receive() appends to the back, so one
+        # arriving meanwhile waits for the next flush rather than being lost.
+        queue = self.recorded
+        recorded = []
+        while queue:
+            recorded.append(queue.popleft())
+        if not recorded:
+            return 0
+        step_count = self.sequencer.step_count
+        strength = self.strength
+        # Notes starting on the same step make a chord, held as long as the
+        # longest and as loud as the loudest
+        notes = {}
+        for start, end, value, velocity in recorded:
+            first_position = quantize_position(start, strength)
+            length = max(1, quantize_position(end, strength) - first_position)
+            step_id = first_position % step_count
+            note = notes.get(step_id)
+            if note is None:
+                notes[step_id] = [step_id, step_id + length - 1, 1 << value, velocity]
+            else:
+                note[1] = max(note[1], step_id + length - 1)
+                note[2] |= 1 << value
+                note[3] = max(note[3], velocity)
+        self.sequencer.record_notes([tuple(notes[step_id]) for step_id in sorted(notes)])
+        return len(recorded)
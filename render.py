@@ -0,0 +1,152 @@
+import argparse
+import json
+import sys
+import time
+
+from instrumentation import instruments, timer
+from scheduler import StepScheduler
+from tempo import TempoMap
+
+
+__all__ = ['OfflineRenderer', 'RenderStats']
+
+DEFAULT_BPM = 120
+
+
+class RenderStats(object):
+    def __init__(self):
+        self.events = 0
+        self.steps = 0
+        self.bars = 0
+        self.duration = 0.0         # Length of the rendered music in seconds
+        self.elapsed = 0.0          # Wall clock time it took to render
+
+    @property
+    def events_per_second(self):
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bars_per_second(self):
+        return self.bars / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def realtime_factor(self):
+        return self.duration / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'events': self.events,
+            'steps': self.steps,
+            'bars': self.bars,
+            'duration': self.duration,
+            'elapsed': self.elapsed,
+            'events_per_second': self.events_per_second,
+            'bars_per_second': self.bars_per_second,
+            'realtime_factor': self.realtime_factor,
+        }
+
+
+class OfflineRenderer(object):
+    # Runs the same per-step logic as PolymeterClock, without Kivy and
+    # without waiting: a StepScheduler hands over sequencers as their steps
+    # come due and each event is stamped with the time it would have been
+    # played at. Step times come from a TempoMap, a constant bpm one unless
+    # given.
+    def __init__(self, sequencers, bpm=DEFAULT_BPM, steps_per_beat=None, steps_per_bar=None, tempo_map=None):
+        self.sequencers = sequencers
+        self.bpm = bpm
+        self.steps_per_beat = steps_per_beat or sequencers[0].beat_subdivision
+        self.steps_per_bar = steps_per_bar or sequencers[0].steps_per_bar
+        self.tempo_map = tempo_map or TempoMap(
+            sequencers[0].step_count, bpm, self.steps_per_bar // self.steps_per_beat, self.steps_per_beat
+        )
+        self.stats = RenderStats()
+
+    def events(self, bars):
+        # Yields (timestamp, sequencer id, message, midi_channel, data1,
+        # data2), starting every sequencer from its first step. Timestamps
+        # include groove offsets and gates, so they are not strictly ordered.
+        for sequencer in self.sequencers:
+            sequencer.locate(0)
+
+        stats = self.stats = RenderStats()
+        step_total = bars * self.steps_per_bar
+        last_beat = step_total / float(self.steps_per_beat)
+        tempo_map = self.tempo_map
+        map_steps_per_beat = tempo_map.steps_per_beat
+        sequencers = self.sequencers
+        scheduler = StepScheduler(sequencers)
+        scheduler.start(first_position=0)
+        started = time.perf_counter()
+        while True:
+            beat = scheduler.peek()
+            if beat is None or beat >= last_beat:
+                break
+            beat, indexes = scheduler.pop()
+            position = beat * map_steps_per_beat
+            step_timestamp = tempo_map.time_at(position)
+            for index in indexes:
+                sequencer = sequencers[index]
+                if instruments.enabled:
+                    advance_started = timer()
+                    events = sequencer.advance()
+                    instruments.record('sequencer.advance', timer() - advance_started)
+                else:
+                    events = sequencer.advance()
+                scheduler.schedule(index)
+                if not events:
+                    continue
+                interval = tempo_map.time_at(position + map_steps_per_beat / float(sequencer.beat_subdivision))
+                interval -= step_timestamp
+                timestamp = step_timestamp
+                if sequencer.groove_offsets is not None:
+                    timestamp += sequencer.groove_offsets[sequencer.active_step] * interval
+                for event in events:
+                    stats.events += 1
+                    yield (timestamp + event[5] * interval, sequencer.id, event[1], event[2], event[3], event[4])
+        stats.steps = step_total
+        stats.bars = bars
+        stats.duration = tempo_map.time_of(step_total)
+        stats.elapsed = time.perf_counter() - started
+
+    def run(self, bars, callback=None):
+        for event in self.events(bars):
+            if callback is not None:
+                callback(*event)
+        return self.stats
+
+
+def print_event(timestamp, sequencer_id, message, midi_channel, data1, data2):
+    print('{:.6f} #{} {} ch={} {} {}'.format(timestamp, sequencer_id, message, midi_channel, data1, data2))
+
+
+def main(argv=None):
+    from persistence import load_session
+
+    parser = argparse.ArgumentParser(description='Render a saved session faster than real time')
+    parser.add_argument('session')
+    parser.add_argument('--bars', type=int, default=16)
+    parser.add_argument('--bpm', type=float, default=DEFAULT_BPM)
+    parser.add_argument('--events', action='store_true', help='Print every rendered event')
+    parser.add_argument('--json', action='store_true', help='Print the throughput metrics as JSON')
+    parser.add_argument('--instrument', action='store_true', help='Dump per-tick latency histograms afterwards')
+    args = parser.parse_args(argv)
+
+    if args.instrument:
+        instruments.enable()
+
+    renderer = OfflineRenderer(load_session(args.session), bpm=args.bpm)
+    stats = renderer.run(args.bars, print_event if args.events else None)
+
+    if args.json:
+        print(json.dumps(stats.as_dict(), sort_keys=True))
+    else:
+        print('{events} events, {bars} bars in {elapsed:.4f}s: {events_per_second:.0f} events/s, '
+              '{bars_per_second:.0f} bars/s, {realtime_factor:.0f}x real time'.format(**stats.as_dict()))
+    if args.instrument:
+        print(instruments.dump())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
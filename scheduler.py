@@ -0,0 +1,217 @@
+import heapq
+import math
+
+from timeline import Timeline
+
+
+__all__ = ['StepScheduler', 'ArrangementScheduler']
+
+
+class StepScheduler(object):
+    # Merges sequencers running at their own step rates and pattern lengths
+    # into one queue ordered by beat. Positions count a sequencer's steps
+    # from start(), position p falls on beat p / beat_subdivision, so
+    # triplets and 16ths line up on the beat without a common tick rate.
+    #
+    # Each sequencer only has an entry for the next step it sends anything
+    # on. Empty stretches are skipped and a sequencer with nothing to play
+    # has no entry at all, until reschedule() is told it was edited.
+    # Sequencers in follow are queued on every step regardless, e.g. the
+    # one on screen whose playhead should move.
+    def __init__(self, sequencers, follow=()):
+        self.sequencers = sequencers
+        self.follow = list(follow)
+        self.start()
+
+    def start(self, first_position=1):
+        # Each sequencer's active step counts as played at first_position - 1
+        sequencers = self.sequencers
+        self.heap = []
+        self.anchors = [sequencer.active_step - first_position + 1 for sequencer in sequencers]
+        self.positions = [first_position - 1] * len(sequencers)
+        self.due = [None] * len(sequencers)
+        for index in range(len(sequencers)):
+            self.schedule(index)
+
+    def locate(self, beat):
+        # Starts over with every sequencer on the step it plays at beat
+        for sequencer in self.sequencers:
+            sequencer.locate(int(beat * sequencer.beat_subdivision))
+        self.start(first_position=0)
+
+    def index(self, sequencer):
+        for index, scheduled in enumerate(self.sequencers):
+            if scheduled is sequencer:
+                return index
+        raise ValueError('{} is not scheduled'.format(sequencer))
+
+    def step_id(self, index, position):
+        return (self.anchors[index] + position) % self.sequencers[index].step_count
+
+    def beat(self, index, position):
+        return position / float(self.sequencers[index].beat_subdivision)
+
+    def schedule(self, index):
+        # Queues the sequencer's next step that sends anything after its
+        # last played position
+        sequencer = self.sequencers[index]
+        position = self.positions[index]
+        if sequencer in self.follow:
+            steps = 1
+        else:
+            steps = sequencer.steps_until_due(self.step_id(index, position))
+        if steps is None:
+            self.due[index] = None
+            return
+        due = position + steps
+        if due != self.due[index]:
+            self.due[index] = due
+            heapq.heappush(self.heap, (self.beat(index, due), index, due))
+
+    def reschedule(self, index, beat):
+        # After an edit: steps before beat have passed and can't be played
+        # late any more, queue whatever is due from there on
+        position = int(math.floor(beat * self.sequencers[index].beat_subdivision))
+        if position > self.positions[index]:
+            self.positions[index] = position
+        self.schedule(index)
+
+    def peek(self):
+        # Beat of the next due step, None when nothing is queued. Entries
+        # superseded by a reschedule are dropped on the way.
+        heap = self.heap
+        due = self.due
+        while heap and due[heap[0][1]] != heap[0][2]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop(self):
+        # (beat, [index]) of every sequencer due on the next beat, each left
+        # on the step before its due one so that tick() or advance() plays
+        # it. Call schedule() for each once it has been played.
+        beat = self.peek()
+        heap = self.heap
+        due = self.due
+        indexes = []
+        while heap and heap[0][0] == beat:
+            _, index, position = heapq.heappop(heap)
+            if due[index] != position:
+                continue
+            due[index] = None
+            self.positions[index] = position
+            self.cue(index, position)
+            indexes.append(index)
+        return beat, indexes
+
+    def cue(self, index, position):
+        self.sequencers[index].active_step = self.step_id(index, position - 1)
+
+
+class ArrangementScheduler(StepScheduler):
+    # Schedules an Arrangement: each sequencer plays its track's sections in
+    # turn instead of looping one pattern. Positions count from the song
+    # position start() or locate() left each track at, anchors turn them
+    # into positions on the track.
+    #
+    # A sequencer is always due on the first step of its next section, so
+    # pop() can swap the section's pattern in (Sequencer.cue_pattern) just
+    # before it plays. The next section is compiled and its timeline built
+    # by schedule(), after the first step of the one before it has played
+    # rather than on any step's deadline.
+    def __init__(self, arrangement, follow=()):
+        self.arrangement = arrangement
+        self.tracks = arrangement.tracks
+        self.offsets = [0] * len(self.tracks)
+        super(ArrangementScheduler, self).__init__(arrangement.sequencers, follow)
+
+    def start(self, first_position=1):
+        # Each track's first_position plays the step at its offset
+        tracks = self.tracks
+        self.heap = []
+        self.anchors = [offset - first_position for offset in self.offsets]
+        self.positions = [first_position - 1] * len(tracks)
+        self.due = [None] * len(tracks)
+        self.sections = [None] * len(tracks)
+        self.prefetched = [None] * len(tracks)
+        for index, track in enumerate(tracks):
+            offset = self.offsets[index]
+            section = track.section_at(offset)
+            self.enter(index, section)
+            if section is not None:
+                track.sequencer.active_step = track.step_id(section, offset - 1)
+            self.schedule(index)
+
+    def locate(self, beat):
+        # Seeking is a bisect per track, nothing before beat is replayed
+        self.offsets = [int(beat * track.sequencer.beat_subdivision) for track in self.tracks]
+        self.start(first_position=0)
+
+    def enter(self, index, section):
+        # Swaps in section's pattern, prefetched if schedule() got to it
+        track = self.tracks[index]
+        self.sections[index] = section
+        if section is None:
+            return
+        pattern = track.patterns[section]
+        prefetched = self.prefetched[index]
+        self.prefetched[index] = None
+        if prefetched is not None and prefetched[0] == section and prefetched[1] is pattern:
+            track.sequencer.cue_pattern(pattern, prefetched[2])
+        else:
+            track.sequencer.cue_pattern(pattern)
+
+    def prefetch(self, index, section):
+        # Compiles section's pattern and builds its timeline ahead of time
+        track = self.tracks[index]
+        pattern = track.patterns[section]
+        timeline = Timeline(pattern.steps, track.sequencer.midi_channel, pattern.compiled)
+        timeline.event_steps
+        self.prefetched[index] = (section, pattern, timeline)
+
+    def step_id(self, index, position):
+        track = self.tracks[index]
+        position += self.anchors[index]
+        section = track.section_at(position)
+        return None if section is None else track.step_id(section, position)
+
+    def schedule(self, index):
+        # Queues the next step that sends anything, or the first step of
+        # the next section, whichever comes first
+        track = self.tracks[index]
+        sequencer = track.sequencer
+        position = self.positions[index]
+        last = self.anchors[index] + position
+        section = self.sections[index]
+        if section is not None and self.prefetched[index] is None and section + 1 < len(track):
+            self.prefetch(index, section + 1)
+        next_section = track.section_at(last + 1)
+        if next_section is None:
+            # Once more past the end of the song to stop what's sounding
+            steps = 1 if section is not None and sequencer.sounding else None
+        elif next_section != section or sequencer in self.follow:
+            steps = 1
+        else:
+            end = track.starts[section + 1]
+            steps = sequencer.steps_until_due(track.step_id(section, last))
+            if steps is None or last + steps > end:
+                steps = end - last
+        if steps is None:
+            self.due[index] = None
+            return
+        due = position + steps
+        if due != self.due[index]:
+            self.due[index] = due
+            heapq.heappush(self.heap, (self.beat(index, due), index, due))
+
+    def cue(self, index, position):
+        track = self.tracks[index]
+        position += self.anchors[index]
+        section = track.section_at(position)
+        if section != self.sections[index]:
+            self.enter(index, section)
+        if section is not None:
+            track.sequencer.active_step = track.step_id(section, position - 1)
+
+    def audible(self, index):
+        # Whether the step just popped for index should be heard
+        return self.sections[index] is not None and self.arrangement.audible(self.tracks[index])
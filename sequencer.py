@@ -1,4 +1,10 @@
-from midi_engine import midi_engine
+import random
+
+from instrumentation import instruments, timer
+from midi_engine import DEFAULT_VELOCITY, midi_engine
+from pattern import pattern_pool
+from steps import ALWAYS, EMPTY_NOTE, FULL_GATE, StepStore, StepView, mask_notes, note_mask  # noqa: F401
+from timeline import Timeline
 
 
 __all__ = ['Sequencer']
@@ -8,9 +14,18 @@ MAXIMUM_OCTAVES = 4    # 0 - 4 == 5 Octaves (2 == Octave 4)
 
 
 class Note(object):
-    def __init__(self, value=None, is_hold=False):
+    def __init__(self, value=None, is_hold=False, velocity=DEFAULT_VELOCITY, gate=FULL_GATE, probability=ALWAYS,
+                 chord=None):
         self.is_hold = is_hold
         self.value = value
+        self.velocity = velocity
+        self.gate = gate
+        self.probability = probability
+        self.chord = sorted(chord) if chord else ([] if value is None else [value])
+
+    @property
+    def mask(self):
+        return note_mask(self.chord)
 
     def __repr__(self):
         return u'<Note value={}, is_hold={}>'.format(self.value, self.is_hold)
@@ -26,37 +41,100 @@ class Sequencer(object):
         self.beats_per_bar = kwargs.get('beats_per_bar', 4)
         self.beat_subdivision = kwargs.get('steps_per_beat', 4)
         self.steps_per_bar = self.beats_per_bar * self.beat_subdivision
-        self.update_step_count()
         self.midi_channel = kwargs.get('midi_channel')
+        self.pattern = None
+        self.groove = kwargs.get('groove')
+        self.groove_offsets = None
+        self.random = random.Random(kwargs.get('seed'))
+        self.sounding = 0          # Mask of the notes this sequencer has playing
+        self.length = kwargs.get('step_count')     # Any step count, None to fill whole bars
+        if self.length is not None and self.length < 1:
+            raise ValueError('Sequencers need at least one step, not {}'.format(self.length))
+        self.listeners = []        # Called with (sequencer, first_step_id, last_step_id) after edits
+        self.pattern_listeners = []    # Called with (sequencer) when another pattern replaces the steps
+        self.update_step_count()
 
     def update_step_count(self):
-        self.step_count = self.bars * self.beats_per_bar * self.beat_subdivision
+        self.step_count = self.length or self.bars * self.beats_per_bar * self.beat_subdivision
         if not hasattr(self, 'steps'):
-            self.steps = dict(
-                [
-                    (step_id, Note(None))
-                    for step_id in range(self.step_count)
-                ]
-            )
+            self.steps = StepStore(self.step_count)
+            self.timeline = Timeline(self.steps, self.midi_channel)
+        else:
+            self.fork_pattern()
+            self.steps.resize(self.step_count)
+            self.timeline.compile()
+            self.notify(0, self.step_count - 1)
+        self.compile_groove()
+
+    def notify(self, first_step_id, last_step_id):
+        for listener in self.listeners:
+            listener(self, first_step_id, last_step_id)
+
+    def changed(self, first_step_id, last_step_id):
+        # Every edit ends here, so anything scheduled off the timeline (see
+        # StepScheduler) hears about it as soon as the timeline is patched
+        self.timeline.patch(first_step_id, last_step_id)
+        self.notify(first_step_id, last_step_id)
+
+    def set_pattern(self, pattern):
+        # Plays a shared Pattern without copying it: steps and the compiled
+        # events are the pattern's own until the first edit forks them
+        self.cue_pattern(pattern)
+        if self.active_step >= self.step_count:
+            self.active_step = 0
+        self.notify(0, self.step_count - 1)
+
+    def cue_pattern(self, pattern, timeline=None):
+        # set_pattern() for an arrangement changing section between steps.
+        # That's not an edit, so only pattern_listeners are told, and
+        # timeline may come already built over the pattern's compiled events.
+        self.pattern = pattern
+        self.steps = pattern.steps
+        self.timeline = timeline or Timeline(self.steps, self.midi_channel, pattern.compiled)
+        if len(pattern) != self.step_count:
+            self.step_count = len(pattern)
+            self.compile_groove()
+        for listener in self.pattern_listeners:
+            listener(self)
+
+    def set_groove(self, groove):
+        self.groove = groove
+        self.compile_groove()
+
+    def compile_groove(self):
+        # Straight grooves compile to None so tick() keeps its plain path
+        if self.groove is None or self.groove.is_straight:
+            self.groove_offsets = None
         else:
-            self.steps = {}
-            for step_id in range(self.step_count):
-                if step_id not in self.steps:
-                    self.steps[step_id] = Note(None)
+            self.groove_offsets = self.groove.compile(self.step_count)
+
+    def share_pattern(self, pool=pattern_pool):
+        # Swaps this sequencer's steps for the pool's copy of the same
+        # content, so identical patterns across sequencers are stored once
+        if self.pattern is None:
+            self.set_pattern(pool.intern(self.steps))
+        return self.pattern
+
+    def fork_pattern(self):
+        if self.pattern is None:
+            return
+        self.steps = self.steps.copy()
+        self.timeline = self.timeline.copy(self.steps)
+        self.pattern = None
 
     def get_previous_step(self, step_id=None):
-        step_id = step_id or self.active_step
+        step_id = self.active_step if step_id is None else step_id
         previous_step_id = step_id - 1 if step_id != 0 else self.step_count - 1
         return self.steps[previous_step_id]
 
     def get_next_step(self, step_id=None):
-        step_id = step_id or self.active_step
-        next_step_id = step_id + 1 if step_id != self.step_count else 0
+        step_id = self.active_step if step_id is None else step_id
+        next_step_id = step_id + 1 if step_id != self.step_count - 1 else 0
         return self.steps[next_step_id]
 
-    def start_note(self, value):
+    def start_note(self, value, velocity=DEFAULT_VELOCITY):
         if self.midi_channel is not None:
-            midi_engine.send_message('NoteOn', self.midi_channel, value)
+            midi_engine.send_message('NoteOn', self.midi_channel, value, velocity=velocity)
 
     def stop_note(self, value):
         if self.midi_channel is not None:
@@ -67,48 +145,221 @@ class Sequencer(object):
             return
 
         previous_step = self.get_previous_step()
-        if previous_step.value:
-            self.stop_note(previous_step.value)
+        for value in previous_step.chord:
+            self.stop_note(value)
+
+        if self.chance(step.probability):
+            for value in step.chord:
+                self.start_note(value, step.velocity)
+
+    def chance(self, probability):
+        return probability >= ALWAYS or self.random.random() * ALWAYS < probability
+
+    def locate(self, position=0):
+        # Leaves the sequencer on the step before position, so the next
+        # tick() plays it
+        self.active_step = (position - 1) % self.step_count
 
-        if step.value:
-            self.start_note(step.value)
+    def skip(self):
+        # Moves on a step without playing it, e.g. while muted, letting go
+        # of anything still sounding
+        self.release_all()
+        self.active_step = self.active_step + 1 if self.active_step + 1 < self.step_count else 0
+
+    def release_all(self):
+        # NoteOffs for everything still sounding, e.g. on stop or before
+        # moving to another MIDI channel
+        if self.midi_channel is not None:
+            for value in mask_notes(self.sounding):
+                midi_engine.send_message('NoteOff', self.midi_channel, value, 0)
+        self.sounding = 0
 
     def tick(self, delta):
+        started = timer() if instruments.enabled else None
         self.active_step += 1
         if self.active_step > (self.step_count - 1):
             self.active_step = 0
-        self.process_step(self.steps[self.active_step])
+        step_id = self.active_step
+        probability = self.steps.probabilities[step_id]
+        events, self.sounding = self.timeline.play(
+            step_id, self.sounding, self.midi_channel, probability >= ALWAYS or self.chance(probability)
+        )
+        if delta:
+            # Groove and event offsets are in fractions of a step, delta is
+            # one step long
+            offsets = self.groove_offsets
+            step_offset = offsets[step_id] if offsets is not None else 0.0
+            for event in events:
+                midi_engine.send_message(event[1], event[2], event[3], event[4], (step_offset + event[5]) * delta)
+        else:
+            for event in events:
+                midi_engine.send_message(event[1], event[2], event[3], event[4])
+        if started is not None:
+            instruments.record('sequencer.tick', timer() - started)
+
+    def advance(self):
+        # Moves to the next step like tick(), but hands back the due events
+        # instead of sending them
+        self.active_step += 1
+        if self.active_step > (self.step_count - 1):
+            self.active_step = 0
+        probability = self.steps.probabilities[self.active_step]
+        events, self.sounding = self.timeline.play(
+            self.active_step, self.sounding, self.midi_channel, probability >= ALWAYS or self.chance(probability)
+        )
+        return events
+
+    def steps_until_due(self, step_id=None):
+        # How many steps after step_id (the active step by default) the next
+        # one that sends anything is, None while nothing ever will
+        step_id = self.active_step if step_id is None else step_id
+        return self.timeline.steps_until_due(step_id, self.sounding)
+
+    def recompile(self):
+        # Only needed after writing to self.steps directly, the edit methods
+        # below keep the timeline patched themselves
+        self.fork_pattern()
+        self.timeline.compile()
+        self.notify(0, self.step_count - 1)
 
     def set_note_for_step(self, step_id, value=None):
-        self.steps[step_id].value = value
-        self.steps[step_id].is_hold = False
+        self.fork_pattern()
+        self.steps.set(step_id, value)
+        self.changed(step_id, step_id)
 
     def clear_note_for_step(self, step_id):
-        self.steps[step_id].value = None
-        self.steps[step_id].is_hold = False
-        current_step = step_id
-        while self.get_next_step(current_step).is_hold:
-            self.steps[current_step + 1].value = None
-            self.steps[current_step + 1].is_hold = False
-            current_step = current_step + 1
+        self.fork_pattern()
+        self.steps.set(step_id, None)
+        holds = self.steps.holds
+        current_step = step_id + 1
+        while current_step < self.step_count and holds[current_step]:
+            self.steps.set(current_step, None)
+            current_step += 1
+        self.changed(step_id, current_step - 1)
 
     def set_note_for_step_range(self, first_step_id, last_step_id, value):
-        self.steps[first_step_id].value = value
-        self.steps[first_step_id].is_hold = False
+        self.set_chord_for_step_range(first_step_id, last_step_id, [] if value is None else [value])
+
+    def set_chord_for_step(self, step_id, values):
+        self.fork_pattern()
+        self.steps.set_chord(step_id, values)
+        self.changed(step_id, step_id)
+
+    def set_chord_for_step_range(self, first_step_id, last_step_id, values):
+        self.fork_pattern()
+        mask = note_mask(values)
+        self.steps.set_mask(first_step_id, mask)
 
+        notes = self.steps.notes
+        last_written_step_id = first_step_id
         for held_step_id in range(first_step_id + 1, last_step_id + 1):
-            if self.steps[held_step_id].value is not None or held_step_id > self.step_count:
+            if held_step_id >= self.step_count or notes[held_step_id] != EMPTY_NOTE:
                 # Bail, we won't override a programmed step
-                return
-            self.steps[held_step_id].value = value
-            self.steps[held_step_id].is_hold = True
+                break
+            self.steps.set_mask(held_step_id, mask, is_hold=True)
+            last_written_step_id = held_step_id
+        self.changed(first_step_id, last_written_step_id)
+
+    def set_velocity(self, step_id, velocity):
+        self.fork_pattern()
+        self.steps.set_velocity(step_id, velocity)
+        self.changed(step_id, step_id)
+
+    def set_gate(self, step_id, gate):
+        # Set on the step a note starts on, it shortens the note's last step
+        self.fork_pattern()
+        self.steps.set_gate(step_id, gate)
+        holds = self.steps.holds
+        last_step_id = step_id
+        while last_step_id + 1 < self.step_count and holds[last_step_id + 1]:
+            last_step_id += 1
+        self.changed(step_id, last_step_id)
+
+    def set_probability(self, step_id, probability):
+        # Rolled as the step plays, so the timeline doesn't change
+        self.fork_pattern()
+        self.steps.set_probability(step_id, probability)
+        self.notify(step_id, step_id)
+
+    def set_cc(self, step_id, controller, value):
+        self.fork_pattern()
+        self.steps.set_cc(step_id, controller, value)
+        self.changed(step_id, step_id)
+
+    def remove_cc_lane(self, controller):
+        self.fork_pattern()
+        self.steps.remove_cc_lane(controller)
+        self.timeline.compile()
+        self.notify(0, self.step_count - 1)
 
-        held_step = self.steps[first_step_id]
-        if held_step.is_hold or last_step_id > self.step_count:
+    def edit_steps(self, first_step_id, last_step_id, edit):
+        # Runs a bulk edit, a function taking a StepStore, over the steps
+        # first..last (all of them when last_step_id is None). The timeline
+        # is patched and listeners told once for the whole range.
+        self.fork_pattern()
+        step_count = self.step_count
+        if last_step_id is None or last_step_id >= step_count:
+            last_step_id = step_count - 1
+        if first_step_id == 0 and last_step_id == step_count - 1:
+            edit(self.steps)
+            self.steps.repair_holds(0, step_count - 1)
+            self.timeline.compile()
+        else:
+            steps = self.steps.slice(first_step_id, last_step_id)
+            edit(steps)
+            self.steps.paste(first_step_id, steps)
+            # The edit may have split a note held over either end
+            following_step_id = (last_step_id + 1) % step_count
+            self.steps.repair_holds(first_step_id, last_step_id)
+            self.steps.repair_holds(following_step_id, following_step_id)
+            self.timeline.patch(first_step_id, last_step_id + 1 if following_step_id else last_step_id)
+            if not following_step_id:
+                self.timeline.patch(0, 0)
+        self.notify(first_step_id, last_step_id)
+
+    def transpose(self, semitones, first_step_id=0, last_step_id=None):
+        self.edit_steps(first_step_id, last_step_id, lambda steps: steps.transpose(semitones))
+
+    def rotate(self, steps, first_step_id=0, last_step_id=None):
+        self.edit_steps(first_step_id, last_step_id, lambda region: region.rotate(steps))
+
+    def shift(self, steps, first_step_id=0, last_step_id=None):
+        self.edit_steps(first_step_id, last_step_id, lambda region: region.shift(steps))
+
+    def reverse(self, first_step_id=0, last_step_id=None):
+        self.edit_steps(first_step_id, last_step_id, StepStore.reverse)
+
+    def quantize(self, grid, first_step_id=0, last_step_id=None):
+        self.edit_steps(first_step_id, last_step_id, lambda steps: steps.quantize(grid))
+
+    def fill_every(self, every, value, first_step_id=0, last_step_id=None, offset=0):
+        self.edit_steps(first_step_id, last_step_id, lambda steps: steps.fill_every(every, value, offset))
+
+    def euclid(self, pulses, value, first_step_id=0, last_step_id=None, rotation=0):
+        self.edit_steps(first_step_id, last_step_id, lambda steps: steps.euclid(pulses, value, rotation))
+
+    def record_notes(self, notes):
+        # A batch of (first_step_id, last_step_id, mask, velocity) notes, e.g.
+        # from a NoteRecorder, written as one edit
+        if not notes:
             return
-        for step_id in range(first_step_id + 1, last_step_id + 1):
-            self.steps[step_id].value = held_step.value
-            self.steps[step_id].is_hold = True
+        first_step_id = min(note[0] for note in notes)
+        last_step_id = max(note[1] for note in notes)
+        self.edit_steps(first_step_id, last_step_id, lambda steps: steps.write_notes([
+            (note[0] - first_step_id, note[1] - first_step_id, note[2], note[3]) for note in notes
+        ]))
+
+    def copy_steps(self, first_step_id=0, last_step_id=None):
+        if last_step_id is None:
+            last_step_id = self.step_count - 1
+        return self.steps.slice(first_step_id, last_step_id)
+
+    def paste_steps(self, first_step_id, steps):
+        # steps from copy_steps(), of this or any other sequencer
+        self.edit_steps(first_step_id, first_step_id + len(steps) - 1, lambda region: region.paste(0, steps))
 
     def set_midi_channel(self, midi_channel):
+        if midi_channel != self.midi_channel:
+            self.release_all()
         self.midi_channel = midi_channel
+        self.timeline.set_midi_channel(midi_channel)
@@ -0,0 +1,160 @@
+import multiprocessing
+
+from midi_engine import MESSAGE_STATUS, midi_engine
+
+
+__all__ = ['ShardedEngine']
+
+EVENT_WIDTH = 5     # track, status byte, data1, data2, offset
+OFFSET_SCALE = 1 << 16   # Offsets are stored as integer fractions of a step
+
+
+def _run_worker(worker_index, tracks, buffer, slot_size, start_barrier, done_barrier, running, edit_batches, edits):
+    offset = worker_index * slot_size
+    capacity = (slot_size - 2) // EVENT_WIDTH
+    message_status = MESSAGE_STATUS
+    while True:
+        start_barrier.wait()
+        if not running.value:
+            return
+
+        if edit_batches[worker_index]:
+            # Sent once every worker is past the barrier and reading
+            edit_batches[worker_index] = 0
+            for track, method, args in edits.recv():
+                getattr(tracks[track], method)(*args)
+
+        count = 0
+        overflows = 0
+        for track, sequencer in tracks.items():
+            events = sequencer.advance()
+            if not events:
+                continue
+            groove_offsets = sequencer.groove_offsets
+            step_offset = groove_offsets[sequencer.active_step] if groove_offsets is not None else 0.0
+            for event in events:
+                if count == capacity:
+                    overflows += 1
+                    continue
+                base = offset + 2 + count * EVENT_WIDTH
+                buffer[base] = track
+                buffer[base + 1] = message_status[event[1]] | event[2]
+                buffer[base + 2] = event[3]
+                buffer[base + 3] = event[4]
+                buffer[base + 4] = int((step_offset + event[5]) * OFFSET_SCALE)
+                count += 1
+        buffer[offset] = count
+        buffer[offset + 1] += overflows
+        done_barrier.wait()
+
+
+class ShardedEngine(object):
+    # Ticks sequencers in worker processes. The engine's tick() is the
+    # shared clock: it releases every worker at once, waits for them to
+    # write their due events into one shared buffer, then merges them in
+    # track order and sends them to midi_engine.
+    #
+    # Workers own copies of the sequencers, so edits must go through
+    # send_edit() to reach them. Edits wait in a backlog until the next
+    # tick, which sends each worker its share in one batch while the
+    # worker is reading, so send_edit() never blocks on a full pipe and
+    # may be called from the thread that ticks.
+    #
+    # tick(delta) is all PlaybackClock needs of a sequencer, so an engine
+    # plays on a clock as its only one: PlaybackClock([engine], interval).
+    def __init__(self, sequencers, workers=None, max_events_per_worker=8192, context=None):
+        self.sequencers = sequencers
+        self.worker_count = workers or multiprocessing.cpu_count()
+        self.slot_size = 2 + max_events_per_worker * EVENT_WIDTH
+        self.context = context or multiprocessing.get_context()
+        self.tick_count = 0
+        self.processes = []
+        self.edit_connections = []
+        self.edit_backlogs = []
+        self.shards = [
+            dict(
+                (track, sequencers[track])
+                for track in range(worker_index, len(sequencers), self.worker_count)
+            )
+            for worker_index in range(self.worker_count)
+        ]
+        self.buffer = None
+
+    @property
+    def overflows(self):
+        return sum(self.buffer[worker_index * self.slot_size + 1] for worker_index in range(self.worker_count))
+
+    def start(self):
+        context = self.context
+        self.tick_count = 0
+        self.first_steps = [sequencer.active_step for sequencer in self.sequencers]
+        self.buffer = context.RawArray('i', self.worker_count * self.slot_size)
+        self.running = context.RawValue('b', 1)
+        self.start_barrier = context.Barrier(self.worker_count + 1)
+        self.done_barrier = context.Barrier(self.worker_count + 1)
+        self.edit_batches = context.RawArray('b', self.worker_count)
+        self.edit_backlogs = [[] for _ in range(self.worker_count)]
+        for worker_index, tracks in enumerate(self.shards):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_run_worker,
+                name='SequencerShard-{}'.format(worker_index),
+                args=(
+                    worker_index, tracks, self.buffer, self.slot_size,
+                    self.start_barrier, self.done_barrier, self.running, self.edit_batches, receiver,
+                )
+            )
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            self.edit_connections.append(sender)
+
+    def stop(self):
+        if not self.processes:
+            return
+        self.running.value = 0
+        self.start_barrier.wait()
+        for process in self.processes:
+            process.join()
+        for connection in self.edit_connections:
+            connection.close()
+        self.processes = []
+        self.edit_connections = []
+        self.edit_backlogs = []
+
+    def send_edit(self, track, method, *args):
+        getattr(self.sequencers[track], method)(*args)
+        if self.edit_backlogs:
+            self.edit_backlogs[track % self.worker_count].append((track, method, args))
+
+    def collect(self):
+        backlogs = [worker_index for worker_index, backlog in enumerate(self.edit_backlogs) if backlog]
+        for worker_index in backlogs:
+            self.edit_batches[worker_index] = 1
+        self.start_barrier.wait()
+        for worker_index in backlogs:
+            self.edit_connections[worker_index].send(self.edit_backlogs[worker_index])
+            self.edit_backlogs[worker_index] = []
+        self.done_barrier.wait()
+        self.tick_count += 1
+
+        buffer = self.buffer
+        events = []
+        for worker_index in range(self.worker_count):
+            offset = worker_index * self.slot_size
+            end = offset + 2 + buffer[offset] * EVENT_WIDTH
+            slot = buffer[offset + 2:end]
+            events.extend(zip(slot[0::5], slot[1::5], slot[2::5], slot[3::5], slot[4::5]))
+        events.sort(key=lambda event: event[0])
+        return events
+
+    def tick(self, delta):
+        for track, status, data1, data2, offset in self.collect():
+            delay = offset * delta / OFFSET_SCALE if delta else 0.0
+            midi_engine.send_raw(bytes((status, data1, data2)), delay)
+
+    def sync_active_steps(self):
+        # The main process copies don't advance on their own; call this
+        # before reading active_step from them, e.g. when drawing the UI
+        for sequencer, first_step in zip(self.sequencers, self.first_steps):
+            sequencer.active_step = (first_step + self.tick_count) % sequencer.step_count
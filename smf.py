@@ -0,0 +1,278 @@
+import argparse
+import math
+import struct
+import sys
+
+from midi_engine import CONTROL_CHANGE, MESSAGE_STATUS, NOTE_OFF, NOTE_ON
+from steps import FULL_GATE
+from timeline import NOTE_OFF as NOTE_OFF_MESSAGE, NOTE_ON as NOTE_ON_MESSAGE, Timeline
+
+
+__all__ = ['SmfReader', 'export_smf', 'write_smf', 'import_smf']
+
+HEADER_CHUNK = struct.Struct('>4sIHHH')
+TRACK_CHUNK = struct.Struct('>4sI')
+META = 0xFF
+SYSEX = 0xF0
+SYSEX_ESCAPE = 0xF7
+META_TRACK_NAME = 0x03
+META_END_OF_TRACK = 0x2F
+META_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+DEFAULT_BPM = 120
+OFFSET_RESOLUTION = 24   # Ticks per step used when gates put events between steps
+
+
+def _encode_vlq(value):
+    encoded = bytearray((value & 0x7F,))
+    value >>= 7
+    while value:
+        encoded.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(encoded)
+
+
+def _meta(delta, meta_type, data):
+    return _encode_vlq(delta) + bytes((META, meta_type)) + _encode_vlq(len(data)) + data
+
+
+def _track_chunk(data):
+    return TRACK_CHUNK.pack(b'MTrk', len(data)) + data
+
+
+def _conductor_track(bpm, beats_per_bar):
+    microseconds_per_beat = int(round(60000000.0 / bpm))
+    data = bytearray()
+    data += _meta(0, META_TEMPO, struct.pack('>I', microseconds_per_beat)[1:])
+    data += _meta(0, META_TIME_SIGNATURE, bytes((beats_per_bar, 2, 24, 8)))
+    data += _meta(0, META_END_OF_TRACK, b'')
+    return _track_chunk(bytes(data))
+
+
+def _sequencer_track(sequencer, events, ticks_per_step, loops):
+    midi_channel = sequencer.midi_channel if sequencer.midi_channel is not None else 0
+    data = bytearray(_meta(0, META_TRACK_NAME, 'Sequencer #{}'.format(sequencer.id).encode('ascii')))
+    sounding = set()
+    last_tick = 0
+    for loop in range(loops):
+        loop_tick = loop * sequencer.step_count * ticks_per_step
+        for step_id, message, channel, data1, data2, offset in events:
+            if message == NOTE_OFF_MESSAGE:
+                # The first pass has nothing ringing over from a previous loop
+                if data1 not in sounding:
+                    continue
+                sounding.discard(data1)
+            elif message == NOTE_ON_MESSAGE:
+                sounding.add(data1)
+            tick = loop_tick + step_id * ticks_per_step
+            if offset:
+                tick += max(1, int(round(offset * ticks_per_step)))
+            data += _encode_vlq(tick - last_tick) + bytes((MESSAGE_STATUS[message] | channel, data1, data2))
+            last_tick = tick
+
+    end_tick = loops * sequencer.step_count * ticks_per_step
+    for note in sorted(sounding):
+        data += _encode_vlq(end_tick - last_tick) + bytes((NOTE_OFF | midi_channel, note, 0))
+        last_tick = end_tick
+    data += _meta(end_tick - last_tick, META_END_OF_TRACK, b'')
+    return _track_chunk(bytes(data))
+
+
+def write_smf(fp, sequencers, bpm=DEFAULT_BPM, loops=1):
+    # Type 1: a conductor track followed by one track per sequencer. The
+    # division is the lowest tick rate every sequencer's steps land on,
+    # raised to OFFSET_RESOLUTION ticks a step if any gates fall in between.
+    division = 1
+    for sequencer in sequencers:
+        division = division * sequencer.beat_subdivision // math.gcd(division, sequencer.beat_subdivision)
+    beats_per_bar = sequencers[0].beats_per_bar if sequencers else 4
+    tracks = [
+        Timeline(sequencer.steps, sequencer.midi_channel if sequencer.midi_channel is not None else 0).events
+        for sequencer in sequencers
+    ]
+    if any(event[5] for events in tracks for event in events):
+        division *= OFFSET_RESOLUTION
+
+    fp.write(HEADER_CHUNK.pack(b'MThd', 6, 1, len(sequencers) + 1, division))
+    fp.write(_conductor_track(bpm, beats_per_bar))
+    for sequencer, events in zip(sequencers, tracks):
+        fp.write(_sequencer_track(sequencer, events, division // sequencer.beat_subdivision, loops))
+
+
+def export_smf(path, sequencers, bpm=DEFAULT_BPM, loops=1):
+    with open(path, 'wb') as fp:
+        write_smf(fp, sequencers, bpm, loops)
+
+
+def _read_vlq(data, position):
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, position
+
+
+class SmfReader(object):
+    # Streams events out of a Standard MIDI File. Only one track chunk is
+    # held in memory at a time and events are yielded, never collected.
+    def __init__(self, fp):
+        self.fp = fp
+        header = fp.read(HEADER_CHUNK.size)
+        if len(header) < HEADER_CHUNK.size:
+            raise ValueError('Not a Standard MIDI File')
+        magic, length, self.format, self.track_count, self.division = HEADER_CHUNK.unpack(header)
+        if magic != b'MThd':
+            raise ValueError('Not a Standard MIDI File')
+        if self.division & 0x8000:
+            raise ValueError('SMPTE time division is not supported')
+        fp.read(length - 6)
+
+    def events(self):
+        # Yields (track, tick, status, data1, data2) for channel messages and
+        # (track, tick, 0xFF, meta type, payload) for meta events
+        track = 0
+        while track < self.track_count:
+            chunk_header = self.fp.read(TRACK_CHUNK.size)
+            if len(chunk_header) < TRACK_CHUNK.size:
+                return
+            chunk_type, length = TRACK_CHUNK.unpack(chunk_header)
+            data = self.fp.read(length)
+            if chunk_type != b'MTrk':
+                continue
+            for event in self._track_events(track, data):
+                yield event
+            track += 1
+
+    def _track_events(self, track, data):
+        position = 0
+        tick = 0
+        running_status = None
+        length = len(data)
+        while position < length:
+            delta, position = _read_vlq(data, position)
+            tick += delta
+            status = data[position]
+            if status == META:
+                meta_type = data[position + 1]
+                meta_length, position = _read_vlq(data, position + 2)
+                yield (track, tick, META, meta_type, data[position:position + meta_length])
+                position += meta_length
+                if meta_type == META_END_OF_TRACK:
+                    return
+                continue
+            if status == SYSEX or status == SYSEX_ESCAPE:
+                sysex_length, position = _read_vlq(data, position + 1)
+                position += sysex_length
+                continue
+
+            if status & 0x80:
+                running_status = status
+                position += 1
+            else:
+                status = running_status
+            if status & 0xE0 == 0xC0:
+                # Program change and channel pressure only carry one byte
+                yield (track, tick, status, data[position], 0)
+                position += 1
+            else:
+                yield (track, tick, status, data[position], data[position + 1])
+                position += 2
+
+
+def import_smf(fp, sequencers):
+    # Note tracks are written into sequencers in order, skipping tracks that
+    # carry no notes (like the conductor track write_smf emits). Notes are
+    # snapped to the nearest step and held with set_chord_for_step_range;
+    # notes starting on the same step become a chord held as long as its
+    # longest note. Velocity is kept, and a note ending part way through a
+    # step becomes a gate. Control changes land in CC lanes.
+    reader = SmfReader(fp)
+    division = float(reader.division)
+    track_index = {}
+    pending = {}
+    chords = {}
+    for track, tick, status, data1, data2 in reader.events():
+        message = status & 0xF0
+        if message != NOTE_ON and message != NOTE_OFF and message != CONTROL_CHANGE:
+            continue
+        if track not in track_index:
+            if len(track_index) == len(sequencers):
+                continue
+            track_index[track] = len(track_index)
+        sequencer = sequencers[track_index[track]]
+        channel = status & 0x0F
+        position = tick * sequencer.beat_subdivision / division
+
+        if message == CONTROL_CHANGE:
+            step_id = int(round(position))
+            if step_id < sequencer.step_count:
+                sequencer.set_cc(step_id, data1, data2)
+            continue
+
+        key = (track, channel, data1)
+        if message == NOTE_ON and data2:
+            pending[key] = (tick, data2)
+            continue
+        start = pending.pop(key, None)
+        if start is None:
+            continue
+
+        start_tick, velocity = start
+        first_step_id = int(round(start_tick * sequencer.beat_subdivision / division))
+        if first_step_id >= sequencer.step_count:
+            continue
+        if sequencer.midi_channel is None:
+            sequencer.set_midi_channel(channel)
+        chord = chords.get((track, first_step_id))
+        if chord is None:
+            chord = chords[(track, first_step_id)] = [[], position]
+        else:
+            # Another note of a chord already written, write it again whole
+            sequencer.clear_note_for_step(first_step_id)
+        chord[0].append(data1)
+        chord[1] = end = max(chord[1], position)
+
+        # Ends are rounded up to the step they fall in, the remainder is the gate
+        last_step_id = max(first_step_id, int(math.ceil(end - 1e-6)) - 1)
+        sequencer.set_chord_for_step_range(first_step_id, last_step_id, chord[0])
+        sequencer.set_velocity(first_step_id, velocity)
+        gate = end - last_step_id
+        if 0 < gate < FULL_GATE - 1e-6:
+            sequencer.set_gate(first_step_id, gate)
+        elif len(chord[0]) > 1:
+            sequencer.set_gate(first_step_id, FULL_GATE)
+    return sequencers
+
+
+def main(argv=None):
+    from persistence import load_session, save_session
+
+    parser = argparse.ArgumentParser(description='Convert between pyseq sessions and Standard MIDI Files')
+    subparsers = parser.add_subparsers(dest='command')
+    export_parser = subparsers.add_parser('export', help='Render a session to a .mid file')
+    export_parser.add_argument('session')
+    export_parser.add_argument('output')
+    export_parser.add_argument('--bpm', type=float, default=DEFAULT_BPM)
+    export_parser.add_argument('--loops', type=int, default=1)
+    import_parser = subparsers.add_parser('import', help='Write a .mid file into a session')
+    import_parser.add_argument('midi_file')
+    import_parser.add_argument('session')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        export_smf(args.output, load_session(args.session), args.bpm, args.loops)
+    elif args.command == 'import':
+        sequencers = load_session(args.session)
+        with open(args.midi_file, 'rb') as fp:
+            import_smf(fp, sequencers)
+        save_session(args.session, sequencers)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+from array import array
+
+
+__all__ = ['StepGridState', 'StepGridWindow', 'CELL_COLORS']
+
+ACTIVE_STEP_COLOR = [.5, .5, .5, 1]
+STEP_COLOR = [1, 1, 1, 1]
+ROWS = 11               # Notes of the octave on screen, one per piano roll key
+
+# A cell is lit by its note (bit 0) and by the playhead (bit 1)
+EMPTY_CELL, NOTE_CELL, ACTIVE_CELL, ACTIVE_NOTE_CELL = range(4)
+CELL_COLORS = (
+    [.25, .25, .25, 1],
+    [.2, .6, 1, 1],
+    ACTIVE_STEP_COLOR,
+    [.4, .8, 1, 1],
+)
+
+
+def _column_cells(rows, active):
+    # A column's cells for every mask of its rows' notes
+    return [array('B', [(mask >> row & 1) | active for row in range(rows)]) for mask in range(1 << rows)]
+
+
+class StepGridState(object):
+    # Remembers what the step grid was last drawn from, so a refresh only
+    # has to touch the steps whose contents could have changed
+    def __init__(self):
+        self.edited_step_ids = set()
+        self.edited_ranges = []
+        self.invalidate()
+
+    def invalidate(self):
+        self.sequencer = None
+        self.octave = None
+        self.bar = None
+        self.active_step = None
+
+    def pattern_replaced(self, sequencer):
+        # Sequencer pattern listener: none of the grid drawn is current
+        if sequencer is self.sequencer:
+            self.invalidate()
+
+    def mark_edited(self, step_id):
+        self.edited_step_ids.add(step_id)
+
+    def sequencer_changed(self, sequencer, first_step_id, last_step_id):
+        # Sequencer listener, so bulk edits and undo are redrawn too. Only
+        # the range is kept, collect() clips it to the steps on screen.
+        if sequencer is self.sequencer:
+            self.edited_ranges.append((first_step_id, last_step_id))
+
+    def collect(self, sequencer, octave, bar, visible_step_ids):
+        relabel = octave != self.octave
+        if relabel or sequencer is not self.sequencer or bar != self.bar:
+            dirty_step_ids = set(visible_step_ids)
+        else:
+            dirty_step_ids = self.edited_step_ids
+            if sequencer.active_step != self.active_step:
+                dirty_step_ids.add(self.active_step)
+                dirty_step_ids.add(sequencer.active_step)
+            for first_step_id, last_step_id in self.edited_ranges:
+                dirty_step_ids.update(range(
+                    max(first_step_id, visible_step_ids[0]), min(last_step_id, visible_step_ids[-1]) + 1
+                ))
+            dirty_step_ids = dirty_step_ids.intersection(visible_step_ids)
+
+        self.sequencer = sequencer
+        self.octave = octave
+        self.bar = bar
+        self.active_step = sequencer.active_step
+        self.edited_step_ids = set()
+        self.edited_ranges = []
+        return dirty_step_ids, relabel
+
+
+class StepGridWindow(object):
+    # The cells on screen: one bar of steps by ROWS notes of one octave.
+    # The same fixed pool of cells is rebound to whichever bar and octave
+    # is shown, so moving around the pattern costs one window's worth of
+    # work however long the pattern is. Cells hold a state, not a widget;
+    # the view draws them and hit tests touches with step_at()/note_at().
+    def __init__(self, columns, rows=ROWS):
+        self.columns = columns
+        self.rows = rows
+        self.cells = array('B', [EMPTY_CELL]) * (columns * rows)     # Column major, row 0 at the bottom
+        self.state = StepGridState()
+        self.first_step_id = 0
+        self.first_note = 0
+        self.column_cells = (_column_cells(rows, EMPTY_CELL), _column_cells(rows, ACTIVE_CELL))
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def visible_step_ids(self):
+        return range(self.first_step_id, self.first_step_id + self.columns)
+
+    def step_at(self, column):
+        return self.first_step_id + column
+
+    def note_at(self, row):
+        return self.first_note + row
+
+    def refresh(self, sequencer, octave, bar):
+        # Returns the cells whose state changed, for the view to recolor
+        self.first_step_id = bar * self.columns
+        self.first_note = octave * 12
+        dirty_step_ids, _ = self.state.collect(sequencer, octave, bar, self.visible_step_ids)
+        steps = sequencer.steps
+        step_count = len(steps)
+        cells = self.cells
+        rows = self.rows
+        row_mask = (1 << rows) - 1
+        changed = []
+        for step_id in dirty_step_ids:
+            # One bit per row, chords light several
+            mask = (steps.note_mask(step_id) >> self.first_note) & row_mask if step_id < step_count else 0
+            column = self.column_cells[step_id == sequencer.active_step][mask]
+            first_cell = (step_id - self.first_step_id) * rows
+            if cells[first_cell:first_cell + rows] == column:
+                continue
+            for row in range(rows):
+                if cells[first_cell + row] != column[row]:
+                    changed.append(first_cell + row)
+            cells[first_cell:first_cell + rows] = column
+        return changed
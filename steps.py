@@ -0,0 +1,431 @@
+import hashlib
+
+from array import array
+
+from midi_engine import DEFAULT_VELOCITY
+
+
+__all__ = ['StepStore', 'StepView', 'EMPTY_NOTE', 'EMPTY_VALUE', 'note_mask', 'mask_notes']
+
+EMPTY_NOTE = -1        # Stored in place of None in the step value array
+EMPTY_VALUE = -1       # Same for CC lanes, where a step may not send anything
+FULL_GATE = 1.0        # Gate lengths are fractions of a note's last step
+ALWAYS = 100           # Probabilities are percentages
+MASK_BYTES = 16        # Note masks have one bit per MIDI note
+
+# Most steps hold a single note, sharing their masks keeps compiled
+# timelines from carrying an int object per step
+NOTE_MASKS = tuple(1 << value for value in range(128))
+
+
+def note_mask(values):
+    mask = 0
+    for value in values:
+        mask |= 1 << value
+    return mask
+
+
+def mask_notes(mask):
+    # Lowest note first, one loop per set bit rather than per possible note
+    notes = []
+    while mask:
+        lowest = mask & -mask
+        notes.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return notes
+
+
+class StepView(object):
+    # Stands in for a Note, reading and writing straight through to the
+    # arrays of the StepStore it was handed out by
+    __slots__ = ('store', 'step_id')
+
+    def __init__(self, store, step_id):
+        self.store = store
+        self.step_id = step_id
+
+    @property
+    def value(self):
+        value = self.store.notes[self.step_id]
+        return None if value == EMPTY_NOTE else value
+
+    @value.setter
+    def value(self, value):
+        self.store.notes[self.step_id] = EMPTY_NOTE if value is None else value
+        self.store.chords.pop(self.step_id, None)
+
+    @property
+    def chord(self):
+        return self.store.chord(self.step_id)
+
+    @property
+    def mask(self):
+        return self.store.note_mask(self.step_id)
+
+    @property
+    def is_hold(self):
+        return bool(self.store.holds[self.step_id])
+
+    @is_hold.setter
+    def is_hold(self, is_hold):
+        self.store.holds[self.step_id] = 1 if is_hold else 0
+
+    @property
+    def velocity(self):
+        return self.store.velocities[self.step_id]
+
+    @property
+    def gate(self):
+        return self.store.gates[self.step_id]
+
+    @property
+    def probability(self):
+        return self.store.probabilities[self.step_id]
+
+    def __repr__(self):
+        return u'<Note value={}, is_hold={}>'.format(self.value, self.is_hold)
+
+
+class StepStore(object):
+    # Parallel arrays indexed by step id, exposed with the same mapping
+    # interface the old dict of Note objects had.
+    #
+    # Per step parameters are lanes of the same length: velocity, gate and
+    # probability always exist, CC lanes are keyed by controller number and
+    # only allocated once something writes to them.
+    #
+    # A step with more than one note keeps its lowest in notes, like any
+    # other step, and the full set as a 128 bit mask in chords. Chords are
+    # rare enough that a dict beats a pair of uint64 lanes on every step.
+    def __init__(self, step_count=0):
+        self.notes = array('h', [EMPTY_NOTE]) * step_count
+        self.holds = array('B', [0]) * step_count
+        self.velocities = array('B', [DEFAULT_VELOCITY]) * step_count
+        self.gates = array('f', [FULL_GATE]) * step_count
+        self.probabilities = array('B', [ALWAYS]) * step_count
+        self.cc_lanes = {}
+        self.chords = {}
+
+    def note_lanes(self):
+        # (lane, fill value) for the columns every step has
+        return [
+            (self.notes, EMPTY_NOTE),
+            (self.holds, 0),
+            (self.velocities, DEFAULT_VELOCITY),
+            (self.gates, FULL_GATE),
+            (self.probabilities, ALWAYS),
+        ]
+
+    def lanes(self):
+        # (lane, fill value) for every column, in a stable order
+        lanes = self.note_lanes()
+        for controller in sorted(self.cc_lanes):
+            lanes.append((self.cc_lanes[controller], EMPTY_VALUE))
+        return lanes
+
+    def resize(self, step_count):
+        current_step_count = len(self.notes)
+        for lane, fill_value in self.lanes():
+            if step_count < current_step_count:
+                del lane[step_count:]
+            else:
+                lane.extend([fill_value] * (step_count - current_step_count))
+        for step_id in [step_id for step_id in self.chords if step_id >= step_count]:
+            del self.chords[step_id]
+
+    def copy(self):
+        steps = StepStore()
+        steps.notes = array('h', self.notes)
+        steps.holds = array('B', self.holds)
+        steps.velocities = array('B', self.velocities)
+        steps.gates = array('f', self.gates)
+        steps.probabilities = array('B', self.probabilities)
+        steps.cc_lanes = dict((controller, array('h', lane)) for controller, lane in self.cc_lanes.items())
+        steps.chords = dict(self.chords)
+        return steps
+
+    def digest(self):
+        content = hashlib.blake2b(digest_size=16)
+        for lane, _ in self.lanes():
+            content.update(lane.tobytes())
+        content.update(bytes(sorted(self.cc_lanes)))
+        for step_id in sorted(self.chords):
+            content.update(step_id.to_bytes(4, 'little'))
+            content.update(self.chords[step_id].to_bytes(MASK_BYTES, 'little'))
+        return content.hexdigest()
+
+    def set(self, step_id, value, is_hold=False):
+        self.notes[step_id] = EMPTY_NOTE if value is None else value
+        self.holds[step_id] = 1 if is_hold else 0
+        if self.chords:
+            self.chords.pop(step_id, None)
+
+    def set_mask(self, step_id, mask, is_hold=False):
+        if mask >> 128:
+            raise ValueError('Notes must be between 0 and 127')
+        if mask & (mask - 1):
+            self.notes[step_id] = (mask & -mask).bit_length() - 1
+            self.holds[step_id] = 1 if is_hold else 0
+            self.chords[step_id] = mask
+        else:
+            self.set(step_id, mask.bit_length() - 1 if mask else None, is_hold)
+
+    def set_chord(self, step_id, values, is_hold=False):
+        self.set_mask(step_id, note_mask(values), is_hold)
+
+    def note_mask(self, step_id):
+        mask = self.chords.get(step_id) if self.chords else None
+        if mask is not None:
+            return mask
+        value = self.notes[step_id]
+        return 0 if value == EMPTY_NOTE else NOTE_MASKS[value]
+
+    def chord(self, step_id):
+        mask = self.chords.get(step_id) if self.chords else None
+        if mask is not None:
+            return mask_notes(mask)
+        value = self.notes[step_id]
+        return [] if value == EMPTY_NOTE else [value]
+
+    def set_velocity(self, step_id, velocity):
+        if not 0 < velocity < 128:
+            raise ValueError('Velocity must be between 1 and 127, not {}'.format(velocity))
+        self.velocities[step_id] = velocity
+
+    def set_gate(self, step_id, gate):
+        if not 0 < gate <= FULL_GATE:
+            raise ValueError('Gate must be above 0 and at most 1, not {}'.format(gate))
+        self.gates[step_id] = gate
+
+    def set_probability(self, step_id, probability):
+        if not 0 <= probability <= ALWAYS:
+            raise ValueError('Probability must be between 0 and 100, not {}'.format(probability))
+        self.probabilities[step_id] = probability
+
+    def cc_lane(self, controller):
+        lane = self.cc_lanes.get(controller)
+        if lane is None:
+            if not 0 <= controller < 128:
+                raise ValueError('Controller must be between 0 and 127, not {}'.format(controller))
+            lane = self.cc_lanes[controller] = array('h', [EMPTY_VALUE]) * len(self.notes)
+        return lane
+
+    def set_cc(self, step_id, controller, value):
+        if value is not None and not 0 <= value < 128:
+            raise ValueError('CC value must be between 0 and 127, not {}'.format(value))
+        self.cc_lane(controller)[step_id] = EMPTY_VALUE if value is None else value
+
+    def remove_cc_lane(self, controller):
+        self.cc_lanes.pop(controller, None)
+
+    # Bulk edits. Each works on the whole store as operations over entire
+    # lanes; Sequencer.edit_steps() runs them on a slice to edit a range.
+
+    def slice(self, first_step_id, last_step_id):
+        end = last_step_id + 1
+        steps = StepStore()
+        steps.notes = self.notes[first_step_id:end]
+        steps.holds = self.holds[first_step_id:end]
+        steps.velocities = self.velocities[first_step_id:end]
+        steps.gates = self.gates[first_step_id:end]
+        steps.probabilities = self.probabilities[first_step_id:end]
+        steps.cc_lanes = dict((controller, lane[first_step_id:end]) for controller, lane in self.cc_lanes.items())
+        steps.chords = dict(
+            (step_id - first_step_id, mask) for step_id, mask in self.chords.items()
+            if first_step_id <= step_id < end
+        )
+        return steps
+
+    def paste(self, first_step_id, steps):
+        # Writes steps over these from first_step_id on, as many as fit.
+        # CC lanes the pasted steps don't have are cleared.
+        end = min(first_step_id + len(steps), len(self))
+        count = end - first_step_id
+        if count <= 0:
+            return
+        self.notes[first_step_id:end] = steps.notes[:count]
+        self.holds[first_step_id:end] = steps.holds[:count]
+        self.velocities[first_step_id:end] = steps.velocities[:count]
+        self.gates[first_step_id:end] = steps.gates[:count]
+        self.probabilities[first_step_id:end] = steps.probabilities[:count]
+        for controller in set(self.cc_lanes) | set(steps.cc_lanes):
+            lane = steps.cc_lanes.get(controller)
+            self.cc_lane(controller)[first_step_id:end] = (
+                lane[:count] if lane is not None else array('h', [EMPTY_VALUE]) * count
+            )
+        chords = self.chords
+        for step_id in [step_id for step_id in chords if first_step_id <= step_id < end]:
+            del chords[step_id]
+        for step_id, mask in steps.chords.items():
+            if step_id < count:
+                chords[first_step_id + step_id] = mask
+
+    def clear(self):
+        self.paste(0, StepStore(len(self)))
+
+    def transpose(self, semitones):
+        notes = self.notes
+        values = [value for value in notes if value != EMPTY_NOTE]
+        masks = list(self.chords.values())
+        if values and not (0 <= min(values) + semitones and max(values) + semitones < 128):
+            raise ValueError('Transposing by {} takes notes outside 0 to 127'.format(semitones))
+        if semitones >= 0:
+            masks = [mask << semitones for mask in masks]
+        else:
+            masks = [mask >> -semitones for mask in masks]
+        if any(mask >> 128 for mask in masks):
+            raise ValueError('Transposing by {} takes notes outside 0 to 127'.format(semitones))
+        notes[:] = array('h', [value + semitones if value != EMPTY_NOTE else value for value in notes])
+        self.chords = dict(zip(self.chords, masks))
+
+    def rotate(self, steps):
+        # Later by steps, wrapping round the end
+        step_count = len(self)
+        if not step_count or not steps % step_count:
+            return
+        steps %= step_count
+        for lane, _ in self.lanes():
+            lane[:] = lane[-steps:] + lane[:-steps]
+        self.chords = dict(((step_id + steps) % step_count, mask) for step_id, mask in self.chords.items())
+
+    def shift(self, steps):
+        # Like rotate(), but steps moved past either end are dropped
+        step_count = len(self)
+        self.rotate(steps)
+        if steps > 0:
+            self.paste(0, StepStore(min(steps, step_count)))
+        elif steps < 0:
+            self.paste(max(step_count + steps, 0), StepStore(min(-steps, step_count)))
+
+    def reverse(self):
+        step_count = len(self)
+        if not step_count:
+            return
+        for lane, _ in self.lanes():
+            lane.reverse()
+        # Held notes now start on the step they used to end on: the hold
+        # flags move along one step, and so do the note's own parameters
+        holds = self.holds
+        holds[:] = holds[-1:] + holds[:-1]
+        for first_step_id, last_step_id in self.note_ranges():
+            if last_step_id != first_step_id:
+                for lane in (self.velocities, self.gates, self.probabilities):
+                    lane[first_step_id], lane[last_step_id] = lane[last_step_id], lane[first_step_id]
+        self.chords = dict((step_count - 1 - step_id, mask) for step_id, mask in self.chords.items())
+
+    def note_ranges(self):
+        # (first step id, last step id) of every note, holds included
+        notes = self.notes
+        holds = self.holds
+        step_count = len(notes)
+        ranges = []
+        for step_id in range(step_count):
+            if notes[step_id] == EMPTY_NOTE or holds[step_id]:
+                continue
+            last_step_id = step_id
+            while last_step_id + 1 < step_count and holds[last_step_id + 1]:
+                last_step_id += 1
+            ranges.append((step_id, last_step_id))
+        return ranges
+
+    def quantize(self, grid):
+        # Moves every note to start on the nearest multiple of grid steps,
+        # keeping its length. Where notes collide the earlier one wins.
+        if grid < 1:
+            raise ValueError('Quantize grid must be at least one step, not {}'.format(grid))
+        step_count = len(self)
+        source = self.copy()
+        ranges = source.note_ranges()
+        for lane, fill_value in self.note_lanes():
+            lane[:] = array(lane.typecode, [fill_value]) * step_count
+        self.chords = {}
+        notes = self.notes
+        for first_step_id, last_step_id in ranges:
+            target = (first_step_id + grid // 2) // grid * grid % step_count
+            if notes[target] != EMPTY_NOTE:
+                continue
+            mask = source.note_mask(first_step_id)
+            self.velocities[target] = source.velocities[first_step_id]
+            self.gates[target] = source.gates[first_step_id]
+            self.probabilities[target] = source.probabilities[first_step_id]
+            for step_id in range(target, min(target + last_step_id - first_step_id + 1, step_count)):
+                if notes[step_id] != EMPTY_NOTE:
+                    break
+                self.set_mask(step_id, mask, is_hold=step_id != target)
+
+    def fill_every(self, every, value, offset=0):
+        # value (None to clear) on every every-th step from offset on
+        if every < 1:
+            raise ValueError('Fill spacing must be at least one step, not {}'.format(every))
+        step_ids = range(offset, len(self), every)
+        self.notes[offset::every] = array('h', [EMPTY_NOTE if value is None else value]) * len(step_ids)
+        self.holds[offset::every] = array('B', [0]) * len(step_ids)
+        if self.chords:
+            for step_id in step_ids:
+                self.chords.pop(step_id, None)
+
+    def euclid(self, pulses, value, rotation=0):
+        # Replaces the notes with pulses onsets spread as evenly as they go
+        # over the steps (Bjorklund's rhythms), rotated later by rotation
+        step_count = len(self)
+        if not 0 <= pulses <= step_count:
+            raise ValueError('Euclidean rhythms need 0 to {} pulses, not {}'.format(step_count, pulses))
+        self.notes[:] = array('h', [
+            value if (step_id * pulses) % step_count < pulses else EMPTY_NOTE for step_id in range(step_count)
+        ])
+        self.holds[:] = array('B', [0]) * step_count
+        self.chords = {}
+        if rotation:
+            notes = self.notes
+            rotation %= step_count
+            notes[:] = notes[-rotation:] + notes[:-rotation]
+
+    def write_notes(self, notes):
+        # (first_step_id, last_step_id, mask, velocity) notes, in order. Like
+        # Sequencer.set_chord_for_step_range each replaces its first step and
+        # is held over empty steps up to its last, stopping at programmed ones.
+        note_values = self.notes
+        last_step = len(self) - 1
+        for first_step_id, last_step_id, mask, velocity in notes:
+            self.set_mask(first_step_id, mask)
+            self.velocities[first_step_id] = velocity
+            for step_id in range(first_step_id + 1, min(last_step_id, last_step) + 1):
+                if note_values[step_id] != EMPTY_NOTE:
+                    break
+                self.set_mask(step_id, mask, is_hold=True)
+
+    def repair_holds(self, first_step_id, last_step_id):
+        # A hold carries on the note of the step before it. Bulk edits that
+        # split a held note leave holds after something else, those start
+        # the note again instead.
+        holds = self.holds
+        step_count = len(holds)
+        for step_id in range(first_step_id, last_step_id + 1):
+            if holds[step_id]:
+                previous_step_id = step_id - 1 if step_id else step_count - 1
+                mask = self.note_mask(step_id)
+                if not mask or self.note_mask(previous_step_id) != mask:
+                    holds[step_id] = 0
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __contains__(self, step_id):
+        return 0 <= step_id < len(self.notes)
+
+    def __getitem__(self, step_id):
+        if step_id not in self:
+            raise KeyError(step_id)
+        return StepView(self, step_id)
+
+    def __iter__(self):
+        return iter(range(len(self.notes)))
+
+    def keys(self):
+        return list(range(len(self.notes)))
+
+    def values(self):
+        return [StepView(self, step_id) for step_id in self]
+
+    def items(self):
+        return [(step_id, StepView(self, step_id)) for step_id in self]
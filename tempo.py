@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_right
+
+
+__all__ = ['TempoMap', 'DEFAULT_BPM']
+
+DEFAULT_BPM = 120.0
+SECONDS_PER_MINUTE = 60.0
+
+
+class TempoMap(object):
+    # Tempo and time signature changes for one loop of step_count steps,
+    # compiled into self.times: the time in seconds each step starts at,
+    # relative to the start of the loop, with the loop length at the end.
+    #
+    # Tempo changes sit on the first step of a bar. A ramping change glides
+    # from the previous change's tempo, step by step, until it is reached.
+    # Time signature changes move where later bars (and so later tempo
+    # changes) start. Edits only recompile the steps whose tempo changed,
+    # every step after them just shifts by the same amount.
+    def __init__(self, step_count, bpm=DEFAULT_BPM, beats_per_bar=4, steps_per_beat=4):
+        if step_count < 1:
+            raise ValueError('A tempo map needs at least one step')
+        self.step_count = step_count
+        self.steps_per_beat = steps_per_beat
+        self.tempos = {0: (float(bpm), False)}     # Bar -> (bpm, ramp)
+        self.meters = {0: beats_per_bar}           # Bar -> beats per bar
+        self.version = 0
+        self.compile()
+
+    def __len__(self):
+        return self.step_count
+
+    def bar_start(self, bar):
+        # First step of a bar, which may be past the end of the loop
+        bars = sorted(self.meters)
+        step_id = 0
+        for index, meter_bar in enumerate(bars):
+            if meter_bar >= bar:
+                break
+            next_bar = bars[index + 1] if index + 1 < len(bars) and bars[index + 1] < bar else bar
+            step_id += (next_bar - meter_bar) * self.meters[meter_bar] * self.steps_per_beat
+        return step_id
+
+    @property
+    def loop_length(self):
+        return self.times[self.step_count]
+
+    def time_of(self, position):
+        # When the step position steps after the start of playback fires,
+        # counting on through as many loops as it takes
+        loops, step_id = divmod(position, self.step_count)
+        times = self.times
+        return loops * times[self.step_count] + times[step_id]
+
+    def interval(self, position):
+        step_id = position % self.step_count
+        return self.times[step_id + 1] - self.times[step_id]
+
+    def time_at(self, position):
+        # time_of() for fractional positions, e.g. triplets against a grid
+        # of 16ths, timed evenly through the step they land in
+        whole = int(position // 1)
+        return self.time_of(whole) + (position - whole) * self.interval(whole)
+
+    def position_at(self, time):
+        # The inverse of time_at()
+        loops, time = divmod(time, self.loop_length)
+        step_id = min(bisect_right(self.times, time) - 1, self.step_count - 1)
+        return loops * self.step_count + step_id + (time - self.times[step_id]) / self.interval(step_id)
+
+    def bpm_at(self, step_id):
+        points = self._points()
+        index = bisect_right(points[0], step_id) - 1
+        return self._bpm(points, index, step_id)
+
+    def set_tempo(self, bar, bpm, ramp=False):
+        if bpm <= 0:
+            raise ValueError('Tempo must be above 0 BPM, not {}'.format(bpm))
+        if bar == 0 and ramp:
+            raise ValueError('The first bar has nothing to ramp from')
+        self.tempos[bar] = (float(bpm), ramp)
+        self._tempo_changed(bar)
+
+    def remove_tempo(self, bar):
+        if bar == 0:
+            raise ValueError('The first bar must have a tempo')
+        del self.tempos[bar]
+        self._tempo_changed(bar)
+
+    def set_meter(self, bar, beats_per_bar):
+        if beats_per_bar < 1:
+            raise ValueError('Bars need at least one beat, not {}'.format(beats_per_bar))
+        self.meters[bar] = beats_per_bar
+        self._meter_changed(bar)
+
+    def remove_meter(self, bar):
+        if bar == 0:
+            raise ValueError('The first bar must have a time signature')
+        del self.meters[bar]
+        self._meter_changed(bar)
+
+    def resize(self, step_count):
+        if step_count < 1:
+            raise ValueError('A tempo map needs at least one step')
+        self.step_count = step_count
+        self.compile()
+
+    def compile(self):
+        self.times = array('d', [0.0]) * (self.step_count + 1)
+        self._recompile_region(0, self.step_count - 1)
+
+    def _points(self):
+        # Tempo changes inside the loop as ([step_id], [(bpm, ramp)])
+        step_ids = []
+        tempos = []
+        for bar in sorted(self.tempos):
+            step_id = self.bar_start(bar)
+            if step_id >= self.step_count:
+                break
+            step_ids.append(step_id)
+            tempos.append(self.tempos[bar])
+        return step_ids, tempos
+
+    def _bpm(self, points, index, step_id):
+        step_ids, tempos = points
+        bpm = tempos[index][0]
+        if index + 1 < len(step_ids) and tempos[index + 1][1]:
+            start = step_ids[index]
+            target = tempos[index + 1][0]
+            bpm += (target - bpm) * (step_id - start) / float(step_ids[index + 1] - start)
+        return bpm
+
+    def _tempo_changed(self, bar):
+        # Only the steps from the change before this one up to the change
+        # after it can be played at a different tempo, whether or not
+        # either of them ramps
+        step_ids = self._points()[0]
+        step_id = self.bar_start(bar)
+        if step_id >= self.step_count:
+            return
+        first_step_id = step_ids[max(bisect_right(step_ids, step_id - 1) - 1, 0)]
+        following = bisect_right(step_ids, step_id)
+        last_step_id = step_ids[following] - 1 if following < len(step_ids) else self.step_count - 1
+        self._recompile_region(first_step_id, last_step_id)
+
+    def _meter_changed(self, bar):
+        # Every bar after a time signature change moves, and with them any
+        # ramp running over the change
+        step_id = self.bar_start(bar)
+        if step_id >= self.step_count:
+            return
+        step_ids = self._points()[0]
+        first_step_id = step_ids[bisect_right(step_ids, step_id) - 1]
+        self._recompile_region(first_step_id, self.step_count - 1)
+
+    def _recompile_region(self, first_step_id, last_step_id):
+        points = self._points()
+        step_ids = points[0]
+        times = self.times
+        step_seconds = SECONDS_PER_MINUTE / self.steps_per_beat
+        old_end = times[last_step_id + 1]
+        index = bisect_right(step_ids, first_step_id) - 1
+        time = times[first_step_id]
+        for step_id in range(first_step_id, last_step_id + 1):
+            while index + 1 < len(step_ids) and step_ids[index + 1] <= step_id:
+                index += 1
+            time += step_seconds / self._bpm(points, index, step_id)
+            times[step_id + 1] = time
+        shift = time - old_end
+        if shift:
+            for step_id in range(last_step_id + 2, self.step_count + 1):
+                times[step_id] += shift
+        self.version += 1
+
+    def __repr__(self):
+        return u'<TempoMap steps={}, tempos={}, meters={}, length={:.3f}s>'.format(
+            self.step_count, len(self.tempos), len(self.meters), self.loop_length
+        )
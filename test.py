@@ -1,18 +1,66 @@
 from kivy.app import App
 from kivy.clock import Clock
+from kivy.core.window import Window
+from kivy.graphics import Color, InstructionGroup, Rectangle
 from kivy.logger import Logger
 from kivy.properties import NumericProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.togglebutton import ToggleButton
-
+from kivy.uix.widget import Widget
+
+from clock import PolymeterClock
+from history import EditHistory
+from instrumentation import instruments, timer
+from midi_clock import MidiClockOutput
+from midi_engine import RawMidiInput, midi_engine
+from recorder import NoteRecorder
 from sequencer import MAXIMUM_OCTAVES, Sequencer
+from steps import mask_notes
+from step_grid import CELL_COLORS, StepGridWindow
+from tempo import TempoMap
 
 
-class StepWidget(BoxLayout):
-    def __init__(self, sequencer_view, step_id, **kwargs):
-        self.step_id = step_id
+class StepGrid(Widget):
+    # Draws a StepGridWindow as one batch of canvas instructions, a Color
+    # and Rectangle per cell recolored in place. Touches are hit tested
+    # against the window rather than every cell being a button.
+    def __init__(self, **kwargs):
+        super(StepGrid, self).__init__(**kwargs)
         self.app = App.get_running_app()
-        super(StepWidget, self).__init__(**kwargs)
+        self.window = StepGridWindow(self.app.active_sequencer.steps_per_bar)
+        self.colors = []
+        self.rectangles = []
+        cells = InstructionGroup()
+        for state in self.window.cells:
+            color = Color(*CELL_COLORS[state])
+            rectangle = Rectangle()
+            cells.add(color)
+            cells.add(rectangle)
+            self.colors.append(color)
+            self.rectangles.append(rectangle)
+        self.canvas.add(cells)
+        self.bind(pos=self.layout_cells, size=self.layout_cells)
+
+    def layout_cells(self, *args):
+        width = self.width / float(self.window.columns)
+        height = self.height / float(self.window.rows)
+        for cell, rectangle in enumerate(self.rectangles):
+            column, row = divmod(cell, self.window.rows)
+            rectangle.pos = (self.x + column * width + 1, self.y + row * height + 1)
+            rectangle.size = (width - 2, height - 2)
+
+    def refresh(self, sequencer, octave, bar):
+        cells = self.window.cells
+        for cell in self.window.refresh(sequencer, octave, bar):
+            self.colors[cell].rgba = CELL_COLORS[cells[cell]]
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super(StepGrid, self).on_touch_down(touch)
+        column = int((touch.x - self.x) * self.window.columns / self.width)
+        row = int((touch.y - self.y) * self.window.rows / self.height)
+        self.app.toggle_note(self.window.step_at(column), self.window.note_at(row))
+        return True
 
 
 class TransportButton(ToggleButton):
@@ -40,39 +88,15 @@ class SequencerView(BoxLayout):
     def __init__(self, *args, **kwargs):
         super(SequencerView, self).__init__(*args, **kwargs)
         self.app = App.get_running_app()
-        for step_id in range(self.app.active_sequencer.steps_per_bar):
-            self.step_container.add_widget(StepWidget(self.app, step_id))
 
     def _reset_step_view(self):
-        for step_widget in self.step_container.children:
-            for step in step_widget.children:
-                step.background_color = [1, 1, 1, 1]
+        self.step_grid.window.state.invalidate()
         self.update_ui(None)
 
     def _update_step_view(self, delta):
-        current_octave_start = self.app.current_octave * 12
-        current_octave_end = current_octave_start + 12
-        current_note_range = range(current_octave_start, current_octave_end)
-        current_bar_start = self.app.current_bar * self.app.active_sequencer.steps_per_bar
-        current_bar_end = current_bar_start + self.app.active_sequencer.steps_per_bar
-        current_step_range = range(current_bar_start, current_bar_end)
-        for step_widget in self.step_container.children:
-            sequencer_step_note_id = self.app.active_sequencer.steps[step_widget.step_id].value
-
-            if step_widget.step_id != self.app.active_sequencer.active_step:
-                color = [1, 1, 1, 1]
-            else:
-                color = [.5, .5, .5, 1]
-
-            for step_button in step_widget.children:
-                computed_button_note_id = (self.app.current_octave * 12) + step_button.note_offset_id
-                step_button.background_color = color
-                step_button.text = '({})'.format(computed_button_note_id)
-                step_button.state = 'normal'
-                if sequencer_step_note_id in current_note_range:
-                    if computed_button_note_id == sequencer_step_note_id:
-                        if step_widget.step_id in current_step_range:
-                            step_button.state = 'down'
+        # Only the previous and current active step, edited steps and a
+        # changed octave, bar or sequencer have their cells recolored
+        self.step_grid.refresh(self.app.active_sequencer, self.app.current_octave, self.app.current_bar)
 
     def _update_menu(self, delta):
         self.ids['menu'].update_display(
@@ -86,24 +110,41 @@ class SequencerView(BoxLayout):
     def _update_navigation(self, delta):
         self.btn_octave_up.disabled = self.app.current_octave == MAXIMUM_OCTAVES
         self.btn_octave_down.disabled = self.app.current_octave == 0
-        self.btn_bar_next.disabled = self.app.current_bar == self.app.active_sequencer.bars
+        self.btn_bar_next.disabled = self.app.current_bar >= self.app.last_bar()
         self.btn_bar_previous.disabled = self.app.current_bar == 0
 
     def update_ui(self, delta):
-        self.app.ui_updating = True
+        started = timer() if instruments.enabled else None
         self._update_step_view(delta)
         self._update_navigation(delta)
         self._update_menu(delta)
-        self.app.ui_updating = False
+        if started is not None:
+            instruments.record('ui.update', timer() - started)
+
+
+KEY_R = 114
+KEY_Y = 121
+KEY_Z = 122
+KEY_F11 = 292
+KEY_F12 = 293
+RECORD_BATCH_INTERVAL = 0.05     # Seconds of recorded notes written as one edit
 
 
 class TestApp(App):
     sequencers = []
-    step_timer = None
+    playback_clock = None
+    tempo_map = None
+    history = None
     bpm = NumericProperty(120)
+    send_clock = True
+    record_device = None        # rawmidi device Ctrl+R records from
+    record_strength = 1.0
+    recorder = None
 
-    def get_tick_interval(self):
-        return 60.0 / (self.bpm * self.active_sequencer.beat_subdivision)
+    def on_bpm(self, instance, bpm):
+        # A running clock picks tempo map edits up on its next step
+        if self.tempo_map is not None:
+            self.tempo_map.set_tempo(0, bpm)
 
     def octave_up(self, widget, state):
         self.debug_hold = True
@@ -133,48 +174,114 @@ class TestApp(App):
         if state == 'normal':
             return
 
-        if self.current_bar < self.active_sequencer.bars:
+        if self.current_bar < self.last_bar():
             self.current_bar += 1
         self.sequencer_view.update_ui(None)
 
-    def sequence_step(self, widget, state):
-        if self.ui_updating:
-            return
+    def last_bar(self):
+        sequencer = self.active_sequencer
+        return (sequencer.step_count - 1) // sequencer.steps_per_bar
 
-        if state == 'normal':
-            value = None
-        else:
-            value = (self.current_octave * 12) + widget.note_offset_id
+    def toggle_note(self, step_id, value):
+        # Grid cells toggle single notes in and out of the step's chord
+        if step_id >= self.active_sequencer.step_count or value > 127:
+            return
+        chord = mask_notes(self.active_sequencer.steps.note_mask(step_id) ^ (1 << value))
         Logger.info(
-            'Scheduling Sequencer #{} to Play Note {} on Step {}'.format(
-                self.active_sequencer.id, value, widget.parent.step_id
+            'Scheduling Sequencer #{} to Play Notes {} on Step {}'.format(
+                self.active_sequencer.id, chord, step_id
             )
         )
-        self.active_sequencer.set_note_for_step(widget.parent.step_id, value)
+        self.active_sequencer.set_chord_for_step(step_id, chord)
+        self.sequencer_view.update_ui(None)
 
     def start_playback(self):
-        self.active_sequencer.active_step = 0
-        self.step_timer = Clock.schedule_interval(self.tick, self.get_tick_interval())
+        for sequencer in self.sequencers:
+            sequencer.locate(0)
+        # Sequencers only wake the clock on steps they play something on,
+        # the one on screen is followed so its playhead moves every step
+        self.playback_clock = PolymeterClock(
+            self.sequencers,
+            self.tempo_map,
+            on_tick=Clock.create_trigger(self.sequencer_view.update_ui),
+            follow=[self.active_sequencer],
+            clock_output=MidiClockOutput() if self.send_clock else None
+        )
+        self.playback_clock.start()
         Logger.info('Playback Started')
 
+    def start_recording(self):
+        # Into the sequencer on screen, lined up with the running clock
+        if self.playback_clock is None or self.record_device is None or self.recorder is not None:
+            return
+        self.recorder = NoteRecorder(self.playback_clock, self.active_sequencer, self.record_strength)
+        self.record_input = RawMidiInput(self.record_device, self.recorder.receive)
+        self.record_input.start()
+        Clock.schedule_interval(self.write_recorded_notes, RECORD_BATCH_INTERVAL)
+        Logger.info('Recording Started')
+
+    def stop_recording(self):
+        if self.recorder is None:
+            return
+        self.record_input.stop()
+        Clock.unschedule(self.write_recorded_notes)
+        self.recorder.release(timer())
+        self.write_recorded_notes(None)
+        self.recorder = None
+        Logger.info('Recording Stopped')
+
+    def write_recorded_notes(self, delta):
+        if self.recorder.flush() and self.recorder.sequencer is self.active_sequencer:
+            self.sequencer_view.update_ui(None)
+
     def stop_playback(self):
-        if self.step_timer:
-            self.step_timer.cancel()
-            self.step_timer = None
+        self.stop_recording()
+        if self.playback_clock:
+            self.playback_clock.stop()
+            Logger.info('Playback Stopped ({})'.format(self.playback_clock.report))
+            self.playback_clock = None
+        for sequencer in self.sequencers:
+            sequencer.release_all()
+        midi_engine.flush()
         self.sequencer_view._reset_step_view()
-        Logger.info('Playback Stopped')
 
     def switch_sequencer(self, sequencer_id):
         sequencer_id = int(sequencer_id.lstrip('Sequencer #'))
         Logger.info('Switching to Sequencer #{}'.format(sequencer_id))
 
-    def tick(self, delta):
-        for sequencer in self.sequencers:
-            sequencer.tick(delta)
-        self.sequencer_view.update_ui(delta)
+    def undo(self, redo=False):
+        sequencer = self.history.redo() if redo else self.history.undo()
+        if sequencer is self.active_sequencer:
+            self.sequencer_view.update_ui(None)
+
+    def on_keyboard(self, window, key, scancode=None, codepoint=None, modifiers=()):
+        # Ctrl+Z undoes, Ctrl+Y or Ctrl+Shift+Z redoes
+        if 'ctrl' in modifiers and key in (KEY_Y, KEY_Z):
+            self.undo(redo=key == KEY_Y or 'shift' in modifiers)
+            return True
+        # Ctrl+R records from record_device while playing
+        if 'ctrl' in modifiers and key == KEY_R:
+            if self.recorder is None:
+                self.start_recording()
+            else:
+                self.stop_recording()
+            return True
+        # F11 toggles playback instrumentation, F12 dumps the histograms
+        if key == KEY_F11:
+            if instruments.enabled:
+                instruments.disable()
+            else:
+                instruments.reset()
+                instruments.enable()
+            Logger.info('Instrumentation {}'.format('enabled' if instruments.enabled else 'disabled'))
+            return True
+        if key == KEY_F12:
+            for line in instruments.dump().splitlines():
+                Logger.info(line)
+            return True
+        return False
 
     def initialize_app_state(self):
-        self.ui_updating = False
         self.current_bar = 0
         self.current_octave = 2
 
@@ -185,12 +292,28 @@ class TestApp(App):
             for _id in range(8)
         ]
         self.active_sequencer = self.sequencers[0]
+        self.history = EditHistory()
+        for sequencer in self.sequencers:
+            self.history.attach(sequencer)
+        self.tempo_map = TempoMap(
+            self.active_sequencer.step_count,
+            self.bpm,
+            self.active_sequencer.beats_per_bar,
+            self.active_sequencer.beat_subdivision
+        )
         self.sequencer_view = SequencerView()
+        state = self.sequencer_view.step_grid.window.state
+        for sequencer in self.sequencers:
+            # Bulk edits, undo and pattern changes redraw whatever they
+            # changed on screen
+            sequencer.listeners.append(state.sequencer_changed)
+            sequencer.pattern_listeners.append(state.pattern_replaced)
         self.sequencer_view.menu.sequencer_spinner.values = [
             'Sequencer #{}'.format(sequencer_id)
             for sequencer_id in range(len(self.sequencers))
         ]
         self.sequencer_view.update_ui(None)
+        Window.bind(on_keyboard=self.on_keyboard)
         return self.sequencer_view
 
 
@@ -0,0 +1,180 @@
+import time
+
+from unittest import TestCase
+
+from arrangement import Arrangement, Track
+from clock import PolymeterClock
+from midi_engine import NOTE_ON, NullBackend, RecordingBackend, midi_engine
+from pattern import Pattern
+from scheduler import ArrangementScheduler
+from sequencer import Sequencer
+from steps import StepStore
+from tempo import TempoMap
+
+
+def build_pattern(step_count, notes):
+    steps = StepStore(step_count)
+    for step_id, value in notes.items():
+        steps.set(step_id, value)
+    return Pattern(steps)
+
+
+def build_sequencer(_id=0):
+    return Sequencer(_id, bars=1, beats_per_bar=1, steps_per_beat=4, midi_channel=_id)
+
+
+def play(scheduler, beats):
+    # What PolymeterClock does with a scheduler, without the waiting
+    played = []
+    while scheduler.peek() is not None and scheduler.peek() < beats:
+        beat, indexes = scheduler.pop()
+        for index in indexes:
+            sequencer = scheduler.sequencers[index]
+            if scheduler.audible(index):
+                played.extend((beat, index, event[3]) for event in sequencer.advance() if event[1] == 'NoteOn')
+            else:
+                sequencer.skip()
+            scheduler.schedule(index)
+    return played
+
+
+class TestTrack(TestCase):
+    def test_sections_are_found_by_position(self):
+        a, b = build_pattern(4, {}), build_pattern(8, {})
+        track = Track(build_sequencer(), [(a, 2), (b, 1)])
+        self.assertEqual(list(track.starts), [0, 8, 16])
+        self.assertEqual([track.section_at(position) for position in (-1, 0, 7, 8, 15, 16)], [None, 0, 0, 1, 1, None])
+        self.assertEqual(track.step_id(0, 6), 2)
+        self.assertEqual(track.step_id(1, 10), 2)
+
+    def test_editing_sections_moves_the_ones_after(self):
+        a, b = build_pattern(4, {}), build_pattern(8, {})
+        track = Track(build_sequencer(), [(a, 1), (a, 1)])
+        track.insert(1, b, 2)
+        self.assertEqual(list(track.starts), [0, 4, 20, 24])
+        track.set_repeats(0, 3)
+        self.assertEqual(list(track.starts), [0, 12, 28, 32])
+        track.remove(1)
+        self.assertEqual(list(track.starts), [0, 12, 16])
+        self.assertRaises(ValueError, track.set_repeats, 0, 0)
+
+
+class TestArrangement(TestCase):
+    def test_solo_silences_every_other_track(self):
+        arrangement = Arrangement()
+        first = arrangement.add_track(build_sequencer(0))
+        second = arrangement.add_track(build_sequencer(1))
+        self.assertTrue(arrangement.audible(first))
+        first.muted = True
+        self.assertFalse(arrangement.audible(first))
+        second.soloed = True
+        first.muted = False
+        self.assertEqual([arrangement.audible(first), arrangement.audible(second)], [False, True])
+        self.assertIs(arrangement.track(second.sequencer), second)
+
+
+class TestArrangementScheduler(TestCase):
+    def test_sections_play_in_turn_and_repeat(self):
+        a, b = build_pattern(4, {0: 60}), build_pattern(8, {2: 62})
+        arrangement = Arrangement()
+        arrangement.add_track(build_sequencer(), [(a, 2), (b, 1)])
+        scheduler = ArrangementScheduler(arrangement)
+        scheduler.start(first_position=0)
+        self.assertEqual(play(scheduler, 10), [(0.0, 0, 60), (1.0, 0, 60), (2.5, 0, 62)])
+        # Nothing after the end of the song
+        self.assertIsNone(scheduler.peek())
+
+    def test_the_next_section_is_compiled_before_it_starts(self):
+        a, b = build_pattern(4, {0: 60}), build_pattern(4, {1: 62})
+        arrangement = Arrangement()
+        sequencer = arrangement.add_track(build_sequencer(), [(a, 1), (b, 1)]).sequencer
+        scheduler = ArrangementScheduler(arrangement)
+        scheduler.start(first_position=0)
+        self.assertIs(sequencer.pattern, a)
+        section, pattern, timeline = scheduler.prefetched[0]
+        self.assertEqual(section, 1)
+        self.assertIs(pattern, b)
+        self.assertIsNotNone(b._compiled)
+        self.assertEqual(timeline.event_steps, [1, 2])
+        play(scheduler, 1.25)
+        self.assertIs(sequencer.pattern, b)
+        self.assertIs(sequencer.timeline, timeline)
+        self.assertIsNone(scheduler.prefetched[0])
+
+    def test_notes_held_into_the_next_section_are_stopped(self):
+        held = StepStore(4)
+        held.set(2, 60)
+        held.set(3, 60, is_hold=True)
+        a, b = Pattern(held), build_pattern(4, {})
+        arrangement = Arrangement()
+        sequencer = arrangement.add_track(build_sequencer(), [(a, 1), (b, 1)]).sequencer
+        scheduler = ArrangementScheduler(arrangement)
+        scheduler.start(first_position=0)
+        play(scheduler, 1.0)
+        self.assertTrue(sequencer.sounding)
+        play(scheduler, 1.25)
+        self.assertFalse(sequencer.sounding)
+
+    def test_locate_finds_the_section_without_replaying_the_song(self):
+        patterns = [build_pattern(4, {step_id: 60 + step_id}) for step_id in range(4)]
+        arrangement = Arrangement()
+        sequencer = arrangement.add_track(
+            build_sequencer(), [(patterns[section % 4], 1 + section % 3) for section in range(5000)]
+        ).sequencer
+        track = arrangement.tracks[0]
+        scheduler = ArrangementScheduler(arrangement)
+        calls = []
+        sequencer.advance = lambda advance=sequencer.advance: calls.append(1) or advance()
+        beat = track.starts[4000] / 4.0 + 0.5
+        scheduler.locate(beat)
+        self.assertEqual(calls, [])
+        # Two steps into section 4000, pattern 0 twice, then pattern 1
+        self.assertIs(sequencer.pattern, patterns[0])
+        self.assertEqual(play(scheduler, 2), [(0.5, 0, 60), (1.75, 0, 61)])
+
+    def test_muted_tracks_keep_their_place(self):
+        arrangement = Arrangement()
+        track = arrangement.add_track(build_sequencer(), [(build_pattern(4, {0: 60, 2: 62}), 4)])
+        scheduler = ArrangementScheduler(arrangement)
+        scheduler.start(first_position=0)
+        self.assertEqual(len(play(scheduler, 1)), 2)
+        track.muted = True
+        self.assertEqual(play(scheduler, 2), [])
+        track.muted = False
+        self.assertEqual(play(scheduler, 3), [(2.0, 0, 60), (2.5, 0, 62)])
+
+
+class TestPolymeterClockArrangement(TestCase):
+    def setUp(self):
+        self.backend = RecordingBackend()
+        midi_engine.set_backend(self.backend)
+
+    def tearDown(self):
+        midi_engine.set_backend(NullBackend())
+
+    def note_ons(self):
+        return [(message[0] & 0x0F, message[1]) for message in self.backend.messages if message[0] & 0xF0 == NOTE_ON]
+
+    def wait_for(self, count):
+        deadline = time.time() + 5
+        while len(self.note_ons()) < count and time.time() < deadline:
+            time.sleep(0.005)
+
+    def test_plays_and_seeks_a_song(self):
+        a, b, c = build_pattern(4, {0: 60}), build_pattern(4, {0: 62}), build_pattern(4, {0: 64})
+        arrangement = Arrangement()
+        arrangement.add_track(build_sequencer(0), [(a, 1), (b, 1), (c, 1)])
+        muted = arrangement.add_track(build_sequencer(1), [(a, 3)])
+        muted.muted = True
+        tempo_map = TempoMap(4, bpm=2000, beats_per_bar=1, steps_per_beat=4)
+        clock = PolymeterClock(arrangement.sequencers, tempo_map, arrangement=arrangement)
+        clock.start()
+        self.wait_for(3)
+        time.sleep(0.05)
+        self.assertEqual(self.note_ons(), [(0, 60), (0, 62), (0, 64)])
+
+        del self.backend.messages[:]
+        clock.seek(1)
+        self.wait_for(2)
+        clock.stop()
+        self.assertEqual(self.note_ons(), [(0, 62), (0, 64)])
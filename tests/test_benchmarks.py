@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from benchmarks.suite import (
+    HEADLESS_MODULES, HIGHER_IS_BETTER, LOWER_IS_BETTER, STARTUP_BUDGET, baseline_results, compare, import_times, run
+)
+
+
+class TestBenchmarkSuite(TestCase):
+    def test_compare_flags_results_outside_the_tolerance(self):
+        baseline = {
+            'rate': {'value': 100.0, 'better': HIGHER_IS_BETTER},
+            'latency': {'value': 1.0, 'better': LOWER_IS_BETTER},
+        }
+        results = {
+            'rate': {'value': 70.0, 'better': HIGHER_IS_BETTER},
+            'latency': {'value': 1.2, 'better': LOWER_IS_BETTER},
+            'new': {'value': 1.0, 'better': LOWER_IS_BETTER},
+        }
+        self.assertEqual(compare(results, baseline, 0.25), [('rate', 100.0, 70.0)])
+
+    def test_cold_starts_get_their_own_tolerance(self):
+        name = 'startup.headless_import.seconds'
+        baseline = {name: {'value': 0.02, 'better': LOWER_IS_BETTER}}
+        self.assertEqual(compare({name: {'value': 0.035, 'better': LOWER_IS_BETTER}}, baseline, 0.25), [])
+        self.assertEqual(
+            compare({name: {'value': 0.05, 'better': LOWER_IS_BETTER}}, baseline, 0.25), [(name, 0.02, 0.05)]
+        )
+
+    def test_baselines_are_what_most_runs_match_or_beat(self):
+        runs = [
+            {
+                'rate': {'value': value, 'better': HIGHER_IS_BETTER},
+                'latency': {'value': value, 'better': LOWER_IS_BETTER},
+            }
+            for value in (300.0, 100.0, 500.0, 200.0, 400.0)
+        ]
+        self.assertEqual(baseline_results(runs), {
+            'rate': {'value': 200.0, 'better': HIGHER_IS_BETTER},
+            'latency': {'value': 400.0, 'better': LOWER_IS_BETTER},
+        })
+
+    def test_run_produces_machine_readable_results(self):
+        results = run(['memory'], repeat=1)
+        self.assertEqual(list(results), ['memory.bytes_per_pattern'])
+        self.assertEqual(results['memory.bytes_per_pattern']['better'], LOWER_IS_BETTER)
+
+    def test_headless_start_stays_inside_the_budget_without_kivy(self):
+        times = import_times(('cli',) + HEADLESS_MODULES)
+        self.assertIn('sequencer', times)
+        self.assertEqual([name for name in times if name.split('.')[0] == 'kivy'], [])
+        self.assertLess(sum(times.values()), STARTUP_BUDGET)
@@ -0,0 +1,60 @@
+import io
+import os
+import shutil
+import tempfile
+
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+from cli import main
+from midi_clock import START, STOP, TIMING_CLOCK
+from midi_engine import NOTE_ON, NullBackend, midi_engine
+from persistence import save_session
+from sequencer import Sequencer
+
+
+class TestCli(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session = os.path.join(self.directory, 'session.pyseq')
+        sequencer = Sequencer(0, bars=1, midi_channel=2)
+        sequencer.set_note_for_step(0, 60)
+        save_session(self.session, [sequencer])
+
+    def tearDown(self):
+        midi_engine.set_backend(NullBackend())
+        shutil.rmtree(self.directory)
+
+    def test_play_runs_headless_through_a_device(self):
+        device = os.path.join(self.directory, 'midi')
+        open(device, 'wb').close()
+        self.assertEqual(main(['play', self.session, '--bpm', '960', '--bars', '1', '--device', device]), 0)
+        with open(device, 'rb') as fp:
+            self.assertEqual(fp.read(3), bytes((NOTE_ON | 2, 60, 100)))
+
+    def test_play_sends_clock_to_the_device(self):
+        device = os.path.join(self.directory, 'midi')
+        open(device, 'wb').close()
+        arguments = ['play', self.session, '--bpm', '960', '--bars', '1', '--device', device, '--send-clock']
+        self.assertEqual(main(arguments), 0)
+        with open(device, 'rb') as fp:
+            data = fp.read()
+        self.assertEqual(data[:5], bytes((START, TIMING_CLOCK, NOTE_ON | 2, 60, 100)))
+        self.assertIn(bytes((STOP,)), data)
+
+    def test_play_follows_clock_until_the_leader_stops(self):
+        clock_in = os.path.join(self.directory, 'clock')
+        with open(clock_in, 'wb') as fp:
+            fp.write(bytes((START, STOP)))
+        self.assertEqual(main(['play', self.session, '--clock-in', clock_in]), 0)
+
+    def test_render_and_smf_keep_their_own_arguments(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main(['render', self.session, '--bars', '2', '--json']), 0)
+        self.assertIn('"events": 4', output.getvalue())
+        self.assertEqual(main(['smf', 'export', self.session, os.path.join(self.directory, 'out.mid')]), 0)
+
+    def test_no_command_prints_help(self):
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(main([]), 1)
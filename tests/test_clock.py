@@ -0,0 +1,105 @@
+import threading
+
+from unittest import TestCase
+
+from clock import JitterReport, PlaybackClock, PolymeterClock
+from sequencer import Sequencer
+from tempo import TempoMap
+
+
+class CountingSequencer(object):
+    def __init__(self, target):
+        self.ticks = 0
+        self.target = target
+        self.done = threading.Event()
+
+    def tick(self, delta):
+        self.ticks += 1
+        if self.ticks >= self.target:
+            self.done.set()
+
+
+class TestJitterReport(TestCase):
+    def test_record_tracks_error_statistics(self):
+        report = JitterReport()
+        report.record(1.0, 1.001, 0.01)
+        report.record(2.0, 2.003, 0.01)
+        self.assertEqual(report.tick_count, 2)
+        self.assertAlmostEqual(report.mean_error, 0.002)
+        self.assertAlmostEqual(report.max_error, 0.003)
+        self.assertAlmostEqual(report.min_error, 0.001)
+        self.assertAlmostEqual(report.jitter, 0.001)
+        self.assertAlmostEqual(report.drift, 0.003)
+        self.assertEqual(report.missed_deadlines, 0)
+
+    def test_record_counts_missed_deadlines(self):
+        report = JitterReport()
+        report.record(1.0, 1.02, 0.01)
+        self.assertEqual(report.missed_deadlines, 1)
+
+
+class TestPlaybackClock(TestCase):
+    def test_clock_ticks_every_sequencer_on_its_own_thread(self):
+        sequencers = [CountingSequencer(20), CountingSequencer(20)]
+        notified = []
+        clock = PlaybackClock(sequencers, 0.002, on_tick=lambda: notified.append(threading.current_thread()))
+        clock.start()
+        self.assertTrue(sequencers[0].done.wait(5))
+        clock.stop()
+        self.assertFalse(clock.is_running)
+        self.assertEqual(sequencers[0].ticks, sequencers[1].ticks)
+        self.assertEqual(len(notified), sequencers[0].ticks)
+        self.assertNotEqual(notified[0], threading.current_thread())
+        self.assertEqual(clock.report.tick_count, sequencers[0].ticks)
+
+    def test_set_interval_rebases_the_schedule(self):
+        sequencer = CountingSequencer(10)
+        clock = PlaybackClock([sequencer], 0.002)
+        clock.start()
+        clock.set_interval(0.001)
+        self.assertTrue(sequencer.done.wait(5))
+        clock.stop()
+        self.assertEqual(clock.interval, 0.001)
+
+    def test_tempo_map_sets_each_steps_deadline_and_length(self):
+        class DeltaSequencer(CountingSequencer):
+            def tick(self, delta):
+                self.deltas.append(delta)
+                super(DeltaSequencer, self).tick(delta)
+
+        sequencer = DeltaSequencer(8)
+        sequencer.deltas = []
+        tempo_map = TempoMap(4, bpm=60000, beats_per_bar=1, steps_per_beat=1)
+        tempo_map.set_tempo(3, 30000)
+        clock = PlaybackClock([sequencer], 0.001, tempo_map=tempo_map)
+        clock.start()
+        self.assertTrue(sequencer.done.wait(5))
+        clock.stop()
+        self.assertEqual([round(delta, 6) for delta in sequencer.deltas[:8]], [0.001, 0.001, 0.002, 0.001] * 2)
+
+
+class TestPolymeterClock(TestCase):
+    def build_sequencer(self, _id):
+        sequencer = Sequencer(_id, step_count=4, beats_per_bar=1, steps_per_beat=1, midi_channel=None)
+        ticked = threading.Event()
+        tick = sequencer.tick
+
+        def counting_tick(delta):
+            tick(delta)
+            ticked.set()
+        sequencer.tick = counting_tick
+        return sequencer, ticked
+
+    def test_idle_sequencers_wait_until_they_are_edited(self):
+        (busy, busy_ticked), (idle, idle_ticked) = self.build_sequencer(0), self.build_sequencer(1)
+        busy.set_note_for_step(2, 60)
+        tempo_map = TempoMap(4, bpm=30000, beats_per_bar=1, steps_per_beat=1)
+        clock = PolymeterClock([busy, idle], tempo_map)
+        clock.start()
+        self.assertTrue(busy_ticked.wait(5))
+        self.assertFalse(idle_ticked.wait(0.05))
+        idle.set_note_for_step(0, 60)
+        self.assertTrue(idle_ticked.wait(5))
+        clock.stop()
+        self.assertFalse(clock.is_running)
+        self.assertEqual(idle.listeners, [])
@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+from groove import Groove
+from midi_engine import RecordingBackend, midi_engine
+from midi_queue import QueuedBackend
+from render import OfflineRenderer
+from sequencer import Sequencer
+
+
+class TestGroove(TestCase):
+    def test_straight_groove_has_no_offsets(self):
+        groove = Groove()
+        self.assertTrue(groove.is_straight)
+        self.assertEqual(groove.compile(4), (0.0, 0.0, 0.0, 0.0))
+
+    def test_swing_delays_every_second_step(self):
+        offsets = Groove(swing=75).compile(4)
+        self.assertEqual(offsets, (0.0, 0.5, 0.0, 0.5))
+
+    def test_offsets_repeat_over_the_pattern(self):
+        offsets = Groove(offsets=[0.1, 0.0, -0.1]).compile(6)
+        self.assertEqual(offsets, (0.1, 0.0, -0.1, 0.1, 0.0, -0.1))
+
+    def test_humanize_is_reproducible_and_bounded(self):
+        first = Groove(humanize=0.05, seed=3).compile(64)
+        second = Groove(humanize=0.05, seed=3).compile(64)
+        self.assertEqual(first, second)
+        self.assertTrue(all(-0.05 <= offset <= 0.05 for offset in first))
+        self.assertNotEqual(first, Groove(humanize=0.05, seed=4).compile(64))
+
+    def test_compile_is_cached_per_step_count(self):
+        groove = Groove(swing=60)
+        self.assertIs(groove.compile(16), groove.compile(16))
+
+    def test_changing_a_parameter_recompiles(self):
+        groove = Groove(swing=60, offsets=[0.0])
+        self.assertAlmostEqual(groove.compile(4)[1], 0.2)
+        groove.swing = 75
+        self.assertEqual(groove.compile(4), (0.0, 0.5, 0.0, 0.5))
+        groove.offsets[0] = 0.1
+        self.assertEqual(groove.compile(4), (0.1, 0.6, 0.1, 0.6))
+
+
+class TestGroovePlayback(TestCase):
+    def setUp(self):
+        self.previous_backend = midi_engine.backend
+        self.recording = RecordingBackend()
+        midi_engine.set_backend(self.recording)
+
+    def tearDown(self):
+        midi_engine.set_backend(self.previous_backend)
+
+    def test_tick_passes_the_step_offset_as_a_delay(self):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=1, steps_per_beat=4, midi_channel=0, groove=Groove(swing=75))
+        sequencer.set_note_for_step(1, 60)
+        sequencer.tick(0.2)
+        self.assertEqual(self.recording.delays, [0.1])
+
+    def test_straight_groove_keeps_the_plain_send_path(self):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=1, steps_per_beat=4, midi_channel=0)
+        sequencer.set_groove(Groove())
+        self.assertIsNone(sequencer.groove_offsets)
+        sequencer.set_note_for_step(1, 60)
+        sequencer.tick(0.2)
+        self.assertEqual(self.recording.delays, [0.0])
+
+    def test_setting_an_edited_groove_again_picks_up_the_change(self):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=1, steps_per_beat=4, midi_channel=0)
+        groove = Groove(swing=60)
+        sequencer.set_groove(groove)
+        groove.swing = 75
+        sequencer.set_groove(groove)
+        self.assertEqual(sequencer.groove_offsets[1], 0.5)
+
+    def test_offsets_follow_step_count_changes(self):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=1, steps_per_beat=4, midi_channel=0, groove=Groove(swing=75))
+        sequencer.bars = 2
+        sequencer.update_step_count()
+        self.assertEqual(len(sequencer.groove_offsets), 8)
+
+    def test_renderer_stamps_events_with_the_offset(self):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0, groove=Groove(swing=75))
+        sequencer.set_note_for_step(1, 60)
+        timestamps = [event[0] for event in OfflineRenderer([sequencer], bpm=120).events(bars=1)]
+        self.assertEqual(timestamps, [0.125 * 1.5, 0.125 * 2])
+
+
+class TestQueuedBackendDelays(TestCase):
+    def test_messages_are_queued_in_time_order(self):
+        recording = RecordingBackend()
+        backend = QueuedBackend(recording, latency=0.01)
+        backend.writer.stop()
+        backend.begin_tick(100.0)
+        backend.send(b'late', 0.005)
+        backend.send(b'early', -1.0)
+        backend.send(b'on time')
+        backend.flush()
+        self.assertEqual(backend.ring.pop(), (100.0, b'early'))
+        self.assertEqual(backend.ring.pop(), (100.01, b'on time'))
+        self.assertEqual(backend.ring.pop(), (100.015, b'late'))
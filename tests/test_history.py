@@ -0,0 +1,193 @@
+import random
+
+from unittest import TestCase
+
+from arrangement import Arrangement
+from history import DeltaRing, EditHistory, ENTRY, RECORD
+from pattern import Pattern
+from scheduler import ArrangementScheduler
+from sequencer import Sequencer
+from steps import StepStore
+from timeline import Timeline
+
+
+class TestDeltaRing(TestCase):
+    def test_records_walk_back_and_forward(self):
+        ring = DeltaRing(64)
+        ring.push(b'one')
+        ring.push(b'two')
+        self.assertEqual(ring.back(), b'two')
+        self.assertEqual(ring.back(), b'one')
+        self.assertIsNone(ring.back())
+        self.assertEqual(ring.forward(), b'one')
+        ring.push(b'three')
+        self.assertIsNone(ring.forward())
+        self.assertEqual(ring.back(), b'three')
+        self.assertEqual(ring.back(), b'one')
+
+    def test_oldest_records_make_room_and_wrap_round(self):
+        ring = DeltaRing(40)
+        for index in range(20):
+            ring.push(bytes([index]) * 7)
+            self.assertLessEqual(len(ring), 40)
+        self.assertEqual(ring.back(), bytes([19]) * 7)
+        self.assertEqual(ring.back(), bytes([18]) * 7)
+        self.assertIsNone(ring.back())
+        self.assertFalse(ring.push(b'x' * 40))
+        self.assertIsNone(ring.back())
+
+
+class TestEditHistory(TestCase):
+    def setUp(self):
+        self.sequencer = Sequencer(0, bars=2, midi_channel=1)
+        self.history = EditHistory()
+        self.history.attach(self.sequencer)
+
+    def assertConsistent(self, sequencer):
+        self.assertEqual(sequencer.timeline.events, Timeline(sequencer.steps, sequencer.midi_channel).events)
+
+    def test_undo_and_redo_a_single_step(self):
+        self.sequencer.set_note_for_step(3, 60)
+        self.sequencer.set_velocity(3, 40)
+        self.assertIs(self.history.undo(), self.sequencer)
+        self.assertEqual(self.sequencer.steps[3].velocity, 100)
+        self.history.undo()
+        self.assertIsNone(self.sequencer.steps[3].value)
+        self.assertIsNone(self.history.undo())
+        self.history.redo()
+        self.history.redo()
+        self.assertEqual((self.sequencer.steps[3].value, self.sequencer.steps[3].velocity), (60, 40))
+        self.assertFalse(self.history.can_redo)
+        self.assertConsistent(self.sequencer)
+
+    def test_only_changed_lanes_and_steps_are_recorded(self):
+        self.sequencer.set_note_for_step(3, 60)
+        self.assertEqual(len(self.history.ring), 2 * 4 + RECORD.size + ENTRY.size)
+        self.sequencer.set_note_for_step(3, 60)
+        self.assertEqual(len(self.history.ring), 2 * 4 + RECORD.size + ENTRY.size)
+
+    def test_bulk_edits_undo_in_one_batch(self):
+        self.sequencer.fill_every(2, 60)
+        self.sequencer.set_chord_for_step(4, [60, 64])
+        self.sequencer.set_cc(5, 74, 20)
+        before = self.sequencer.steps.digest()
+        changes = []
+        self.sequencer.listeners.append(lambda sequencer, first, last: changes.append((first, last)))
+        self.sequencer.transpose(5, 2, 9)
+        self.sequencer.rotate(3)
+        after = self.sequencer.steps.digest()
+        self.history.undo()
+        self.history.undo()
+        self.assertEqual(self.sequencer.steps.digest(), before)
+        self.assertEqual(len(changes), 4)
+        self.assertConsistent(self.sequencer)
+        self.history.redo()
+        self.history.redo()
+        self.assertEqual(self.sequencer.steps.digest(), after)
+        self.assertConsistent(self.sequencer)
+
+    def test_removed_cc_lanes_come_back(self):
+        self.sequencer.set_cc(2, 1, 64)
+        self.sequencer.remove_cc_lane(1)
+        self.history.undo()
+        self.assertEqual(self.sequencer.steps.cc_lanes[1][2], 64)
+        self.assertConsistent(self.sequencer)
+
+    def test_edits_to_each_sequencer_undo_in_order(self):
+        other = Sequencer(1, bars=1, midi_channel=2)
+        self.history.attach(other)
+        self.sequencer.set_note_for_step(0, 36)
+        other.set_note_for_step(0, 38)
+        self.assertIs(self.history.undo(), other)
+        self.assertIsNone(other.steps[0].value)
+        self.assertEqual(self.sequencer.steps[0].value, 36)
+        self.assertIs(self.history.undo(), self.sequencer)
+        self.assertIsNone(self.sequencer.steps[0].value)
+
+    def test_resizing_forgets_the_history(self):
+        self.sequencer.set_note_for_step(0, 36)
+        self.sequencer.bars = 1
+        self.sequencer.update_step_count()
+        self.assertFalse(self.history.can_undo)
+        self.sequencer.set_note_for_step(1, 36)
+        self.history.undo()
+        self.assertEqual(self.sequencer.steps[0].value, 36)
+
+    def test_sections_cued_by_an_arrangement_are_not_edits(self):
+        sections = []
+        for value in (60, 62):
+            steps = StepStore(self.sequencer.step_count)
+            steps.set(0, value)
+            steps.set(8, value)
+            sections.append((Pattern(steps), 1))
+        arrangement = Arrangement()
+        arrangement.add_track(self.sequencer, sections)
+        ArrangementScheduler(arrangement).start(first_position=0)
+        self.sequencer.set_note_for_step(4, 36)
+        self.sequencer.cue_pattern(sections[1][0])
+        self.sequencer.set_note_for_step(5, 38)
+        self.assertEqual(len(self.history.ring), 2 * (2 * 4 + RECORD.size + ENTRY.size))
+        self.history.undo()
+        self.assertEqual([self.sequencer.steps[step_id].value for step_id in (0, 5, 8)], [62, None, 62])
+        self.assertIsNone(sections[1][0].steps[5].value)
+        self.assertConsistent(self.sequencer)
+
+    def test_long_sessions_stay_inside_the_budget(self):
+        history = EditHistory(budget=1024)
+        sequencer = Sequencer(2, bars=4, midi_channel=0)
+        history.attach(sequencer)
+        for step_id in range(sequencer.step_count):
+            sequencer.set_note_for_step(step_id, 60)
+            self.assertLessEqual(len(history.ring), 1024)
+        undone = 0
+        while history.undo() is not None:
+            undone += 1
+        self.assertTrue(0 < undone < sequencer.step_count)
+        self.assertEqual(sequencer.steps[sequencer.step_count - 1].value, None)
+        self.assertEqual(sequencer.steps[0].value, 60)
+
+    def test_random_edits_undo_back_to_the_start(self):
+        rng = random.Random(20)
+        self.sequencer.set_note_for_step_range(4, 7, 48)
+        self.history.clear()
+        start = self.sequencer.steps.digest()
+        digests = []
+        ends = [self.history.ring.end]
+
+        def recorded(sequencer, first_step_id, last_step_id):
+            # One digest per record, edits that change nothing aren't recorded
+            if self.history.ring.end != ends[-1]:
+                ends.append(self.history.ring.end)
+                digests.append(sequencer.steps.digest())
+
+        self.sequencer.listeners.append(recorded)
+        for _ in range(200):
+            step_id = rng.randrange(self.sequencer.step_count)
+            operation = rng.choice(['note', 'chord', 'clear', 'gate', 'cc', 'rotate', 'reverse', 'euclid'])
+            if operation == 'note':
+                self.sequencer.set_note_for_step(step_id, rng.choice([None, 60]))
+            elif operation == 'chord':
+                self.sequencer.clear_note_for_step(step_id)
+                self.sequencer.set_chord_for_step_range(step_id, step_id + rng.randrange(4), [60, 63, 67])
+            elif operation == 'clear':
+                self.sequencer.clear_note_for_step(step_id)
+            elif operation == 'gate':
+                self.sequencer.set_gate(step_id, rng.choice([0.3, 1.0]))
+            elif operation == 'cc':
+                self.sequencer.set_cc(step_id, 7, rng.choice([None, 100]))
+            elif operation == 'rotate':
+                self.sequencer.rotate(rng.randrange(-5, 5), step_id)
+            elif operation == 'reverse':
+                self.sequencer.reverse(step_id)
+            else:
+                self.sequencer.euclid(rng.randrange(4), 36, 0, rng.randrange(4, 32))
+        self.sequencer.listeners.remove(recorded)
+        for digest in reversed(digests):
+            self.assertEqual(self.sequencer.steps.digest(), digest)
+            self.history.undo()
+        self.assertEqual(self.sequencer.steps.digest(), start)
+        self.assertConsistent(self.sequencer)
+        for digest in digests:
+            self.history.redo()
+            self.assertEqual(self.sequencer.steps.digest(), digest)
+        self.assertConsistent(self.sequencer)
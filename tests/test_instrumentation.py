@@ -0,0 +1,55 @@
+import mock
+
+from unittest import TestCase
+
+from instrumentation import Histogram, Instrumentation
+from sequencer import Sequencer
+
+
+class TestHistogram(TestCase):
+    def test_bucket_index_and_value_round_trip_within_precision(self):
+        for nanoseconds in [0, 1, 63, 64, 65, 1000, 123456, 10 ** 9, 2 ** 40 + 12345]:
+            index = Histogram.bucket_index(nanoseconds)
+            lower = Histogram.bucket_value(index)
+            self.assertLessEqual(lower, nanoseconds)
+            self.assertLessEqual(nanoseconds - lower, max(1, nanoseconds // 32))
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for microseconds in range(1, 101):
+            histogram.record(microseconds / 1e6)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(50), 50e-6, delta=2e-6)
+        self.assertAlmostEqual(histogram.percentile(99), 99e-6, delta=4e-6)
+        self.assertAlmostEqual(histogram.as_dict()['max'], 100e-6)
+        self.assertAlmostEqual(histogram.mean, 50.5e-6, delta=1e-8)
+
+
+class TestInstrumentation(TestCase):
+    def test_sequencer_ticks_are_only_timed_when_enabled(self):
+        instrumentation = Instrumentation()
+        sequencer = Sequencer(0, bars=1, midi_channel=0)
+        with mock.patch('sequencer.instruments', instrumentation):
+            sequencer.tick(None)
+            self.assertEqual(instrumentation.histograms, {})
+            instrumentation.enable()
+            sequencer.tick(None)
+            sequencer.tick(None)
+        self.assertEqual(instrumentation.snapshot()['sequencer.tick']['count'], 2)
+        self.assertIn('sequencer.tick', instrumentation.dump())
+
+    def test_enabling_mid_tick_is_picked_up_on_the_next_tick(self):
+        instrumentation = Instrumentation()
+        sequencer = Sequencer(0, bars=1, midi_channel=0)
+        sequencer.set_note_for_step(0, 60)
+        with mock.patch('sequencer.instruments', instrumentation):
+            with mock.patch('sequencer.midi_engine') as engine:
+                # Another thread flips the flag while the tick sends
+                engine.send_message.side_effect = lambda *args: instrumentation.enable()
+                sequencer.active_step = -1
+                sequencer.tick(None)
+                self.assertEqual(instrumentation.histograms, {})
+                engine.send_message.side_effect = lambda *args: instrumentation.disable()
+                sequencer.active_step = -1
+                sequencer.tick(None)
+        self.assertEqual(instrumentation.snapshot()['sequencer.tick']['count'], 1)
@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+import time
+
+from unittest import TestCase
+
+from clock import PolymeterClock
+from midi_clock import (
+    CONTINUE, START, STOP, TIMING_CLOCK, MidiClockFollower, MidiClockOutput, PulseGenerator, song_position_message
+)
+from midi_engine import MidiEngine, NullBackend, RawMidiInput, RecordingBackend, midi_engine
+from sequencer import Sequencer
+from tempo import TempoMap
+
+
+def note_ons(messages):
+    return [message for message in messages if message[0] & 0xF0 == 0x90]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class TestSongPosition(TestCase):
+    def test_counts_sixteenths_in_two_seven_bit_bytes(self):
+        self.assertEqual(song_position_message(0), b'\xf2\x00\x00')
+        self.assertEqual(song_position_message(4), b'\xf2\x10\x00')
+        self.assertEqual(song_position_message(40), b'\xf2\x20\x01')
+
+
+class TestMidiClockOutput(TestCase):
+    def test_starts_from_the_top_or_continues_from_a_song_position(self):
+        backend = RecordingBackend()
+        output = MidiClockOutput(MidiEngine(backend))
+        output.start()
+        output.pulse()
+        output.pulse()
+        output.stop()
+        output.start(song_beat=4)
+        self.assertEqual(output.next_beat, 0)
+        self.assertEqual(backend.messages, [
+            bytes((START,)), bytes((TIMING_CLOCK,)), bytes((TIMING_CLOCK,)), bytes((STOP,)),
+            song_position_message(4), bytes((CONTINUE,)),
+        ])
+
+
+class TestMidiClockFollower(TestCase):
+    def feed(self, follower, messages):
+        for data, timestamp in messages:
+            follower.receive(data, timestamp)
+
+    def test_filters_jitter_out_of_the_pulses(self):
+        generator = PulseGenerator(120, jitter=0.002)
+        follower = MidiClockFollower()
+        self.feed(follower, generator.start())
+        filtered_error = raw_error = 0.0
+        for index, (data, timestamp) in enumerate(generator.pulses(24 * 32)):
+            follower.receive(data, timestamp)
+            if index >= 24 * 16:
+                ideal = index * generator.period
+                filtered_error += abs(follower.estimate - ideal)
+                raw_error += abs(timestamp - ideal)
+        self.assertAlmostEqual(follower.bpm, 120, delta=0.1)
+        self.assertLess(filtered_error, raw_error / 2)
+        self.assertEqual(follower.anchor()[1], (24 * 32 - 1) / 24.0)
+
+    def test_tracks_tempo_changes(self):
+        generator = PulseGenerator(120, jitter=0.001)
+        follower = MidiClockFollower()
+        self.feed(follower, generator.start() + generator.pulses(24 * 16))
+        generator.bpm = 130
+        self.feed(follower, generator.pulses(24 * 8))
+        self.assertAlmostEqual(follower.bpm, 130, delta=0.5)
+
+    def test_updates_the_tempo_map_beyond_the_tolerance(self):
+        tempo_map = TempoMap(16, bpm=100)
+        follower = MidiClockFollower(tempo_map, tolerance=0.01)
+        generator = PulseGenerator(100.5)
+        self.feed(follower, generator.start() + generator.pulses(24))
+        self.assertEqual(tempo_map.bpm_at(0), 100)
+        generator.bpm = 120
+        self.feed(follower, generator.pulses(24 * 16))
+        self.assertAlmostEqual(tempo_map.bpm_at(0), 120, delta=1.2)
+
+    def test_follows_the_leaders_transport(self):
+        follower = MidiClockFollower()
+        messages = []
+        follower.listeners.append(lambda follower, message: messages.append(message))
+        self.assertIsNone(follower.anchor())
+        follower.receive(bytes((START,)), 0.0)
+        self.assertTrue(follower.running)
+        follower.receive(bytes((TIMING_CLOCK,)), 0.0)
+        follower.receive(bytes((TIMING_CLOCK,)), 0.02)
+        self.assertEqual(follower.anchor(), (0.02, 1 / 24.0))
+        follower.receive(bytes((STOP,)), 0.03)
+        self.assertFalse(follower.running)
+
+        follower.receive(song_position_message(8), 0.04)
+        follower.receive(bytes((CONTINUE,)), 0.04)
+        self.assertEqual(follower.song_beat, 8)
+        self.assertIsNone(follower.anchor())
+        follower.receive(bytes((TIMING_CLOCK,)), 0.05)
+        follower.receive(bytes((TIMING_CLOCK,)), 0.07)
+        # Beats count from where the leader continued
+        self.assertEqual(follower.anchor(), (0.07, 1 / 24.0))
+        self.assertEqual(messages, ['start', 'pulse', 'stop', 'continue', 'pulse'])
+
+
+class TestPolymeterClockSync(TestCase):
+    def setUp(self):
+        self.backend = RecordingBackend()
+        midi_engine.set_backend(self.backend)
+
+    def tearDown(self):
+        midi_engine.set_backend(NullBackend())
+
+    def build_sequencer(self):
+        sequencer = Sequencer(0, step_count=16, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+        for step_id in range(sequencer.step_count):
+            sequencer.set_note_for_step(step_id, 60)
+        return sequencer
+
+    def test_sends_clock_between_steps(self):
+        sequencer = self.build_sequencer()
+        tempo_map = TempoMap(16, bpm=1000)
+        clock = PolymeterClock([sequencer], tempo_map, clock_output=MidiClockOutput())
+        clock.start()
+        self.assertTrue(wait_for(lambda: len(note_ons(self.backend.messages)) >= 8))
+        clock.stop()
+
+        messages = self.backend.messages
+        self.assertEqual(messages[0], bytes((START,)))
+        self.assertEqual(messages[-1], bytes((STOP,)))
+        pulses = [0]
+        for message in messages[1:-1]:
+            if message[0] == TIMING_CLOCK:
+                pulses[-1] += 1
+            elif message[0] & 0xF0 == 0x90:
+                pulses.append(0)
+        # Six pulses to a 16th, the first one on the downbeat
+        self.assertEqual(pulses[0], 1)
+        self.assertEqual(set(pulses[1:-1]), {6})
+
+    def test_follows_clock_from_a_midi_input(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'midi')
+        os.mkfifo(path)
+        sequencer = self.build_sequencer()
+        tempo_map = TempoMap(16, bpm=120)
+        follower = MidiClockFollower(tempo_map)
+        midi_input = RawMidiInput(path, follower.receive)
+        midi_input.start()
+        clock = PolymeterClock([sequencer], tempo_map, follower=follower)
+        clock.start()
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            self.assertFalse(wait_for(lambda: note_ons(self.backend.messages), timeout=0.05))
+            generator = PulseGenerator(300)
+            os.write(fd, generator.start()[0][0])
+            # 4 beats of clock, in real time
+            origin = time.perf_counter()
+            for data, timestamp in generator.pulses(24 * 4):
+                time.sleep(max(0.0, origin + timestamp - time.perf_counter()))
+                os.write(fd, data)
+            # Steps run up to the last pulse received and then wait
+            self.assertTrue(wait_for(lambda: len(note_ons(self.backend.messages)) >= 16))
+            os.write(fd, generator.stop()[0][0])
+            self.assertTrue(wait_for(lambda: not follower.running))
+            time.sleep(0.1)
+            self.assertIn(len(note_ons(self.backend.messages)), (16, 17))
+            # How close the estimate gets depends on when this thread got to
+            # write each pulse, see TestMidiClockFollower for its accuracy
+            self.assertGreater(tempo_map.bpm_at(0), 200)
+            self.assertAlmostEqual(tempo_map.bpm_at(0), follower.bpm, delta=follower.bpm * follower.tolerance)
+        finally:
+            os.close(fd)
+            clock.stop()
+            midi_input.stop()
+            shutil.rmtree(directory)
+        self.assertEqual(follower.listeners, [])
@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+from unittest import TestCase
+
+from midi_engine import (
+    BatchingBackend, MidiEngine, MidiParser, RawMidiBackend, RecordingBackend, coalesce_messages, encode_message
+)
+
+
+NOTE_ON_60 = encode_message('NoteOn', 0, 60)
+NOTE_OFF_60 = encode_message('NoteOff', 0, 60)
+NOTE_ON_62 = encode_message('NoteOn', 0, 62)
+
+
+class TestEncodeMessage(TestCase):
+    def test_encodes_channel_voice_messages(self):
+        self.assertEqual(encode_message('NoteOn', 2, 60), b'\x92\x3c\x64')
+        self.assertEqual(encode_message('NoteOff', 15, 60), b'\x8f\x3c\x00')
+        self.assertEqual(encode_message('ControlChange', 1, 74, 127), b'\xb1\x4a\x7f')
+
+
+class TestCoalesceMessages(TestCase):
+    def test_drops_duplicate_messages(self):
+        self.assertEqual(coalesce_messages([NOTE_ON_60, NOTE_ON_60, NOTE_ON_62]), [NOTE_ON_60, NOTE_ON_62])
+
+    def test_drops_a_note_that_starts_and_stops_in_the_same_batch(self):
+        self.assertEqual(coalesce_messages([NOTE_ON_60, NOTE_ON_62, NOTE_OFF_60]), [NOTE_ON_62])
+
+    def test_keeps_retriggers_unless_asked_to_merge_them(self):
+        self.assertEqual(coalesce_messages([NOTE_OFF_60, NOTE_ON_60]), [NOTE_OFF_60, NOTE_ON_60])
+        self.assertEqual(coalesce_messages([NOTE_OFF_60, NOTE_ON_60], merge_retriggers=True), [])
+
+
+class TestBackends(TestCase):
+    def test_batching_backend_writes_one_batch_per_flush(self):
+        recording = RecordingBackend()
+        engine = MidiEngine(BatchingBackend(recording))
+        for channel in range(8):
+            engine.send_message('NoteOn', channel, 60)
+        self.assertEqual(recording.writes, 0)
+        engine.flush()
+        engine.flush()
+        self.assertEqual(recording.writes, 1)
+        self.assertEqual(len(recording.messages), 8)
+
+    def test_raw_midi_backend_writes_bytes_to_the_device(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            backend = RawMidiBackend(path)
+            backend.send_batch([NOTE_ON_60, NOTE_OFF_60])
+            backend.close()
+            with open(path, 'rb') as fp:
+                self.assertEqual(fp.read(), NOTE_ON_60 + NOTE_OFF_60)
+        finally:
+            os.remove(path)
+
+    def test_delays_snap_to_the_nearest_tick_without_a_scheduling_backend(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            backend = RawMidiBackend(path)
+            engine = MidiEngine(backend)
+            engine.begin_tick(0.0)
+            engine.begin_tick(0.1)
+            engine.send_message('NoteOn', 0, 60, delay=0.02)
+            engine.send_message('NoteOff', 0, 60, delay=0.07)
+            with open(path, 'rb') as fp:
+                self.assertEqual(fp.read(), NOTE_ON_60)
+            engine.begin_tick(0.2)
+            backend.close()
+            with open(path, 'rb') as fp:
+                self.assertEqual(fp.read(), NOTE_ON_60 + NOTE_OFF_60)
+        finally:
+            os.remove(path)
+
+
+class TestMidiParser(TestCase):
+    def test_splits_a_stream_into_messages(self):
+        parser = MidiParser()
+        self.assertEqual(parser.feed(NOTE_ON_60 + NOTE_OFF_60), [NOTE_ON_60, NOTE_OFF_60])
+
+    def test_messages_may_span_reads(self):
+        parser = MidiParser()
+        self.assertEqual(parser.feed(NOTE_ON_60[:2]), [])
+        self.assertEqual(parser.feed(NOTE_ON_60[2:]), [NOTE_ON_60])
+
+    def test_follows_running_status(self):
+        parser = MidiParser()
+        self.assertEqual(parser.feed(NOTE_ON_60 + NOTE_ON_62[1:]), [NOTE_ON_60, NOTE_ON_62])
+
+    def test_real_time_bytes_are_picked_out_of_other_messages(self):
+        parser = MidiParser()
+        data = NOTE_ON_60[:2] + b'\xf8' + NOTE_ON_60[2:]
+        self.assertEqual(parser.feed(data), [b'\xf8', NOTE_ON_60])
+
+    def test_skips_system_exclusive(self):
+        parser = MidiParser()
+        self.assertEqual(parser.feed(b'\xf0\x7e\x01\x02\xf7' + NOTE_ON_60), [NOTE_ON_60])
+
+    def test_system_common_messages_have_no_running_status(self):
+        parser = MidiParser()
+        self.assertEqual(parser.feed(b'\xf2\x10\x00\x10\x00\xfb'), [b'\xf2\x10\x00', b'\xfb'])
@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from midi_engine import RecordingBackend
+from midi_queue import MessageRing, MidiWriter, QueuedBackend
+
+
+class TestMessageRing(TestCase):
+    def test_push_and_pop_in_order(self):
+        ring = MessageRing(4)
+        ring.push(1.0, b'a')
+        ring.push(2.0, b'b')
+        self.assertEqual(len(ring), 2)
+        self.assertEqual(ring.peek_timestamp(), 1.0)
+        self.assertEqual(ring.pop(), (1.0, b'a'))
+        self.assertEqual(ring.pop(), (2.0, b'b'))
+        self.assertIsNone(ring.pop())
+
+    def test_drop_newest_refuses_messages_when_full(self):
+        ring = MessageRing(2, 'drop_newest')
+        self.assertTrue(ring.push(1.0, b'a'))
+        self.assertTrue(ring.push(2.0, b'b'))
+        self.assertFalse(ring.push(3.0, b'c'))
+        self.assertEqual((ring.overflows, ring.dropped), (1, 1))
+        self.assertEqual(ring.pop(), (1.0, b'a'))
+
+    def test_drop_oldest_overwrites_messages_when_full(self):
+        ring = MessageRing(2, 'drop_oldest')
+        for timestamp, data in [(1.0, b'a'), (2.0, b'b'), (3.0, b'c')]:
+            ring.push(timestamp, data)
+        self.assertEqual(ring.overflows, 1)
+        self.assertEqual(ring.pop(), (2.0, b'b'))
+        self.assertEqual(ring.pop(), (3.0, b'c'))
+        self.assertEqual(ring.overwritten, 1)
+
+    def test_block_gives_up_after_the_timeout(self):
+        ring = MessageRing(1, 'block', block_timeout=0.001)
+        ring.push(1.0, b'a')
+        self.assertFalse(ring.push(2.0, b'b'))
+        self.assertEqual(ring.dropped, 1)
+
+    def test_rejects_unknown_policies(self):
+        self.assertRaises(ValueError, MessageRing, 4, 'drop_everything')
+
+
+class TestMidiWriter(TestCase):
+    def test_write_due_only_writes_messages_whose_time_has_come(self):
+        ring = MessageRing(8)
+        recording = RecordingBackend()
+        writer = MidiWriter(ring, recording)
+        ring.push(1.0, b'a')
+        ring.push(1.0, b'b')
+        ring.push(2.0, b'c')
+        self.assertEqual(writer.write_due(1.5), 2.0)
+        self.assertEqual(recording.messages, [b'a', b'b'])
+        self.assertEqual(recording.writes, 1)
+        self.assertEqual(writer.underruns, 2)
+
+    def test_queued_backend_delivers_from_the_writer_thread(self):
+        recording = RecordingBackend()
+        backend = QueuedBackend(recording, latency=0.001)
+        backend.begin_tick(backend.timer())
+        backend.send(b'a')
+        backend.flush()
+        backend.close()
+        self.assertEqual(recording.messages, [b'a'])
+        self.assertEqual(backend.overflows, 0)
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from pattern import PatternPool
+from sequencer import Sequencer
+from timeline import Timeline
+
+
+class TestPatternSharing(TestCase):
+    def setUp(self):
+        self.pool = PatternPool()
+        self.sequencers = [Sequencer(_id, bars=1, midi_channel=0) for _id in range(3)]
+        for sequencer in self.sequencers:
+            sequencer.set_note_for_step_range(0, 2, 36)
+            sequencer.set_note_for_step(8, 38)
+
+    def test_identical_patterns_share_storage_and_compiled_events(self):
+        patterns = [sequencer.share_pattern(self.pool) for sequencer in self.sequencers]
+        self.assertIs(patterns[0], patterns[1])
+        self.assertIs(patterns[0], patterns[2])
+        self.assertEqual(len(self.pool), 1)
+        self.assertIs(self.sequencers[0].steps, self.sequencers[1].steps)
+        self.assertIs(self.sequencers[0].timeline.onsets, self.sequencers[1].timeline.onsets)
+
+    def test_editing_forks_only_the_edited_sequencer(self):
+        pattern = self.sequencers[0].share_pattern(self.pool)
+        self.sequencers[1].set_pattern(pattern)
+        self.sequencers[1].set_note_for_step(4, 40)
+        self.assertIsNone(self.sequencers[1].pattern)
+        self.assertEqual(self.sequencers[1].steps[4].value, 40)
+        self.assertIsNone(pattern.steps[4].value)
+        self.assertIsNone(self.sequencers[0].steps[4].value)
+        self.assertEqual(self.sequencers[1].timeline.events, Timeline(self.sequencers[1].steps, 0).events)
+        self.assertEqual(self.sequencers[0].timeline.events, Timeline(pattern.steps, 0).events)
+
+    def test_switching_patterns_keeps_playing_on_the_sequencers_channel(self):
+        pattern = self.sequencers[0].share_pattern(self.pool)
+        other = Sequencer(3, bars=1, midi_channel=5)
+        other.set_pattern(pattern)
+        self.assertEqual(list(other.advance()), [])
+        other.active_step = other.step_count - 1
+        self.assertEqual(list(other.advance()), [(0, 'NoteOn', 5, 36, 100, 0.0)])
+        other.set_midi_channel(6)
+        self.assertIs(other.pattern, pattern)
+        self.assertEqual(other.timeline.events[0], (0, 'NoteOn', 6, 36, 100, 0.0))
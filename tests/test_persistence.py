@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from persistence import SessionFile, export_json, import_json, load_session, save_session
+from sequencer import Sequencer
+
+
+class TestPersistence(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'session.pyseq')
+        self.sequencers = [
+            Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0),
+            Sequencer(1, bars=2, beats_per_bar=3, steps_per_beat=2),
+        ]
+        self.sequencers[0].set_note_for_step_range(2, 4, 60)
+        self.sequencers[1].set_note_for_step(11, 0)
+        self.sequencers[0].set_velocity(2, 90)
+        self.sequencers[0].set_gate(2, 0.25)
+        self.sequencers[0].set_probability(2, 75)
+        self.sequencers[0].set_cc(0, 74, 10)
+        self.sequencers[0].set_chord_for_step(8, [48, 55, 127])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameSequencers(self, loaded):
+        self.assertEqual(len(loaded), len(self.sequencers))
+        for original, sequencer in zip(self.sequencers, loaded):
+            self.assertEqual(sequencer.id, original.id)
+            self.assertEqual(sequencer.bars, original.bars)
+            self.assertEqual(sequencer.beats_per_bar, original.beats_per_bar)
+            self.assertEqual(sequencer.beat_subdivision, original.beat_subdivision)
+            self.assertEqual(sequencer.midi_channel, original.midi_channel)
+            self.assertEqual(sequencer.steps.notes, original.steps.notes)
+            self.assertEqual(sequencer.steps.holds, original.steps.holds)
+            self.assertEqual(sequencer.steps.velocities, original.steps.velocities)
+            self.assertEqual(sequencer.steps.gates, original.steps.gates)
+            self.assertEqual(sequencer.steps.probabilities, original.steps.probabilities)
+            self.assertEqual(sequencer.steps.cc_lanes, original.steps.cc_lanes)
+            self.assertEqual(sequencer.steps.chords, original.steps.chords)
+            self.assertEqual(sequencer.timeline.events, original.timeline.events)
+
+    def test_binary_round_trip(self):
+        save_session(self.path, self.sequencers)
+        self.assertSameSequencers(load_session(self.path))
+
+    def test_session_file_reads_headers_without_loading_steps(self):
+        save_session(self.path, self.sequencers)
+        with SessionFile(self.path) as session:
+            self.assertEqual(len(session), 2)
+            header = session.header(1)
+            self.assertEqual(header['step_count'], 12)
+            self.assertIsNone(header['midi_channel'])
+            self.assertEqual(session.load(1).steps[11].value, 0)
+            self.assertRaises(IndexError, session.header, 2)
+
+    def test_rejects_files_that_are_not_sessions(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(b'MThd' + b'\x00' * 16)
+        self.assertRaises(ValueError, SessionFile, self.path)
+
+    def test_json_round_trip(self):
+        fp = io.StringIO()
+        export_json(self.sequencers, fp)
+        fp.seek(0)
+        self.assertSameSequencers(import_json(fp))
+
+    def test_pattern_lengths_outside_whole_bars_round_trip(self):
+        sequencer = Sequencer(2, step_count=7, steps_per_beat=3, midi_channel=0)
+        sequencer.set_note_for_step(6, 40)
+        save_session(self.path, [sequencer])
+        loaded, = load_session(self.path)
+        self.assertEqual(loaded.step_count, 7)
+        self.assertEqual(loaded.steps[6].value, 40)
+        fp = io.StringIO()
+        export_json([sequencer], fp)
+        fp.seek(0)
+        self.assertEqual(import_json(fp)[0].step_count, 7)
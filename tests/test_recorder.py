@@ -0,0 +1,107 @@
+import time
+
+from unittest import TestCase
+
+from clock import PolymeterClock
+from midi_engine import encode_message
+from recorder import NoteRecorder, quantize_position
+from sequencer import Sequencer
+from tempo import TempoMap
+
+
+def note_on(value, velocity=100, midi_channel=0):
+    return encode_message('NoteOn', midi_channel, value, velocity)
+
+
+def note_off(value, midi_channel=0):
+    return encode_message('NoteOff', midi_channel, value)
+
+
+class StepClock(object):
+    # Timestamps are step positions
+    def position_at(self, sequencer, timestamp):
+        return timestamp
+
+
+class TestQuantizePosition(TestCase):
+    def test_strength_is_how_close_notes_are_pulled_onto_the_next_step(self):
+        self.assertEqual(quantize_position(3.7), 4)
+        self.assertEqual(quantize_position(3.3), 3)
+        self.assertEqual(quantize_position(3.7, 0), 3)
+        self.assertEqual(quantize_position(3.7, 0.5), 3)
+        self.assertEqual(quantize_position(3.8, 0.5), 4)
+        self.assertEqual(quantize_position(-0.2), 0)
+
+
+class TestNoteRecorder(TestCase):
+    def setUp(self):
+        self.sequencer = Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+        self.changes = []
+        self.sequencer.listeners.append(lambda sequencer, first, last: self.changes.append((first, last)))
+
+    def notes(self):
+        return [
+            (step_id, step.chord, step.is_hold, step.velocity)
+            for step_id, step in self.sequencer.steps.items()
+            if step.value is not None
+        ]
+
+    def test_records_quantized_notes_and_holds(self):
+        recorder = NoteRecorder(StepClock(), self.sequencer)
+        recorder.receive(note_on(60, 90), 1.9)
+        recorder.receive(note_off(60), 4.2)
+        recorder.receive(note_on(62, 70), 17.1)
+        recorder.receive(note_on(62, 0), 17.4)
+        self.assertEqual(self.notes(), [])
+        self.assertEqual(recorder.flush(), 2)
+        self.assertEqual(self.notes(), [
+            (1, [62], False, 70), (2, [60], False, 90), (3, [60], True, 100),
+        ])
+        self.assertEqual(recorder.flush(), 0)
+
+    def test_a_drum_roll_is_one_edit(self):
+        recorder = NoteRecorder(StepClock(), self.sequencer)
+        for step_id in range(16):
+            recorder.receive(note_on(36), step_id + 0.1)
+            recorder.receive(note_off(36), step_id + 0.2)
+        recorder.flush()
+        self.assertEqual(len(self.notes()), 16)
+        self.assertEqual(self.changes, [(0, 15)])
+
+    def test_notes_on_the_same_step_make_a_chord(self):
+        recorder = NoteRecorder(StepClock(), self.sequencer)
+        recorder.receive(note_on(60, 80), 4.1)
+        recorder.receive(note_on(64, 100), 3.8)
+        recorder.receive(note_off(64), 4.9)
+        recorder.receive(note_off(60), 6.0)
+        recorder.flush()
+        self.assertEqual(self.notes(), [(4, [60, 64], False, 100), (5, [60, 64], True, 100)])
+
+    def test_filters_channels_and_releases_held_notes(self):
+        recorder = NoteRecorder(StepClock(), self.sequencer, midi_channel=1)
+        recorder.receive(note_on(60, midi_channel=0), 0.0)
+        recorder.receive(note_on(62, midi_channel=1), 2.0)
+        recorder.receive(encode_message('ControlChange', 1, 1, 64), 2.5)
+        recorder.release(4.0)
+        recorder.flush()
+        self.assertEqual(self.notes(), [(2, [62], False, 100), (3, [62], True, 100)])
+
+    def test_lines_input_up_with_a_playing_clock(self):
+        self.sequencer.locate(0)
+        tempo_map = TempoMap(16, bpm=120)
+        clock = PolymeterClock([self.sequencer], tempo_map)
+        recorder = NoteRecorder(clock, self.sequencer)
+        recorder.receive(note_on(60), 0.0)
+        self.assertEqual(recorder.held, {})
+        clock.start()
+        try:
+            while clock.origin is None:
+                time.sleep(0.001)
+            origin = clock.origin
+            recorder.receive(note_on(60), origin + tempo_map.time_of(21) - 0.01)
+            recorder.receive(note_off(60), origin + tempo_map.time_of(23))
+        finally:
+            clock.stop()
+        recorder.flush()
+        # The second time through the pattern
+        self.assertEqual(self.notes(), [(5, [60], False, 100), (6, [60], True, 100)])
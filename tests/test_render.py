@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from render import OfflineRenderer
+from sequencer import Sequencer
+from tempo import TempoMap
+
+
+class TestOfflineRenderer(TestCase):
+    def test_events_are_stamped_with_their_playback_time(self):
+        sequencer = Sequencer(7, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=1)
+        sequencer.set_note_for_step_range(0, 1, 60)
+        renderer = OfflineRenderer([sequencer], bpm=120)
+        events = list(renderer.events(bars=2))
+        self.assertEqual(events, [
+            (0.0, 7, 'NoteOn', 1, 60, 100),
+            (0.25, 7, 'NoteOff', 1, 60, 0),
+            (2.0, 7, 'NoteOn', 1, 60, 100),
+            (2.25, 7, 'NoteOff', 1, 60, 0),
+        ])
+
+    def test_run_reports_throughput(self):
+        sequencers = [Sequencer(_id, bars=1, midi_channel=0) for _id in range(4)]
+        for sequencer in sequencers:
+            sequencer.set_note_for_step(0, 40)
+        received = []
+        stats = OfflineRenderer(sequencers).run(8, lambda *event: received.append(event))
+        self.assertEqual(stats.bars, 8)
+        self.assertEqual(stats.steps, 128)
+        self.assertEqual(stats.events, len(received))
+        self.assertAlmostEqual(stats.duration, 16.0)
+        self.assertGreater(stats.realtime_factor, 1)
+
+    def test_events_follow_the_tempo_map(self):
+        sequencer = Sequencer(0, bars=2, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+        sequencer.set_note_for_step(0, 60)
+        sequencer.set_note_for_step(16, 62)
+        tempo_map = TempoMap(sequencer.step_count, bpm=120)
+        tempo_map.set_tempo(1, 60)
+        renderer = OfflineRenderer([sequencer], tempo_map=tempo_map)
+        note_ons = [event[0] for event in renderer.events(bars=4) if event[2] == 'NoteOn']
+        self.assertEqual(note_ons, [0.0, 2.0, 6.0, 8.0])
+        self.assertAlmostEqual(renderer.stats.duration, 12.0)
+
+    def test_sequencers_play_at_their_own_step_rates(self):
+        sixteenths = Sequencer(0, step_count=4, steps_per_beat=4, midi_channel=0)
+        triplets = Sequencer(1, step_count=3, steps_per_beat=3, midi_channel=1)
+        sixteenths.set_note_for_step(2, 60)
+        triplets.set_note_for_step(1, 62)
+        renderer = OfflineRenderer([sixteenths, triplets], bpm=60, steps_per_bar=4)
+        note_ons = [(event[0], event[1]) for event in renderer.events(bars=2) if event[2] == 'NoteOn']
+        self.assertEqual([(round(timestamp, 6), _id) for timestamp, _id in note_ons], [
+            (0.333333, 1), (0.5, 0), (1.333333, 1), (1.5, 0)
+        ])
@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from scheduler import StepScheduler
+from sequencer import Sequencer
+
+
+class TestStepScheduler(TestCase):
+    def build_sequencer(self, _id, step_count, steps_per_beat=4):
+        sequencer = Sequencer(_id, step_count=step_count, steps_per_beat=steps_per_beat, midi_channel=0)
+        sequencer.active_step = step_count - 1
+        return sequencer
+
+    def run_scheduler(self, scheduler, last_beat):
+        played = []
+        while True:
+            beat = scheduler.peek()
+            if beat is None or beat >= last_beat:
+                return played
+            beat, indexes = scheduler.pop()
+            for index in indexes:
+                sequencer = scheduler.sequencers[index]
+                events = sequencer.advance()
+                played.append((beat, sequencer.id, sequencer.active_step, [event[1] for event in events]))
+                scheduler.schedule(index)
+
+    def test_steps_of_different_rates_and_lengths_merge_in_beat_order(self):
+        triplets = self.build_sequencer(0, 3, steps_per_beat=3)
+        sixteenths = self.build_sequencer(1, 5, steps_per_beat=4)
+        triplets.set_note_for_step(0, 60)
+        sixteenths.set_note_for_step(4, 62)
+        scheduler = StepScheduler([triplets, sixteenths])
+        scheduler.start(first_position=0)
+        self.assertEqual(self.run_scheduler(scheduler, 2), [
+            (0.0, 0, 0, ['NoteOn']),
+            (0.0, 1, 0, []),
+            (1 / 3.0, 0, 1, ['NoteOff']),
+            (1.0, 0, 0, ['NoteOn']),
+            (1.0, 1, 4, ['NoteOn']),
+            (1.25, 1, 0, ['NoteOff']),
+            (4 / 3.0, 0, 1, ['NoteOff']),
+        ])
+
+    def test_idle_sequencers_are_never_queued(self):
+        busy = self.build_sequencer(0, 16)
+        busy.set_note_for_step_range(2, 5, 48)
+        idle = [self.build_sequencer(_id, 16) for _id in range(1, 50)]
+        scheduler = StepScheduler([busy] + idle)
+        scheduler.start(first_position=0)
+        self.assertEqual(len(scheduler.heap), 1)
+        played = self.run_scheduler(scheduler, 8)
+        self.assertEqual([(beat, step_id) for beat, _id, step_id, _ in played], [
+            (0.5, 2), (1.5, 6), (4.5, 2), (5.5, 6)
+        ])
+
+    def test_followed_sequencers_are_queued_every_step(self):
+        sequencer = self.build_sequencer(0, 4)
+        scheduler = StepScheduler([sequencer], follow=[sequencer])
+        scheduler.start(first_position=0)
+        self.assertEqual([step_id for _, _, step_id, _ in self.run_scheduler(scheduler, 2)], [0, 1, 2, 3] * 2)
+
+    def test_reschedule_queues_an_edited_sequencer_from_the_given_beat(self):
+        sequencer = self.build_sequencer(0, 16)
+        scheduler = StepScheduler([sequencer])
+        scheduler.start(first_position=0)
+        self.assertIsNone(scheduler.peek())
+        sequencer.set_note_for_step(1, 60)
+        sequencer.set_note_for_step(9, 60)
+        scheduler.reschedule(0, 1.0)
+        self.assertEqual(scheduler.peek(), 2.25)
+        self.assertEqual(self.run_scheduler(scheduler, 3), [(2.25, 0, 9, ['NoteOn']), (2.5, 0, 10, ['NoteOff'])])
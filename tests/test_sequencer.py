@@ -1,8 +1,11 @@
 import mock
+import random
 
 from unittest import TestCase
 
-from sequencer import Sequencer, Note
+from sequencer import Note, Sequencer, StepStore
+from steps import mask_notes, note_mask
+from timeline import Timeline
 
 
 class TestSequencer(TestCase):
@@ -112,3 +115,320 @@ class TestSequencer(TestCase):
         # Test next step after non-hold step is blank
         self.assertIsNone(sequencer.steps[3].value)
         self.assertFalse(sequencer.steps[3].is_hold)
+
+
+class TestStepStore(TestCase):
+    def test_views_read_and_write_through_to_the_arrays(self):
+        steps = StepStore(4)
+        self.assertIsNone(steps[2].value)
+        self.assertFalse(steps[2].is_hold)
+        steps[2].value = 0
+        steps[2].is_hold = True
+        self.assertEqual(steps.notes[2], 0)
+        self.assertEqual(steps.holds[2], 1)
+        self.assertEqual(steps[2].value, 0)
+        self.assertTrue(steps[2].is_hold)
+
+    def test_resize_keeps_existing_steps(self):
+        steps = StepStore(4)
+        steps.set(1, 60)
+        steps.resize(8)
+        self.assertEqual(len(steps), 8)
+        self.assertEqual(steps[1].value, 60)
+        self.assertIsNone(steps[7].value)
+        steps.resize(2)
+        self.assertEqual(steps.keys(), [0, 1])
+        self.assertRaises(KeyError, steps.__getitem__, 2)
+
+    @mock.patch('midi_engine.MidiEngine.send_message')
+    def test_tick_plays_notes_from_the_arrays(self, mock_send_message):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+        sequencer.set_note_for_step_range(1, 2, 0)
+        sequencer.tick(None)
+        sequencer.tick(None)
+        sequencer.tick(None)
+        self.assertEqual(
+            [call[0] for call in mock_send_message.call_args_list],
+            [('NoteOn', 0, 0, 100), ('NoteOff', 0, 0, 0)]
+        )
+
+    def test_clear_note_for_step_clears_a_hold_chain_ending_on_the_last_step(self):
+        sequencer = Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4)
+        sequencer.set_note_for_step_range(13, 15, 40)
+        sequencer.clear_note_for_step(13)
+        self.assertEqual([step.value for step in sequencer.steps.values()], [None] * 16)
+
+
+class TestParameterLanes(TestCase):
+    def build_sequencer(self, **kwargs):
+        return Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0, **kwargs)
+
+    def test_lanes_resize_copy_and_digest_with_the_steps(self):
+        steps = StepStore(4)
+        steps.set_velocity(1, 40)
+        steps.set_cc(2, 74, 127)
+        steps.resize(8)
+        self.assertEqual(len(steps.velocities), 8)
+        self.assertEqual(len(steps.cc_lanes[74]), 8)
+        self.assertEqual(steps[1].velocity, 40)
+        copy = steps.copy()
+        self.assertEqual(copy.digest(), steps.digest())
+        copy.set_velocity(1, 41)
+        self.assertEqual(steps.velocities[1], 40)
+        self.assertNotEqual(copy.digest(), steps.digest())
+
+    def test_lane_values_are_validated(self):
+        steps = StepStore(4)
+        self.assertRaises(ValueError, steps.set_velocity, 0, 128)
+        self.assertRaises(ValueError, steps.set_gate, 0, 0)
+        self.assertRaises(ValueError, steps.set_probability, 0, 101)
+        self.assertRaises(ValueError, steps.set_cc, 0, 128, 1)
+
+    def test_velocity_and_cc_reach_the_midi_output(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step(1, 60)
+        sequencer.set_velocity(1, 33)
+        sequencer.set_cc(1, 7, 90)
+        self.assertEqual(list(sequencer.advance()), [
+            (1, 'ControlChange', 0, 7, 90, 0.0),
+            (1, 'NoteOn', 0, 60, 33, 0.0),
+        ])
+
+    def test_gate_ends_the_note_inside_its_last_step(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(1, 2, 60)
+        sequencer.set_gate(1, 0.5)
+        self.assertEqual([event for event in sequencer.timeline.events if event[1] == 'NoteOff'], [
+            (2, 'NoteOff', 0, 60, 0, 0.5),
+        ])
+        sequencer.set_gate(1, 1.0)
+        self.assertEqual([event for event in sequencer.timeline.events if event[1] == 'NoteOff'], [
+            (3, 'NoteOff', 0, 60, 0, 0.0),
+        ])
+
+    def test_probability_drops_the_note_and_its_note_off(self):
+        sequencer = self.build_sequencer(seed=1)
+        sequencer.set_note_for_step(1, 60)
+        sequencer.set_probability(1, 0)
+        played = [event for _ in range(32) for event in sequencer.advance()]
+        self.assertEqual(played, [])
+        self.assertEqual(sequencer.sounding, 0)
+
+    def test_probability_is_rolled_once_per_step(self):
+        sequencer = self.build_sequencer(seed=3)
+        sequencer.set_note_for_step(0, 60)
+        sequencer.set_probability(0, 50)
+        note_ons = 0
+        for _ in range(sequencer.step_count * 200):
+            note_ons += sum(1 for event in sequencer.advance() if event[1] == 'NoteOn')
+        self.assertTrue(60 < note_ons < 140)
+
+    @mock.patch('midi_engine.MidiEngine.send_message')
+    def test_process_step_sends_the_step_velocity(self, mock_send_message):
+        sequencer = self.build_sequencer()
+        sequencer.process_step(Note(60, velocity=20))
+        self.assertEqual(mock_send_message.call_args, mock.call('NoteOn', 0, 60, velocity=20))
+
+
+class TestChords(TestCase):
+    def build_sequencer(self):
+        return Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+
+    def test_masks_round_trip_through_the_store(self):
+        self.assertEqual(mask_notes(note_mask([64, 60, 67])), [60, 64, 67])
+        steps = StepStore(4)
+        steps.set_chord(1, [67, 60, 64])
+        self.assertEqual(steps[1].value, 60)
+        self.assertEqual(steps[1].chord, [60, 64, 67])
+        steps.set_chord(2, [62])
+        self.assertEqual(steps.chords, {1: note_mask([60, 64, 67])})
+        copy = steps.copy()
+        self.assertEqual(copy.digest(), steps.digest())
+        copy.set_chord(1, [60, 63, 67])
+        self.assertNotEqual(copy.digest(), steps.digest())
+        steps[1].value = 48
+        self.assertEqual(steps.chords, {})
+        self.assertRaises(ValueError, steps.set_chord, 0, [128])
+
+    def test_resize_drops_chords_past_the_end(self):
+        steps = StepStore(8)
+        steps.set_chord(6, [60, 64])
+        steps.resize(4)
+        self.assertEqual(steps.chords, {})
+
+    def test_chord_steps_start_and_stop_every_note(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_chord_for_step_range(1, 2, [60, 64])
+        sequencer.set_chord_for_step(3, [64, 67])
+        self.assertEqual([list(sequencer.advance()) for _ in range(4)], [
+            [(1, 'NoteOn', 0, 60, 100, 0.0), (1, 'NoteOn', 0, 64, 100, 0.0)],
+            [],
+            [(3, 'NoteOff', 0, 60, 0, 0.0), (3, 'NoteOff', 0, 64, 0, 0.0),
+             (3, 'NoteOn', 0, 64, 100, 0.0), (3, 'NoteOn', 0, 67, 100, 0.0)],
+            [(4, 'NoteOff', 0, 64, 0, 0.0), (4, 'NoteOff', 0, 67, 0, 0.0)],
+        ])
+
+    def test_clearing_a_held_note_mid_playback_still_stops_it(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(1, 6, 60)
+        sequencer.advance()
+        sequencer.advance()
+        sequencer.clear_note_for_step(1)
+        self.assertEqual(list(sequencer.advance()), [(3, 'NoteOff', 0, 60, 0, 0.0)])
+        self.assertEqual(sequencer.sounding, 0)
+
+    @mock.patch('midi_engine.MidiEngine.send_message')
+    def test_process_step_plays_chords(self, mock_send_message):
+        sequencer = self.build_sequencer()
+        sequencer.process_step(Note(chord=[64, 60]))
+        self.assertEqual(mock_send_message.call_args_list, [
+            mock.call('NoteOn', 0, 60, velocity=100),
+            mock.call('NoteOn', 0, 64, velocity=100),
+        ])
+
+
+class TestPolymeter(TestCase):
+    def test_step_count_allows_any_pattern_length(self):
+        sequencer = Sequencer(0, step_count=13, steps_per_beat=3, midi_channel=0)
+        self.assertEqual(sequencer.step_count, 13)
+        self.assertEqual(len(sequencer.steps), 13)
+        sequencer.set_note_for_step(12, 60)
+        self.assertEqual([list(sequencer.advance()) for _ in range(13)][-1], [(0, 'NoteOff', 0, 60, 0, 0.0)])
+        self.assertRaises(ValueError, Sequencer, 0, step_count=0)
+
+    def test_edits_notify_listeners(self):
+        sequencer = Sequencer(0, bars=1, midi_channel=0)
+        changes = []
+        sequencer.listeners.append(lambda changed, first, last: changes.append((changed, first, last)))
+        sequencer.set_note_for_step_range(2, 4, 60)
+        sequencer.clear_note_for_step(2)
+        sequencer.set_probability(6, 50)
+        self.assertEqual(changes, [(sequencer, 2, 4), (sequencer, 2, 4), (sequencer, 6, 6)])
+
+
+class TestBulkEdits(TestCase):
+    def build_sequencer(self, **kwargs):
+        return Sequencer(0, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=0, **kwargs)
+
+    def notes(self, sequencer):
+        return [
+            (step_id, step.chord, step.is_hold)
+            for step_id, step in sequencer.steps.items()
+            if step.value is not None
+        ]
+
+    def test_transpose_moves_notes_and_chords(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(0, 1, 60)
+        sequencer.set_chord_for_step(4, [60, 67])
+        sequencer.transpose(-12)
+        self.assertEqual(self.notes(sequencer), [(0, [48], False), (1, [48], True), (4, [48, 55], False)])
+        self.assertRaises(ValueError, sequencer.transpose, 80)
+        self.assertEqual(sequencer.steps[4].chord, [48, 55])
+
+    def test_rotate_and_shift_move_every_lane(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(14, 15, 60)
+        sequencer.set_cc(14, 74, 10)
+        sequencer.rotate(3)
+        self.assertEqual(self.notes(sequencer), [(1, [60], False), (2, [60], True)])
+        self.assertEqual(sequencer.steps.cc_lanes[74][1], 10)
+        sequencer.shift(-2)
+        self.assertEqual(self.notes(sequencer), [(0, [60], False)])
+        sequencer.shift(-1)
+        self.assertEqual(self.notes(sequencer), [])
+
+    def test_reverse_starts_held_notes_on_their_old_last_step(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(0, 2, 60)
+        sequencer.set_velocity(0, 50)
+        sequencer.set_note_for_step(5, 62)
+        sequencer.reverse(0, 7)
+        self.assertEqual(self.notes(sequencer), [
+            (2, [62], False), (5, [60], False), (6, [60], True), (7, [60], True)
+        ])
+        self.assertEqual(sequencer.steps[5].velocity, 50)
+
+    def test_range_edits_split_notes_held_over_their_ends(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(2, 9, 60)
+        sequencer.transpose(1, 4, 5)
+        self.assertEqual(self.notes(sequencer)[1:5], [
+            (3, [60], True), (4, [61], False), (5, [61], True), (6, [60], False)
+        ])
+
+    def test_quantize_moves_notes_to_the_grid(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step_range(3, 4, 60)
+        sequencer.set_note_for_step(9, 62)
+        sequencer.set_note_for_step(14, 64)
+        sequencer.quantize(4)
+        self.assertEqual(self.notes(sequencer), [(0, [64], False), (4, [60], False), (5, [60], True), (8, [62], False)])
+
+    def test_fill_every_and_euclid_generate_rhythms(self):
+        sequencer = self.build_sequencer()
+        sequencer.fill_every(4, 36)
+        self.assertEqual([step_id for step_id, _, _ in self.notes(sequencer)], [0, 4, 8, 12])
+        sequencer.euclid(3, 38, 8, 15)
+        self.assertEqual([step_id for step_id, _, _ in self.notes(sequencer)], [0, 4, 8, 11, 14])
+        self.assertRaises(ValueError, sequencer.euclid, 17, 36)
+
+    def test_record_notes_writes_a_batch_as_one_edit(self):
+        sequencer = self.build_sequencer()
+        sequencer.set_note_for_step(3, 50)
+        changes = []
+        sequencer.listeners.append(lambda sequencer, first, last: changes.append((first, last)))
+        sequencer.record_notes([(1, 4, note_mask([60]), 90), (6, 6, note_mask([60, 64]), 80), (14, 17, 1 << 62, 70)])
+        self.assertEqual(self.notes(sequencer), [
+            (1, [60], False), (2, [60], True), (3, [50], False), (6, [60, 64], False),
+            (14, [62], False), (15, [62], True),
+        ])
+        self.assertEqual(sequencer.steps[1].velocity, 90)
+        self.assertEqual(changes, [(1, 15)])
+
+    def test_copy_and_paste_across_sequencers(self):
+        source = self.build_sequencer()
+        source.set_chord_for_step_range(1, 2, [60, 64])
+        source.set_cc(2, 1, 99)
+        target = Sequencer(1, bars=2, midi_channel=3)
+        changes = []
+        target.listeners.append(lambda sequencer, first, last: changes.append((first, last)))
+        target.paste_steps(16, source.copy_steps(0, 3))
+        self.assertEqual(self.notes(target), [(17, [60, 64], False), (18, [60, 64], True)])
+        self.assertEqual(target.steps.cc_lanes[1][18], 99)
+        self.assertEqual(changes, [(16, 19)])
+
+    def test_random_bulk_edits_leave_a_consistent_timeline(self):
+        rng = random.Random(99)
+        sequencer = Sequencer(0, bars=2, midi_channel=1)
+        sequencer.timeline.event_steps
+        for _ in range(300):
+            first_step_id = rng.randrange(sequencer.step_count)
+            last_step_id = rng.choice([None, rng.randrange(first_step_id, sequencer.step_count)])
+            operation = rng.choice(['range', 'transpose', 'rotate', 'shift', 'reverse', 'quantize', 'fill', 'euclid'])
+            if operation == 'range':
+                sequencer.clear_note_for_step(first_step_id)
+                values = [rng.randrange(40, 80)]
+                sequencer.set_chord_for_step_range(first_step_id, first_step_id + rng.randrange(6), values)
+            elif operation == 'transpose':
+                try:
+                    sequencer.transpose(rng.randrange(-5, 6), first_step_id, last_step_id)
+                except ValueError:
+                    pass
+            elif operation in ('rotate', 'shift'):
+                getattr(sequencer, operation)(rng.randrange(-20, 20), first_step_id, last_step_id)
+            elif operation == 'reverse':
+                sequencer.reverse(first_step_id, last_step_id)
+            elif operation == 'quantize':
+                sequencer.quantize(rng.choice([2, 3, 4]), first_step_id, last_step_id)
+            elif operation == 'fill':
+                sequencer.fill_every(rng.randrange(1, 5), rng.choice([None, 50]), first_step_id, last_step_id)
+            else:
+                length = (last_step_id if last_step_id is not None else sequencer.step_count - 1) - first_step_id + 1
+                sequencer.euclid(rng.randrange(length + 1), 36, first_step_id, last_step_id)
+            steps = sequencer.steps
+            for step_id in steps:
+                if steps.holds[step_id]:
+                    self.assertEqual(steps.note_mask(step_id), steps.note_mask(step_id - 1))
+            self.assertEqual(sequencer.timeline.events, Timeline(steps, 1).events)
+            self.assertEqual(sequencer.timeline.event_steps, Timeline(steps, 1).event_steps)
@@ -0,0 +1,82 @@
+import mock
+import time
+
+from unittest import TestCase
+
+from clock import PlaybackClock
+from midi_engine import MidiEngine, RecordingBackend, encode_message
+from sequencer import Sequencer
+from sharding import ShardedEngine
+
+
+class TestShardedEngine(TestCase):
+    def build_sequencers(self, count):
+        sequencers = []
+        for _id in range(count):
+            sequencer = Sequencer(_id, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=_id % 16)
+            sequencer.set_note_for_step(1, 40 + _id)
+            sequencers.append(sequencer)
+        return sequencers
+
+    def test_workers_produce_the_same_events_as_serial_ticks(self):
+        serial = [event for sequencer in self.build_sequencers(6) for event in sequencer.advance()]
+        engine = ShardedEngine(self.build_sequencers(6), workers=2)
+        engine.start()
+        try:
+            events = engine.collect()
+        finally:
+            engine.stop()
+        self.assertEqual(
+            [(track, status, note, velocity) for track, status, note, velocity, offset in events],
+            [(track, 0x90 | track, 40 + track, 100) for track in range(6)]
+        )
+        self.assertEqual(len(serial), len(events))
+        self.assertEqual(engine.overflows, 0)
+
+    def test_edits_reach_the_worker_copies(self):
+        recording = RecordingBackend()
+        engine = ShardedEngine(self.build_sequencers(2), workers=2)
+        engine.start()
+        try:
+            engine.send_edit(1, 'set_note_for_step', 1, 99)
+            with mock.patch('sharding.midi_engine', MidiEngine(recording)):
+                engine.tick(None)
+        finally:
+            engine.stop()
+        self.assertEqual(recording.messages, [encode_message('NoteOn', 0, 40), encode_message('NoteOn', 1, 99)])
+        self.assertEqual(engine.sequencers[1].steps[1].value, 99)
+        engine.sync_active_steps()
+        self.assertEqual(engine.sequencers[0].active_step, 1)
+
+    def test_edits_never_block_between_ticks(self):
+        recording = RecordingBackend()
+        engine = ShardedEngine(self.build_sequencers(2), workers=2)
+        engine.start()
+        try:
+            # Far more than a pipe holds, from the thread that ticks
+            for value in range(5000):
+                engine.send_edit(1, 'set_note_for_step', 1, value % 128)
+            engine.send_edit(1, 'set_note_for_step', 1, 99)
+            with mock.patch('sharding.midi_engine', MidiEngine(recording)):
+                engine.tick(None)
+        finally:
+            engine.stop()
+        self.assertEqual(recording.messages[-1], encode_message('NoteOn', 1, 99))
+
+    def test_plays_on_a_playback_clock(self):
+        recording = RecordingBackend()
+        engine = ShardedEngine(self.build_sequencers(2), workers=2)
+        engine.start()
+        clock = PlaybackClock([engine], 0.001)
+        try:
+            with mock.patch('sharding.midi_engine', MidiEngine(recording)):
+                clock.start()
+                deadline = time.time() + 5
+                while engine.tick_count < 4 and time.time() < deadline:
+                    time.sleep(0.001)
+                clock.stop()
+        finally:
+            clock.stop()
+            engine.stop()
+        self.assertGreaterEqual(engine.tick_count, 4)
+        self.assertIn(encode_message('NoteOn', 1, 41), recording.messages)
@@ -0,0 +1,94 @@
+import io
+
+from unittest import TestCase
+
+from sequencer import Sequencer
+from smf import SmfReader, import_smf, write_smf
+
+
+class TestSmf(TestCase):
+    def build_sequencer(self, _id, midi_channel=0):
+        return Sequencer(_id, bars=1, beats_per_bar=4, steps_per_beat=4, midi_channel=midi_channel)
+
+    def test_export_writes_a_type_1_file_with_a_track_per_sequencer(self):
+        sequencer = self.build_sequencer(0, midi_channel=2)
+        sequencer.set_note_for_step_range(0, 1, 60)
+        sequencer.set_note_for_step(15, 64)
+        fp = io.BytesIO()
+        write_smf(fp, [sequencer, self.build_sequencer(1)])
+        fp.seek(0)
+
+        reader = SmfReader(fp)
+        self.assertEqual((reader.format, reader.track_count, reader.division), (1, 3, 4))
+        notes = [
+            (track, tick, status, data1)
+            for track, tick, status, data1, data2 in reader.events()
+            if status != 0xFF
+        ]
+        self.assertEqual(notes, [
+            (1, 0, 0x92, 60),
+            (1, 2, 0x82, 60),
+            (1, 15, 0x92, 64),
+            (1, 16, 0x82, 64),
+        ])
+
+    def test_reader_handles_running_status(self):
+        track = b'\x00\x90\x3c\x64\x04\x3c\x00\x00\xff\x2f\x00'
+        fp = io.BytesIO(
+            b'MThd\x00\x00\x00\x06\x00\x00\x00\x01\x00\x04' +
+            b'MTrk' + bytes((0, 0, 0, len(track))) + track
+        )
+        events = list(SmfReader(fp).events())
+        self.assertEqual(events[:2], [(0, 0, 0x90, 60, 100), (0, 4, 0x90, 60, 0)])
+
+    def test_import_round_trips_notes_and_holds(self):
+        original = self.build_sequencer(0, midi_channel=5)
+        original.set_note_for_step_range(2, 5, 48)
+        original.set_note_for_step(9, 50)
+        fp = io.BytesIO()
+        write_smf(fp, [original])
+        fp.seek(0)
+
+        imported = self.build_sequencer(0, midi_channel=None)
+        import_smf(fp, [imported])
+        self.assertEqual(imported.midi_channel, 5)
+        self.assertEqual(imported.steps.notes, original.steps.notes)
+        self.assertEqual(imported.steps.holds, original.steps.holds)
+
+    def test_import_round_trips_velocity_gate_and_cc(self):
+        original = self.build_sequencer(0, midi_channel=1)
+        original.set_note_for_step_range(2, 3, 48)
+        original.set_velocity(2, 70)
+        original.set_gate(2, 0.5)
+        original.set_cc(6, 74, 99)
+        fp = io.BytesIO()
+        write_smf(fp, [original])
+        fp.seek(0)
+        self.assertEqual(SmfReader(fp).division, 4 * 24)
+        fp.seek(0)
+
+        imported = self.build_sequencer(0)
+        import_smf(fp, [imported])
+        self.assertEqual(imported.steps.notes, original.steps.notes)
+        self.assertEqual(imported.steps.holds, original.steps.holds)
+        self.assertEqual(imported.steps[2].velocity, 70)
+        self.assertEqual(imported.steps[2].gate, 0.5)
+        self.assertEqual(imported.steps.cc_lanes[74][6], 99)
+
+    def test_import_round_trips_chords(self):
+        original = self.build_sequencer(0, midi_channel=1)
+        original.set_chord_for_step_range(0, 2, [60, 64, 67])
+        original.set_chord_for_step(3, [48, 60])
+        original.set_note_for_step(5, 50)
+        fp = io.BytesIO()
+        write_smf(fp, [original])
+        fp.seek(0)
+
+        imported = self.build_sequencer(0)
+        import_smf(fp, [imported])
+        self.assertEqual(imported.steps.notes, original.steps.notes)
+        self.assertEqual(imported.steps.holds, original.steps.holds)
+        self.assertEqual(imported.steps.chords, original.steps.chords)
+
+    def test_rejects_files_that_are_not_midi(self):
+        self.assertRaises(ValueError, SmfReader, io.BytesIO(b'PYSQ' + b'\x00' * 20))
@@ -0,0 +1,82 @@
+from unittest import TestCase
+
+from pattern import Pattern
+from sequencer import MAXIMUM_BARS, Sequencer
+from step_grid import ACTIVE_CELL, ACTIVE_NOTE_CELL, NOTE_CELL, ROWS, StepGridWindow
+from steps import StepStore
+
+
+class TestStepGrid(TestCase):
+    def setUp(self):
+        self.sequencer = Sequencer(0, bars=2, beats_per_bar=4, steps_per_beat=4, midi_channel=0)
+        self.window = StepGridWindow(16)
+        self.sequencer.listeners.append(self.window.state.sequencer_changed)
+        self.sequencer.pattern_listeners.append(self.window.state.pattern_replaced)
+
+    def refresh(self, octave=2, bar=0):
+        return self.window.refresh(self.sequencer, octave, bar)
+
+    def lit_cells(self):
+        # (step_id, note) of every cell showing a note
+        return [
+            (self.window.step_at(cell // ROWS), self.window.note_at(cell % ROWS))
+            for cell, state in enumerate(self.window.cells)
+            if state & NOTE_CELL
+        ]
+
+    def test_first_refresh_draws_the_window(self):
+        self.sequencer.set_note_for_step(3, 27)
+        self.assertEqual(sorted(self.refresh()), list(range(ROWS)) + [3 * ROWS + 3])
+        self.assertEqual(self.lit_cells(), [(3, 27)])
+        self.assertEqual(self.window.cells[0], ACTIVE_CELL)
+
+    def test_chords_light_a_cell_per_note(self):
+        self.sequencer.set_chord_for_step(5, [24, 28, 31, 48])
+        self.refresh()
+        self.assertEqual(self.lit_cells(), [(5, 24), (5, 28), (5, 31)])
+
+    def test_playhead_only_redraws_the_old_and_new_active_step(self):
+        self.sequencer.set_note_for_step(1, 24)
+        self.refresh()
+        self.sequencer.tick(None)
+        self.assertEqual(sorted(self.refresh()), list(range(2 * ROWS)))
+        self.assertEqual(self.window.cells[ROWS], ACTIVE_NOTE_CELL)
+        self.assertEqual(self.refresh(), [])
+
+    def test_edits_and_octave_changes_are_redrawn(self):
+        self.refresh()
+        self.sequencer.set_note_for_step(5, 26)
+        self.assertEqual(self.refresh(), [5 * ROWS + 2])
+        self.sequencer.transpose(1)
+        self.assertEqual(sorted(self.refresh()), [5 * ROWS + 2, 5 * ROWS + 3])
+        self.refresh(octave=3)
+        self.assertEqual(self.lit_cells(), [])
+
+    def test_cued_patterns_are_redrawn(self):
+        self.sequencer.set_note_for_step(3, 27)
+        self.refresh()
+        steps = StepStore(self.sequencer.step_count)
+        steps.set(6, 29)
+        self.sequencer.cue_pattern(Pattern(steps))
+        self.refresh()
+        self.assertEqual(self.lit_cells(), [(6, 29)])
+
+    def test_scrolling_rebinds_the_cells_to_the_bar_shown(self):
+        self.sequencer.set_note_for_step(20, 30)
+        self.refresh()
+        self.assertEqual(self.lit_cells(), [])
+        self.refresh(bar=1)
+        self.assertEqual(self.lit_cells(), [(20, 30)])
+        self.assertEqual(self.window.visible_step_ids, range(16, 32))
+        # Past the end of the pattern nothing is lit
+        self.refresh(bar=2)
+        self.assertEqual(self.lit_cells(), [])
+
+    def test_navigation_cost_does_not_depend_on_pattern_length(self):
+        long_sequencer = Sequencer(1, bars=MAXIMUM_BARS, midi_channel=0)
+        for step_id in range(long_sequencer.step_count):
+            long_sequencer.set_note_for_step(step_id, 24 + step_id % 11)
+        window = StepGridWindow(16)
+        for bar in range(MAXIMUM_BARS):
+            self.assertLessEqual(len(window.refresh(long_sequencer, 2, bar)), len(window))
+        self.assertEqual(len(window), 16 * ROWS)
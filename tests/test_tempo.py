@@ -0,0 +1,65 @@
+import random
+
+from unittest import TestCase
+
+from tempo import TempoMap
+
+
+class TestTempoMap(TestCase):
+    def assertTimesEqual(self, times, expected):
+        self.assertEqual(len(times), len(expected))
+        for time, expected_time in zip(times, expected):
+            self.assertAlmostEqual(time, expected_time)
+
+    def test_constant_tempo_gives_an_even_grid(self):
+        tempo_map = TempoMap(16, bpm=120)
+        self.assertTimesEqual(tempo_map.times, [step_id * 0.125 for step_id in range(17)])
+        self.assertAlmostEqual(tempo_map.loop_length, 2.0)
+        self.assertAlmostEqual(tempo_map.time_of(37), 4.625)
+        self.assertAlmostEqual(tempo_map.interval(37), 0.125)
+
+    def test_tempo_changes_and_ramps(self):
+        tempo_map = TempoMap(8, bpm=60, beats_per_bar=1)
+        tempo_map.set_tempo(1, 120)
+        self.assertTimesEqual(tempo_map.times[:6], [0.0, 0.25, 0.5, 0.75, 1.0, 1.125])
+        tempo_map.set_tempo(1, 120, ramp=True)
+        self.assertEqual([tempo_map.bpm_at(step_id) for step_id in range(6)], [60, 75, 90, 105, 120, 120])
+        tempo_map.remove_tempo(1)
+        self.assertAlmostEqual(tempo_map.loop_length, 2.0)
+
+    def test_time_signature_changes_move_later_bars(self):
+        tempo_map = TempoMap(32, bpm=120, beats_per_bar=4)
+        tempo_map.set_tempo(2, 60)
+        self.assertEqual(tempo_map.bar_start(2), 32)
+        self.assertAlmostEqual(tempo_map.loop_length, 4.0)
+        tempo_map.set_meter(1, 3)
+        self.assertEqual(tempo_map.bar_start(2), 28)
+        self.assertAlmostEqual(tempo_map.loop_length, 28 * 0.125 + 4 * 0.25)
+
+    def test_edits_patch_the_same_table_a_full_compile_would_build(self):
+        rng = random.Random(7)
+        tempo_map = TempoMap(64)
+        for _ in range(300):
+            bar = rng.randrange(1, 6)
+            operation = rng.choice(['tempo', 'remove_tempo', 'meter', 'remove_meter'])
+            if operation == 'tempo':
+                tempo_map.set_tempo(bar, rng.choice([60, 90, 140]), rng.random() < 0.5)
+            elif operation == 'meter':
+                tempo_map.set_meter(bar, rng.choice([3, 4, 7]))
+            elif operation == 'remove_tempo' and bar in tempo_map.tempos:
+                tempo_map.remove_tempo(bar)
+            elif operation == 'remove_meter' and bar in tempo_map.meters:
+                tempo_map.remove_meter(bar)
+            compiled = TempoMap(64)
+            compiled.tempos = dict(tempo_map.tempos)
+            compiled.meters = dict(tempo_map.meters)
+            compiled.compile()
+            self.assertTimesEqual(tempo_map.times, compiled.times)
+
+    def test_invalid_changes_are_rejected(self):
+        tempo_map = TempoMap(16)
+        self.assertRaises(ValueError, tempo_map.set_tempo, 1, 0)
+        self.assertRaises(ValueError, tempo_map.set_tempo, 0, 100, ramp=True)
+        self.assertRaises(ValueError, tempo_map.remove_tempo, 0)
+        self.assertRaises(ValueError, tempo_map.set_meter, 1, 0)
+        self.assertRaises(ValueError, TempoMap, 0)
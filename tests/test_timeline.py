@@ -0,0 +1,80 @@
+import random
+
+from unittest import TestCase
+
+from steps import StepStore
+from timeline import NOTE_OFF, NOTE_ON, Timeline
+from sequencer import Sequencer
+
+
+class TestTimeline(TestCase):
+    def test_compile_matches_process_step_semantics(self):
+        steps = StepStore(4)
+        steps.set(0, 60)
+        steps.set(1, 60, is_hold=True)
+        steps.set(2, 62)
+        timeline = Timeline(steps, midi_channel=3)
+        self.assertEqual(timeline.events, [
+            (0, NOTE_ON, 3, 60, 100, 0.0),
+            (2, NOTE_OFF, 3, 60, 0, 0.0),
+            (2, NOTE_ON, 3, 62, 100, 0.0),
+            (3, NOTE_OFF, 3, 62, 0, 0.0),
+        ])
+
+    def test_timeline_without_midi_channel_is_empty(self):
+        steps = StepStore(4)
+        steps.set(0, 60)
+        self.assertEqual(Timeline(steps).events, [])
+
+    def test_play_diffs_against_the_sounding_notes_and_wraps(self):
+        steps = StepStore(4)
+        steps.set(0, 60)
+        steps.set(3, 64)
+        timeline = Timeline(steps, midi_channel=0)
+        sounding = 0
+        played = []
+        for step_id in [0, 1, 2, 3, 0]:
+            events, sounding = timeline.play(step_id, sounding, 0)
+            played.append(list(events))
+        self.assertEqual(played, [
+            [(0, NOTE_ON, 0, 60, 100, 0.0)],
+            [(1, NOTE_OFF, 0, 60, 0, 0.0)],
+            [],
+            [(3, NOTE_ON, 0, 64, 100, 0.0)],
+            [(0, NOTE_OFF, 0, 64, 0, 0.0), (0, NOTE_ON, 0, 60, 100, 0.0)],
+        ])
+
+    def test_edits_patch_the_same_timeline_a_full_compile_would_build(self):
+        rng = random.Random(1234)
+        sequencer = Sequencer(0, bars=2, beats_per_bar=4, steps_per_beat=4, midi_channel=1)
+        sequencer.timeline.event_steps
+        for _ in range(500):
+            step_id = rng.randrange(sequencer.step_count)
+            operation = rng.choice(['set', 'range', 'clear', 'gate', 'velocity', 'cc'])
+            if operation == 'set':
+                sequencer.set_note_for_step(step_id, rng.choice([None, 0, 36, 60]))
+            elif operation == 'gate':
+                sequencer.set_gate(step_id, rng.choice([0.25, 0.5, 1.0]))
+            elif operation == 'velocity':
+                sequencer.set_velocity(step_id, rng.randrange(1, 128))
+            elif operation == 'cc':
+                sequencer.set_cc(step_id, 1, rng.choice([None, 0, 64]))
+            elif operation == 'range':
+                sequencer.set_note_for_step_range(step_id, step_id + rng.randrange(6), rng.randrange(128))
+            else:
+                sequencer.clear_note_for_step(step_id)
+            self.assertEqual(sequencer.timeline.events, Timeline(sequencer.steps, 1).events)
+            self.assertEqual(sequencer.timeline.event_steps, Timeline(sequencer.steps, 1).event_steps)
+
+    def test_steps_until_due_skips_steps_that_send_nothing(self):
+        steps = StepStore(8)
+        steps.set(2, 60)
+        steps.set(3, 60, is_hold=True)
+        timeline = Timeline(steps, midi_channel=0)
+        self.assertEqual(timeline.event_steps, [2, 4])
+        self.assertEqual(timeline.steps_until_due(0, 0), 2)
+        self.assertEqual(timeline.steps_until_due(2, 1 << 60), 2)
+        self.assertEqual(timeline.steps_until_due(4, 0), 6)
+        # A note the steps don't hold any more is stopped on the next step
+        self.assertEqual(timeline.steps_until_due(5, 1 << 62), 1)
+        self.assertIsNone(Timeline(StepStore(8), midi_channel=0).steps_until_due(0, 0))
@@ -0,0 +1,239 @@
+from bisect import bisect_left, bisect_right
+
+from steps import EMPTY_VALUE, FULL_GATE, mask_notes
+
+
+__all__ = ['Timeline', 'NOTE_ON', 'NOTE_OFF', 'CONTROL_CHANGE']
+
+NOTE_ON = 'NoteOn'
+NOTE_OFF = 'NoteOff'
+CONTROL_CHANGE = 'ControlChange'
+NO_EVENTS = ()
+
+
+class Timeline(object):
+    # Per step playback data compiled from a StepStore, indexed by step id:
+    #
+    #   onsets    mask of the notes that start on the step
+    #   sustains  mask of the notes held over into the step from the last
+    #   releases  mask of the notes a gate ends part way through the step,
+    #             release_offsets holds how far through (fractions of a step)
+    #   controls  (controller, value) pairs to send, or None
+    #
+    # Masks are ints with bit n set for MIDI note n. play() diffs them
+    # against whatever the caller has sounding, so nothing compiled depends
+    # on the MIDI channel and one compile can be shared by every sequencer
+    # playing the same pattern.
+    #
+    # Events are (step_id, message, midi_channel, data1, data2, offset)
+    # tuples: data1/data2 are note and velocity, or controller and value.
+    # Within a step CCs come first, then NoteOffs, NoteOns, gated NoteOffs.
+    def __init__(self, steps, midi_channel=None, compiled=None):
+        self.steps = steps
+        self.midi_channel = midi_channel
+        if compiled is None:
+            self.compile()
+        else:
+            # Already compiled for these steps, e.g. shared from a Pattern;
+            # the caller must not patch lists it shares
+            self.onsets, self.sustains, self.releases, self.release_offsets, self.controls = compiled
+            self.step_count = len(steps)
+            self.played = [None] * self.step_count
+            self._event_steps = None
+
+    @property
+    def compiled(self):
+        return (self.onsets, self.sustains, self.releases, self.release_offsets, self.controls)
+
+    def copy(self, steps):
+        return Timeline(steps, self.midi_channel, tuple(list(data) for data in self.compiled))
+
+    def note_gate(self, step_id):
+        # Gates are read from the step the note starts on
+        holds = self.steps.holds
+        while step_id > 0 and holds[step_id]:
+            step_id -= 1
+        return self.steps.gates[step_id]
+
+    def compile_step(self, step_id):
+        # (onset, sustain, release, release offset, controls) for one step
+        steps = self.steps
+        holds = steps.holds
+        mask = steps.note_mask(step_id)
+        is_hold = holds[step_id]
+
+        release = 0
+        release_offset = 0.0
+        if mask and not holds[(step_id + 1) % len(holds)]:
+            # Last step of a note: a gate under one step ends it part way
+            # through this step instead of at the start of the next
+            gate = self.note_gate(step_id) if is_hold else steps.gates[step_id]
+            if gate < FULL_GATE:
+                release = mask
+                release_offset = gate
+
+        controls = None
+        cc_lanes = steps.cc_lanes
+        if cc_lanes:
+            for controller in sorted(cc_lanes):
+                cc_value = cc_lanes[controller][step_id]
+                if cc_value != EMPTY_VALUE:
+                    if controls is None:
+                        controls = []
+                    controls.append((controller, cc_value))
+
+        if is_hold:
+            return 0, mask, release, release_offset, controls
+        return mask, 0, release, release_offset, controls
+
+    def compile(self):
+        step_count = len(self.steps)
+        self.onsets = [0] * step_count
+        self.sustains = [0] * step_count
+        self.releases = [0] * step_count
+        self.release_offsets = [0.0] * step_count
+        self.controls = [None] * step_count
+        self.played = [None] * step_count
+        self.step_count = step_count
+        self._event_steps = None
+        self._recompile_region(0, step_count - 1)
+
+    def set_midi_channel(self, midi_channel):
+        self.midi_channel = midi_channel
+
+    def patch(self, first_step_id, last_step_id):
+        # Whether a step is the last of its note depends on the step after
+        # it, so an edit to first..last also changes the step before first
+        step_count = self.step_count
+        if not step_count:
+            return
+        first_step_id -= 1
+        # A note running on past the edit may now start somewhere else and
+        # so have a different gate, take in the rest of it as well
+        holds = self.steps.holds
+        while last_step_id + 1 < step_count and holds[last_step_id + 1]:
+            last_step_id += 1
+        if first_step_id < 0:
+            self._recompile_region(step_count - 1, step_count - 1)
+            first_step_id = 0
+        self._recompile_region(first_step_id, min(last_step_id, step_count - 1))
+
+    def _recompile_region(self, first_step_id, last_step_id):
+        onsets = self.onsets
+        sustains = self.sustains
+        releases = self.releases
+        release_offsets = self.release_offsets
+        controls = self.controls
+        played = self.played
+        for step_id in range(first_step_id, last_step_id + 1):
+            (onsets[step_id], sustains[step_id], releases[step_id],
+             release_offsets[step_id], controls[step_id]) = self.compile_step(step_id)
+            played[step_id] = None
+        if self._event_steps is not None:
+            # Whether a step sends anything also depends on the step before
+            step_count = self.step_count
+            self._update_event_steps(first_step_id, min(last_step_id + 1, step_count - 1))
+            if last_step_id + 1 >= step_count:
+                self._update_event_steps(0, 0)
+
+    def sends_events(self, step_id):
+        # Whether playing step_id on from the step before it sends anything:
+        # notes start, end or get released, or CCs go out
+        previous_step_id = step_id - 1 if step_id else self.step_count - 1
+        sustain = self.sustains[step_id]
+        return bool(
+            self.onsets[step_id] or self.controls[step_id] or self.releases[step_id] or
+            (self.onsets[previous_step_id] | self.sustains[previous_step_id]) & ~sustain
+        )
+
+    @property
+    def event_steps(self):
+        # Sorted ids of the steps that send anything, only built once a
+        # scheduler asks for them and patched along with the rest after that
+        if self._event_steps is None:
+            self._event_steps = [step_id for step_id in range(self.step_count) if self.sends_events(step_id)]
+        return self._event_steps
+
+    def _update_event_steps(self, first_step_id, last_step_id):
+        event_steps = self._event_steps
+        event_steps[bisect_left(event_steps, first_step_id):bisect_right(event_steps, last_step_id)] = [
+            step_id for step_id in range(first_step_id, last_step_id + 1) if self.sends_events(step_id)
+        ]
+
+    def steps_until_due(self, step_id, sounding):
+        # How many steps after step_id the next one that sends anything is,
+        # given what is sounding, or None if nothing ever will. Steps in
+        # between leave the sounding notes alone, so only the very next step
+        # can stop a note the compiled steps don't know about.
+        step_count = self.step_count
+        next_step_id = step_id + 1 if step_id + 1 < step_count else 0
+        if sounding & ~self.sustains[next_step_id]:
+            return 1
+        event_steps = self.event_steps
+        if not event_steps:
+            return None
+        index = bisect_right(event_steps, step_id)
+        if index < len(event_steps):
+            return event_steps[index] - step_id
+        return event_steps[0] + step_count - step_id
+
+    def play(self, step_id, sounding, midi_channel, played=True):
+        # Returns (events, sounding): what to send on step_id given the
+        # notes sounding before it, and what is left sounding afterwards.
+        # Anything sounding that the step doesn't sustain is stopped, so a
+        # hold chain cleared mid-note still gets its NoteOff. played=False
+        # skips the step's onsets, e.g. when it lost its probability roll.
+        #
+        # Once looping a step sees the same notes sounding every pass, so
+        # the last result for each step is kept and handed back as is.
+        last = self.played[step_id]
+        if last is not None and last[0] == sounding and last[1] == midi_channel and last[2] == played:
+            return last[3], last[4]
+        result = self._play(step_id, sounding, midi_channel, played)
+        self.played[step_id] = (sounding, midi_channel, played) + result
+        return result
+
+    def _play(self, step_id, sounding, midi_channel, played):
+        onset = self.onsets[step_id] if played else 0
+        stopped = sounding & ~self.sustains[step_id]
+        controls = self.controls[step_id]
+        released = ((sounding ^ stopped) | onset) & self.releases[step_id]
+        if not (stopped or onset or controls or released):
+            return NO_EVENTS, sounding
+        if midi_channel is None:
+            return NO_EVENTS, 0
+
+        events = []
+        if controls:
+            for controller, cc_value in controls:
+                events.append((step_id, CONTROL_CHANGE, midi_channel, controller, cc_value, 0.0))
+        if stopped:
+            for note in mask_notes(stopped):
+                events.append((step_id, NOTE_OFF, midi_channel, note, 0, 0.0))
+            sounding ^= stopped
+        if onset:
+            velocity = self.steps.velocities[step_id]
+            for note in mask_notes(onset):
+                events.append((step_id, NOTE_ON, midi_channel, note, velocity, 0.0))
+            sounding |= onset
+        if released:
+            offset = self.release_offsets[step_id]
+            for note in mask_notes(released):
+                events.append((step_id, NOTE_OFF, midi_channel, note, 0, offset))
+            sounding &= ~released
+        return tuple(events), sounding
+
+    @property
+    def events(self):
+        # Every event of one pass through the loop as it plays once looping,
+        # i.e. starting with whatever the end of the loop leaves sounding
+        if self.midi_channel is None:
+            return []
+        sounding = 0
+        for step_id in range(self.step_count):
+            sounding = self.play(step_id, sounding, self.midi_channel)[1]
+        events = []
+        for step_id in range(self.step_count):
+            step_events, sounding = self.play(step_id, sounding, self.midi_channel)
+            events.extend(step_events)
+        return events